@@ -11,12 +11,50 @@ Usage:
 3. Calculate the correlation matrix:
     correlation_matrix = analysis.correlation_matrix(df)
 
+   Or use the blocked NumPy engine, which works on the numeric columns only and spreads
+   column blocks over a thread pool:
+    correlation_matrix = analysis.correlation_matrix(df, engine="numpy", n_jobs=4)
+
+   Or weight each row, e.g. by population:
+    correlation_matrix = analysis.weighted_correlation_matrix(df, weight_col="TotalPopulation")
+
+   Or build it from chunks, partitions or a saved state:
+    acc = analysis.CorrelationAccumulator.load("path/to/state.npz")
+    correlation_matrix = acc.update(new_chunk).finalize()
+
 4. Save the correlation matrix as a CSV file, if desired:
     correlation_matrix.to_csv("path/to/output.csv", index=False)
 
+   Or in a memory-mappable binary format (see correlation_store.py):
+    correlation_store.save_correlation_matrix(correlation_matrix, "path/to/output.npy", "triu")
+
+5. Or only find the strongest pairs, or each measure's strongest partners, without
+   building the full matrix:
+    edges = analysis.top_correlation_pairs(df, n=100, threshold=0.5)
+    partners = analysis.top_correlation_partners(df, n=10, measures=["Crowding among housing units"])
+
+6. Or calculate one correlation matrix per group, e.g. per ZIP3 prefix, in one pass:
+    corr, groups, labels = analysis.grouped_correlation(
+        df, analysis.zip_prefix(df["ZIP"], digits=3), n_jobs=4
+    )
+    analysis.stack_grouped_correlation(corr, groups, labels).to_csv("path/to/grouped.csv")
+
+7. Add bootstrap confidence intervals and p-values for every pair, if desired:
+    significance = analysis.correlation_bootstrap(df, n_boot=1000, seed=0, n_jobs=4)
+    significance.to_csv("path/to/significance.csv", index=False)
+
 Or run the module from the command line:
     python analysis.py --sdoh_pivoted_file <path_to_sdoh_file> 
-    --correlation_matrix_path <path_to_save_correlation_matrix>
+    [--correlation_matrix_path <path_to_save_correlation_matrix>]
+    [--correlation_format {csv,npy,triu,parquet}]
+    [--corr_engine {pandas,numpy}] [--corr_method {pearson,spearman,kendall}]
+    [--n_jobs <n>] [--block_size <n>] [--float32]
+    [--bootstrap <n> --significance_path <path> [--ci <level>] [--seed <seed>]
+        [--bootstrap_memory_mb <mb>]]
+    [--weighted [--weight_col <column>]] [--state_path <path>]
+    [--top_pairs <n> --top_pairs_path <path>] [--top_partners <n> --top_partners_path <path>]
+    [--top_threshold <r>]
+    [--group_by <column> [--group_zip_digits <n>] --grouped_path <path>]
 
 Example:
     python analysis.py --sdoh_pivoted_file data/df_sdoh_pivoted.pkl 
@@ -27,28 +65,986 @@ Date: 2024-03-17
 """
 
 # Import packages
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from choices import CORRELATION_ENGINES, CORRELATION_METHODS
+
+logger = logging.getLogger(__name__)
+
 
 # Define functions
-def correlation_matrix(df: pd.DataFrame) -> pd.DataFrame:
+def _as_float_matrix(df: pd.DataFrame, dtype=np.float64) -> tuple:
+    """
+    Return the numeric columns of the DataFrame as a 2-D float array and their labels.
+    """
+    numeric = df.select_dtypes(include="number")
+    return numeric.to_numpy(dtype=dtype, na_value=np.nan), numeric.columns
+
+
+def _pearson_dense(x: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """
+    Pearson correlation of the columns of x, which must not contain NaN.
+
+    The whole matrix is a single BLAS matrix product of the centered data. With row
+    weights, the means and the covariance are weighted.
+    """
+    if weights is None:
+        centered = x - x.mean(axis=0)
+        cov = centered.T @ centered
+    else:
+        centered = x - np.average(x, axis=0, weights=weights)
+        cov = (centered * weights[:, None]).T @ centered
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.diag(cov))
+        return cov / np.outer(std, std)
+
+
+def _corr_from_sums(n, sum_i, sum_j, sum_ii, sum_jj, sum_ij) -> np.ndarray:
+    """
+    Pearson correlation from per-pair counts, sums, sums of squares and cross-products.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sum_ij - sum_i * sum_j / n
+        var_i = sum_ii - sum_i * sum_i / n
+        var_j = sum_jj - sum_j * sum_j / n
+        return cov / np.sqrt(var_i * var_j)
+
+
+def _pearson_pairwise_block(
+    x: np.ndarray,
+    mask: np.ndarray,
+    rows: slice,
+    cols: slice,
+    weights: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Pearson correlation of the column blocks x[:, rows] and x[:, cols] over the rows
+    where both columns of each pair are present, as DataFrame.corr does.
+
+    x must have its missing values set to zero and mask must be 1.0 where x is present.
+    Leading batch dimensions are allowed, e.g. a stack of bootstrap resamples. With row
+    weights, every sum is weighted and n becomes the weight total of the pair.
+    """
+    xi, xj = x[..., rows], x[..., cols]
+    mi, mj = mask[..., rows], mask[..., cols]
+    xi_t, mi_t = xi.swapaxes(-1, -2), mi.swapaxes(-1, -2)
+    xii_t = xi_t * xi_t
+    if weights is not None:
+        count = mi_t @ mj
+        xi_t, mi_t, xii_t = xi_t * weights, mi_t * weights, xii_t * weights
+
+    # Per-pair sufficient statistics, each a matrix product over the rows
+    n = mi_t @ mj
+    sum_i = xi_t @ mj
+    sum_j = mi_t @ xj
+    sum_ii = xii_t @ mj
+    sum_jj = mi_t @ (xj * xj)
+    sum_ij = xi_t @ xj
+
+    corr = _corr_from_sums(n, sum_i, sum_j, sum_ii, sum_jj, sum_ij)
+    corr[(n if weights is None else count) < 2] = np.nan
+    return corr
+
+
+def _pearson(
+    x: np.ndarray, n_jobs: int = 1, block_size: int = 256, weights: np.ndarray = None
+) -> np.ndarray:
+    """
+    Pearson correlation matrix of the columns of x with pairwise-complete NaN handling.
+
+    Without NaNs the matrix is one BLAS product. With NaNs the columns are split into
+    blocks and the upper-triangle block pairs are computed on a thread pool (NumPy
+    releases the GIL inside matrix products). Optional row weights give the weighted
+    correlation.
+    """
+    n_cols = x.shape[1]
+    present = ~np.isnan(x)
+    if present.all():
+        corr = _pearson_dense(x, weights)
+    else:
+        # Center on the column means first to limit cancellation in the sums of squares
+        x = np.where(present, x - np.nanmean(x, axis=0), 0).astype(x.dtype, copy=False)
+        mask = present.astype(x.dtype)
+        blocks = [
+            slice(start, min(start + block_size, n_cols))
+            for start in range(0, n_cols, block_size)
+        ]
+        pairs = [(bi, bj) for i, bi in enumerate(blocks) for bj in blocks[i:]]
+
+        corr = np.empty((n_cols, n_cols), dtype=x.dtype)
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+            tiles = executor.map(
+                lambda pair: _pearson_pairwise_block(x, mask, *pair, weights), pairs
+            )
+            for (bi, bj), tile in zip(pairs, tiles):
+                corr[bi, bj] = tile
+                corr[bj, bi] = tile.T
+
+    corr = np.clip(corr, -1, 1)
+    np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1.0))
+    return corr
+
+
+class CorrelationAccumulator:
+    """
+    Streaming Pearson correlation from per-pair sufficient statistics.
+
+    For every pair of numeric columns the accumulator keeps the number of rows where both
+    are present and, over those rows, the sums, sums of squares and cross-products.
+    Chunks can be added with update, partial accumulators (e.g. from parallel workers)
+    combined with merge, and the state saved to disk and loaded later, so new data can
+    be added without re-reading the old inputs. finalize gives the same pairwise-complete
+    result as DataFrame.corr on all the data seen.
+
+    Values are accumulated relative to a per-column shift (the column means of the first
+    chunk) to limit cancellation in the sums of squares.
+
+    Example:
+        acc = CorrelationAccumulator()
+        for chunk in chunks:
+            acc.update(chunk)
+        acc.save("data/correlation_state.npz")
+        correlation_matrix = acc.finalize()
+    """
+
+    def __init__(self):
+        self.labels = None
+        self.shift = None
+        self.n = None
+        self.sums = None
+        self.squares = None
+        self.cross = None
+
+    def _init_state(self, labels, shift):
+        k = len(labels)
+        self.labels = pd.Index(labels)
+        self.shift = np.asarray(shift, dtype=np.float64)
+        self.n = np.zeros((k, k))
+        self.sums = np.zeros((k, k))
+        self.squares = np.zeros((k, k))
+        self.cross = np.zeros((k, k))
+
+    def update(self, chunk: pd.DataFrame) -> "CorrelationAccumulator":
+        """
+        Add the rows of a chunk. The numeric columns must match the earlier chunks.
+
+        Parameters:
+        - chunk (pd.DataFrame): The rows to add.
+
+        Returns:
+        - CorrelationAccumulator: The accumulator itself.
+        """
+        x, labels = _as_float_matrix(chunk)
+        if self.labels is None:
+            self._init_state(labels, np.nan_to_num(np.nanmean(x, axis=0)))
+        elif not self.labels.equals(labels):
+            raise ValueError("Chunk columns do not match the accumulator columns")
+
+        present = ~np.isnan(x)
+        x = np.where(present, x - self.shift, 0)
+        mask = present.astype(np.float64)
+
+        # Element [i, j] of each statistic is over the rows where both i and j are present
+        self.n += mask.T @ mask
+        self.sums += x.T @ mask
+        self.squares += (x * x).T @ mask
+        self.cross += x.T @ x
+        return self
+
+    def merge(self, other: "CorrelationAccumulator") -> "CorrelationAccumulator":
+        """
+        Add the statistics of another accumulator over the same columns.
+
+        Parameters:
+        - other (CorrelationAccumulator): The accumulator to add.
+
+        Returns:
+        - CorrelationAccumulator: The accumulator itself.
+        """
+        if other.labels is None:
+            return self
+        if self.labels is None:
+            self._init_state(other.labels, other.shift)
+        elif not self.labels.equals(other.labels):
+            raise ValueError("Accumulator columns do not match")
+
+        # Re-express the other statistics relative to this shift: x - a = (x - b) + d
+        d = other.shift - self.shift
+        d_i, d_j = d[:, None], d[None, :]
+        sums_i, sums_j = other.sums, other.sums.T
+        self.n += other.n
+        self.sums += sums_i + other.n * d_i
+        self.squares += other.squares + 2 * d_i * sums_i + other.n * d_i**2
+        self.cross += other.cross + d_i * sums_j + d_j * sums_i + other.n * d_i * d_j
+        return self
+
+    def finalize(self) -> pd.DataFrame:
+        """
+        Calculate the correlation matrix of all the rows added so far.
+
+        Returns:
+        - pd.DataFrame: The correlation matrix.
+        """
+        if self.labels is None:
+            return pd.DataFrame()
+        corr = _corr_from_sums(
+            self.n, self.sums, self.sums.T, self.squares, self.squares.T, self.cross
+        )
+        corr[self.n < 2] = np.nan
+        corr = np.clip(corr, -1, 1)
+        np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1.0))
+        return pd.DataFrame(corr, index=self.labels, columns=self.labels)
+
+    def save(self, path: str) -> None:
+        """
+        Save the accumulator state as a NumPy .npz file.
+
+        Parameters:
+        - path (str): The path of the state file.
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                labels=np.asarray(self.labels, dtype=str),
+                shift=self.shift,
+                n=self.n,
+                sums=self.sums,
+                squares=self.squares,
+                cross=self.cross,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "CorrelationAccumulator":
+        """
+        Load an accumulator state saved with save.
+
+        Parameters:
+        - path (str): The path of the state file.
+
+        Returns:
+        - CorrelationAccumulator: The loaded accumulator.
+        """
+        acc = cls()
+        with np.load(path) as state:
+            acc.labels = pd.Index(state["labels"].tolist())
+            for name in ("shift", "n", "sums", "squares", "cross"):
+                setattr(acc, name, state[name])
+        return acc
+
+
+def _count_inversions(y: np.ndarray) -> int:
+    """
+    Count the pairs i < j with y[i] > y[j] using a bottom-up merge sort.
+
+    Each pass merges neighbouring sorted runs of the same width. For every element of a
+    right run, the number of larger elements in its left run is found with one vectorized
+    searchsorted, and the merge itself is a stable sort of two already sorted runs, so
+    each pass is linear and the whole count is O(n log n).
+    """
+    n = len(y)
+    y = y.astype(np.int64)
+    span = int(y.max(initial=0)) + 1
+    position = np.arange(n)
+    inversions = 0
+    width = 1
+    while width < n:
+        block = position // (2 * width)
+        key = block * span + y
+        in_right = (position // width) % 2 == 1
+        left_keys = key[~in_right]
+        right_keys = key[in_right]
+        left_end = np.searchsorted(left_keys, (block[in_right] + 1) * span, "left")
+        not_larger = np.searchsorted(left_keys, right_keys, "right")
+        inversions += int((left_end - not_larger).sum())
+        y = np.sort(key, kind="stable") - block * span
+        width *= 2
+    return inversions
+
+
+def _tied_pairs(codes: np.ndarray) -> int:
+    """
+    Number of pairs of equal values in an array of integer codes.
+    """
+    counts = np.bincount(codes)
+    return int((counts * (counts - 1) // 2).sum())
+
+
+def _kendall_pair(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Kendall tau-b of two integer rank arrays with Knight's O(n log n) algorithm.
+
+    Sorting by x (then y) leaves the discordant pairs as the inversions of y, and the
+    tau-b tie corrections come from the tie counts in x, in y and in both.
+    """
+    n = len(x)
+    if n < 2:
+        return np.nan
+    order = np.lexsort((y, x))
+    x, y = x[order], y[order]
+
+    total = n * (n - 1) // 2
+    ties_x = _tied_pairs(x)
+    ties_y = _tied_pairs(y)
+    joint = np.flatnonzero((np.diff(x) != 0) | (np.diff(y) != 0))
+    run_lengths = np.diff(np.concatenate(([-1], joint, [n - 1])))
+    ties_xy = int((run_lengths * (run_lengths - 1) // 2).sum())
+    discordant = _count_inversions(y)
+
+    denominator = np.sqrt(float(total - ties_x) * float(total - ties_y))
+    if denominator == 0:
+        return np.nan
+    return (total - ties_x - ties_y + ties_xy - 2 * discordant) / denominator
+
+
+def _kendall(x: np.ndarray, n_jobs: int = 1) -> np.ndarray:
+    """
+    Kendall tau-b matrix of the columns of x over pairwise-complete rows.
+
+    Each column is ranked once; each pair of columns is then one O(n log n) pass,
+    and the pairs are spread over a thread pool.
+    """
+    n_cols = x.shape[1]
+    present = ~np.isnan(x)
+    ranks = np.zeros(x.shape, dtype=np.int64)
+    for j in range(n_cols):
+        ranks[present[:, j], j] = pd.factorize(x[present[:, j], j], sort=True)[0]
+
+    def pair_tau(pair):
+        i, j = pair
+        both = present[:, i] & present[:, j]
+        return _kendall_pair(ranks[both, i], ranks[both, j])
+
+    # Like DataFrame.corr, the diagonal is 1 for every column with any values
+    pairs = [(i, j) for i in range(n_cols) for j in range(i + 1, n_cols)]
+    corr = np.diag(np.where(present.any(axis=0), 1.0, np.nan))
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        for (i, j), tau in zip(pairs, executor.map(pair_tau, pairs)):
+            corr[i, j] = corr[j, i] = tau
+    return corr
+
+
+def _bootstrap_batch(
+    x: np.ndarray, mask: np.ndarray, n_resamples: int, seed: np.random.SeedSequence
+) -> np.ndarray:
+    """
+    Pearson correlation matrices of n_resamples bootstrap resamples of the rows of x.
+
+    The resamples are stacked into one (n_resamples, rows, columns) array so every
+    correlation matrix of the batch comes from the same batched matrix products.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, x.shape[0], size=(n_resamples, x.shape[0]))
+    every_column = slice(None)
+    return _pearson_pairwise_block(x[rows], mask[rows], every_column, every_column)
+
+
+def _keep_smallest(tail: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """
+    Keeps the size smallest values of every cell along the first axis of tail and values.
+    """
+    values = np.concatenate([tail, values])
+    if values.shape[0] > size:
+        values = np.partition(values, size - 1, axis=0)[:size]
+    return values
+
+
+def _tail_quantile(tail: np.ndarray, valid: np.ndarray, q: float) -> np.ndarray:
+    """
+    The q-quantile of every cell, interpolated linearly as np.nanquantile does, from the
+    smallest values of the cell (missing values stored as +inf) and the number of values
+    that are not missing. The tail must hold at least floor(q * (valid - 1)) + 2 values.
+    """
+    tail = np.sort(tail, axis=0)
+    position = q * (valid - 1)
+    below = np.clip(np.floor(position).astype(np.int64), 0, tail.shape[0] - 1)
+    above = np.minimum(below + 1, tail.shape[0] - 1)
+    fraction = position - below
+    low = np.take_along_axis(tail, below[None], axis=0)[0]
+    high = np.take_along_axis(tail, above[None], axis=0)[0]
+    with np.errstate(invalid="ignore"):
+        quantile = np.where(fraction > 0, low + fraction * (high - low), low)
+    quantile[valid == 0] = np.nan
+    return quantile
+
+
+def correlation_bootstrap(
+    df: pd.DataFrame,
+    n_boot: int = 1000,
+    ci: float = 0.95,
+    seed: int = None,
+    n_jobs: int = 1,
+    batch_memory_mb: int = 256,
+    dtype=np.float64,
+) -> pd.DataFrame:
+    """
+    Calculate Pearson correlations with bootstrap confidence intervals and p-values.
+
+    Bootstrap resamples are drawn in batches sized to fit batch_memory_mb; each batch
+    computes all of its correlation matrices with stacked matrix products, and batches
+    run on a thread pool. Every batch gets its own child of the seed, so results do not
+    depend on n_jobs. Missing values are handled pairwise, as in DataFrame.corr.
+
+    At most n_jobs batches are held at once. Of each batch only the lowest and highest
+    (1 - ci) / 2 of every pair's resampled correlations are kept, which is all the
+    percentile intervals need, so besides the batches memory holds about
+    (1 - ci) * n_boot correlation matrices instead of all n_boot of them.
+
+    P-values are two-sided tests of zero correlation using the Fisher z-transformation,
+    z = atanh(r) * sqrt(n - 3), where n is the number of complete rows of the pair.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame; only its numeric columns are used.
+    - n_boot (int, optional): Number of bootstrap resamples. Default is 1000.
+    - ci (float, optional): Confidence level of the percentile intervals. Default is 0.95.
+    - seed (int, optional): Seed for the resampling. Default is None.
+    - n_jobs (int, optional): Number of threads running batches. Default is 1.
+    - batch_memory_mb (int, optional): Approximate memory budget per batch of resamples.
+        Default is 256.
+    - dtype (optional): np.float64 or np.float32. Default is np.float64.
+
+    Returns:
+    - pd.DataFrame: One row per pair of columns with the columns measure_1, measure_2,
+        n, estimate, lower, upper and p_value.
+    """
+    x, labels = _as_float_matrix(df, dtype)
+    n_rows, n_cols = x.shape
+    present = ~np.isnan(x)
+    x = np.where(present, x - np.nanmean(x, axis=0), 0).astype(dtype, copy=False)
+    mask = present.astype(dtype)
+
+    estimate = _pearson_pairwise_block(x, mask, slice(None), slice(None))
+    counts = mask.T @ mask
+
+    # Each resample holds x, mask and their squares, and six per-pair sums; leave room
+    # for the products too
+    bytes_per_resample = (6 * n_rows + 8 * n_cols) * n_cols * np.dtype(dtype).itemsize
+    batch = max(1, min(n_boot, batch_memory_mb * 2**20 // bytes_per_resample))
+    sizes = [min(batch, n_boot - start) for start in range(0, n_boot, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = list(zip(sizes, seeds))
+
+    # The percentile intervals only need the tails of each pair's resampled correlations
+    alpha = (1 - ci) / 2
+    tail_size = int(math.floor(alpha * (n_boot - 1))) + 2
+    lowest = np.empty((0, n_cols, n_cols), dtype=dtype)
+    highest = np.empty((0, n_cols, n_cols), dtype=dtype)
+    valid = np.zeros((n_cols, n_cols), dtype=np.int64)
+    workers = max(1, n_jobs)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(jobs), workers):
+            for boots in executor.map(
+                lambda args: _bootstrap_batch(x, mask, *args),
+                jobs[start : start + workers],
+            ):
+                missing = np.isnan(boots)
+                valid += (~missing).sum(axis=0)
+                # Missing resamples sort last in both tails; the highest are negated
+                lowest = _keep_smallest(
+                    lowest, np.where(missing, np.inf, boots), tail_size
+                )
+                highest = _keep_smallest(
+                    highest, np.where(missing, np.inf, -boots), tail_size
+                )
+    lower = _tail_quantile(lowest, valid, alpha)
+    upper = -_tail_quantile(highest, valid, alpha)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.abs(np.arctanh(np.clip(estimate, -1, 1))) * np.sqrt(counts - 3)
+    p_value = np.vectorize(math.erfc, otypes=[float])(z / math.sqrt(2))
+    p_value[~np.isfinite(estimate) | (counts <= 3)] = np.nan
+
+    i, j = np.triu_indices(n_cols, 1)
+    significance = pd.DataFrame(
+        {
+            "measure_1": labels[i],
+            "measure_2": labels[j],
+            "n": counts[i, j].astype(np.int64),
+            "estimate": estimate[i, j],
+            "lower": lower[i, j],
+            "upper": upper[i, j],
+            "p_value": p_value[i, j],
+        }
+    )
+    logger.info("Correlation bootstrap calculated successfully")
+    return significance
+
+
+def weighted_correlation_matrix(
+    df: pd.DataFrame,
+    weight_col: str = "TotalPopulation",
+    n_jobs: int = 1,
+    block_size: int = 256,
+    dtype=np.float64,
+) -> pd.DataFrame:
+    """
+    Calculate the weighted Pearson correlation matrix, e.g. weighting each ZCTA by its
+    population so that small ZCTAs do not count as much as large ones.
+
+    Weighted means, covariances and correlations come from the same matrix products as
+    the numpy engine of correlation_matrix, so missing values are handled pairwise.
+    Rows with a missing or negative weight are dropped. With equal weights the result
+    matches DataFrame.corr.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame; its numeric columns other than the weight are used.
+    - weight_col (str, optional): The column holding the row weights.
+        Default is "TotalPopulation".
+    - n_jobs (int, optional): Number of threads for the blocked NaN path. Default is 1.
+    - block_size (int, optional): Number of columns per block. Default is 256.
+    - dtype (optional): np.float64 or np.float32. Default is np.float64.
+
+    Returns:
+    - pd.DataFrame: The weighted correlation matrix.
+    """
+    weights = df[weight_col].to_numpy(dtype=dtype, na_value=np.nan)
+    valid = weights >= 0
+    x, labels = _as_float_matrix(df.loc[valid].drop(columns=weight_col), dtype)
+
+    correlation_matrix = pd.DataFrame(
+        _pearson(x, n_jobs, block_size, weights[valid]), index=labels, columns=labels
+    )
+    logger.info("Weighted correlation matrix calculated successfully")
+    return correlation_matrix
+
+
+def correlation_matrix(
+    df: pd.DataFrame,
+    engine: str = "pandas",
+    n_jobs: int = 1,
+    block_size: int = 256,
+    dtype=np.float64,
+    method: str = "pearson",
+) -> pd.DataFrame:
     """
     Calculate the correlation matrix for the DataFrame.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame for which to calculate the correlation matrix.
+    - engine (str, optional): "pandas" calls DataFrame.corr. "numpy" works on the numeric
+        columns as a float matrix: a single BLAS product when there are no NaNs, and a
+        blocked, pairwise-complete computation (the same NaN semantics as DataFrame.corr)
+        when there are. The two engines agree to within 1e-10 in float64 and 1e-4 in
+        float32. Default is "pandas".
+    - n_jobs (int, optional): Number of threads for the blocked NaN path. Default is 1.
+    - block_size (int, optional): Number of columns per block. Default is 256.
+    - dtype (optional): np.float64 or np.float32 for the numpy engine. Default is np.float64.
+    - method (str, optional): "pearson", "spearman" or "kendall". With the numpy engine,
+        Spearman ranks each column once and reuses the Pearson engine. Kendall tau-b uses
+        Knight's O(n log n) algorithm with tie corrections with either engine, since
+        DataFrame.corr needs scipy for it. When there are NaNs, the numpy Spearman ranks
+        each column over all of its present values, whereas DataFrame.corr re-ranks every
+        pair. Default is "pearson".
 
     Returns:
     - pd.DataFrame: The correlation matrix.
     """
-    correlation_matrix = df.corr()
-    print("\nCorrelation matrix calculated successfully\n")
+    if engine not in CORRELATION_ENGINES:
+        raise ValueError(f"engine must be one of {CORRELATION_ENGINES}, got {engine!r}")
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"method must be one of {CORRELATION_METHODS}, got {method!r}")
+
+    if engine == "pandas" and method != "kendall":
+        correlation_matrix = df.corr(method=method)
+    else:
+        x, labels = _as_float_matrix(df, dtype)
+        if method == "kendall":
+            corr = _kendall(x, n_jobs)
+        else:
+            if method == "spearman":
+                x = pd.DataFrame(x).rank().to_numpy(dtype=dtype)
+            corr = _pearson(x, n_jobs, block_size)
+        correlation_matrix = pd.DataFrame(corr, index=labels, columns=labels)
+    logger.info("Correlation matrix calculated successfully")
     return correlation_matrix
 
 
+def _correlation_tiles(
+    x: np.ndarray, rows: np.ndarray = None, block_size: int = 256, n_jobs: int = 1
+):
+    """
+    Yields (row positions, column positions, tile) Pearson correlation tiles of the
+    columns of x, one block of columns at a time.
+
+    Without rows, the tiles cover the upper triangle of the matrix (diagonal blocks
+    included). With rows, they cover those columns against every column. The tiles of
+    one row block are computed on a thread pool; only they are held in memory at once.
+    """
+    n_cols = x.shape[1]
+    present = ~np.isnan(x)
+    dense = present.all()
+    if dense:
+        # Unit-length centered columns: a tile is one matrix product
+        z = x - x.mean(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = z / np.sqrt((z * z).sum(axis=0))
+    else:
+        z = np.where(present, x - np.nanmean(x, axis=0), 0).astype(x.dtype, copy=False)
+        mask = present.astype(x.dtype)
+
+    def tile(pair):
+        bi, bj = pair
+        if dense:
+            corr = z[:, bi].T @ z[:, bj]
+        else:
+            corr = _pearson_pairwise_block(z, mask, bi, bj)
+        return np.clip(corr, -1, 1)
+
+    starts = range(0, n_cols, block_size)
+    blocks = [np.arange(start, min(start + block_size, n_cols)) for start in starts]
+    if rows is None:
+        row_blocks = blocks
+    else:
+        row_blocks = [rows[i : i + block_size] for i in range(0, len(rows), block_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        for i, bi in enumerate(row_blocks):
+            col_blocks = blocks[i:] if rows is None else blocks
+            pairs = [(bi, bj) for bj in col_blocks]
+            for (bi, bj), corr in zip(pairs, executor.map(tile, pairs)):
+                yield bi, bj, corr
+
+
+def _keep_strongest(scores, *columns, n: int):
+    """
+    Keeps the n highest scores along the last axis (a bounded heap, vectorized), along
+    with the matching entries of the other arrays.
+    """
+    if scores.shape[-1] <= n:
+        return (scores, *columns)
+    top = np.argpartition(-scores, n - 1, axis=-1)[..., :n]
+    return tuple(np.take_along_axis(a, top, axis=-1) for a in (scores, *columns))
+
+
+def _ranked_input(df: pd.DataFrame, method: str, dtype) -> tuple:
+    """
+    Returns the numeric columns as a float matrix, ranked for Spearman.
+    """
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"method must be 'pearson' or 'spearman', got {method!r}")
+    x, labels = _as_float_matrix(df, dtype)
+    if method == "spearman":
+        x = pd.DataFrame(x).rank().to_numpy(dtype=dtype)
+    return x, labels
+
+
+def top_correlation_pairs(
+    df: pd.DataFrame,
+    n: int = 100,
+    threshold: float = 0.0,
+    method: str = "pearson",
+    block_size: int = 256,
+    n_jobs: int = 1,
+    dtype=np.float64,
+) -> pd.DataFrame:
+    """
+    Finds the n most strongly correlated pairs of measures without building the full
+    correlation matrix.
+
+    The upper triangle is computed one block of columns at a time and only the n
+    strongest pairs seen so far are kept, so memory is O(n + block_size * columns)
+    instead of O(columns^2). NaNs are handled pairwise, as in correlation_matrix.
+
+    Parameters:
+    - df (pd.DataFrame): The pivoted DataFrame; only numeric columns are used.
+    - n (int, optional): The number of pairs to return. Default is 100.
+    - threshold (float, optional): Only pairs with |r| >= threshold are returned.
+        Default is 0.0.
+    - method (str, optional): "pearson" or "spearman". Default is "pearson".
+    - block_size (int, optional): Number of columns per block. Default is 256.
+    - n_jobs (int, optional): Number of threads computing the blocks. Default is 1.
+    - dtype (optional): np.float64 or np.float32. Default is np.float64.
+
+    Returns:
+    - pd.DataFrame: An edge list with the columns measure_1, measure_2 and correlation,
+        strongest |r| first.
+    """
+    x, labels = _ranked_input(df, method, dtype)
+    scores, values = np.full(0, -np.inf), np.zeros(0)
+    pair_i = pair_j = np.zeros(0, dtype=np.int64)
+
+    for bi, bj, corr in _correlation_tiles(x, None, block_size, n_jobs):
+        i, j = np.meshgrid(bi, bj, indexing="ij")
+        # Each pair once: diagonal blocks keep only their upper triangle
+        keep = (i < j) & (np.abs(corr) >= threshold)
+        scores, values, pair_i, pair_j = _keep_strongest(
+            np.concatenate([scores, np.abs(corr[keep])]),
+            np.concatenate([values, corr[keep]]),
+            np.concatenate([pair_i, i[keep]]),
+            np.concatenate([pair_j, j[keep]]),
+            n=n,
+        )
+
+    order = np.argsort(-scores, kind="stable")
+    edges = pd.DataFrame(
+        {
+            "measure_1": labels[pair_i[order]],
+            "measure_2": labels[pair_j[order]],
+            "correlation": values[order],
+        }
+    )
+    logger.info("Top %d correlation pairs calculated successfully", len(edges))
+    return edges
+
+
+def top_correlation_partners(
+    df: pd.DataFrame,
+    n: int = 10,
+    measures: list = None,
+    threshold: float = 0.0,
+    method: str = "pearson",
+    block_size: int = 256,
+    n_jobs: int = 1,
+    dtype=np.float64,
+) -> pd.DataFrame:
+    """
+    Finds the n most strongly correlated partners of each measure without building the
+    full correlation matrix.
+
+    One block of measures is correlated with every measure at a time, and each measure
+    keeps only its n strongest partners, so memory is O(measures * n) plus one block.
+
+    Parameters:
+    - df (pd.DataFrame): The pivoted DataFrame; only numeric columns are used.
+    - n (int, optional): The number of partners per measure. Default is 10.
+    - measures (list, optional): The measures to find partners for. Default is None
+        (every numeric column).
+    - threshold (float, optional): Only partners with |r| >= threshold are returned.
+        Default is 0.0.
+    - method (str, optional): "pearson" or "spearman". Default is "pearson".
+    - block_size (int, optional): Number of columns per block. Default is 256.
+    - n_jobs (int, optional): Number of threads computing the blocks. Default is 1.
+    - dtype (optional): np.float64 or np.float32. Default is np.float64.
+
+    Returns:
+    - pd.DataFrame: An edge list with the columns measure, partner, correlation and
+        rank (1 for the strongest partner).
+    """
+    x, labels = _ranked_input(df, method, dtype)
+    if measures is None:
+        rows = np.arange(len(labels))
+    else:
+        rows = labels.get_indexer(measures)
+        if (rows < 0).any():
+            missing = [m for m, r in zip(measures, rows) if r < 0]
+            raise KeyError(f"Measures not found: {missing}")
+    position = {row: k for k, row in enumerate(rows)}
+    scores = np.full((len(rows), 0), -np.inf)
+    values = np.zeros((len(rows), 0))
+    partners = np.zeros((len(rows), 0), dtype=np.int64)
+
+    for bi, bj, corr in _correlation_tiles(x, rows, block_size, n_jobs):
+        k = [position[row] for row in bi]
+        tile_scores = np.abs(corr)
+        # A measure is not its own partner
+        tile_scores[(bi[:, None] == bj[None, :]) | ~(tile_scores >= threshold)] = (
+            -np.inf
+        )
+        new_scores, new_values, new_partners = _keep_strongest(
+            np.concatenate([scores[k], tile_scores], axis=1),
+            np.concatenate([values[k], corr], axis=1),
+            np.concatenate(
+                [partners[k], np.broadcast_to(bj, tile_scores.shape)], axis=1
+            ),
+            n=n,
+        )
+        if new_scores.shape[1] > scores.shape[1]:
+            # The first blocks grow the per-measure heaps up to n entries
+            pad = new_scores.shape[1] - scores.shape[1]
+            scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            values = np.pad(values, ((0, 0), (0, pad)))
+            partners = np.pad(partners, ((0, 0), (0, pad)))
+        scores[k], values[k], partners[k] = new_scores, new_values, new_partners
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+    scores = np.take_along_axis(scores, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    partners = np.take_along_axis(partners, order, axis=1)
+    found = np.isfinite(scores)
+    edges = pd.DataFrame(
+        {
+            "measure": labels[np.broadcast_to(rows[:, None], scores.shape)[found]],
+            "partner": labels[partners[found]],
+            "correlation": values[found],
+            "rank": np.broadcast_to(np.arange(1, scores.shape[1] + 1), scores.shape)[
+                found
+            ],
+        }
+    )
+    logger.info("Top correlation partners calculated successfully")
+    return edges
+
+
+def zip_prefix(zips: pd.Series, digits: int = 3) -> pd.Series:
+    """
+    Returns the first digits of each ZIP code, e.g. to group ZCTAs by ZIP3 area.
+
+    ZIP codes parsed as numbers lose their leading zeros, so they are zero-padded to five
+    digits first.
+
+    Parameters:
+    - zips (pd.Series): The ZIP codes, as numbers or strings.
+    - digits (int, optional): The number of leading digits to keep. Default is 3.
+
+    Returns:
+    - pd.Series: The prefixes as strings, missing where the ZIP code is missing.
+    """
+    if pd.api.types.is_numeric_dtype(zips):
+        zips = zips.astype("Int64")
+    return zips.astype("string").str.zfill(5).str[:digits]
+
+
+def _grouped_batch(
+    x: np.ndarray,
+    starts: np.ndarray,
+    sizes: np.ndarray,
+    batch: np.ndarray,
+    max_rows: int,
+) -> np.ndarray:
+    """
+    Pearson correlation matrices of a batch of groups, from one stacked matrix product.
+
+    The rows of each group (x is sorted by group; a group's rows start at starts[group])
+    are copied into a zero-padded (groups, max_rows, columns) array with a matching
+    presence mask, so padding and missing values add nothing to the per-pair statistics.
+    """
+    counts = sizes[batch]
+    group = np.repeat(np.arange(len(batch)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = starts[batch][group] + position
+
+    stacked = np.full((len(batch), max_rows, x.shape[1]), np.nan, dtype=x.dtype)
+    stacked[group, position] = x[rows]
+    present = ~np.isnan(stacked)
+    # Center each group on its own column means to limit cancellation
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(stacked, axis=1) / present.sum(axis=1)
+    z = np.where(present, stacked - means[:, None, :], 0).astype(x.dtype, copy=False)
+    mask = present.astype(x.dtype)
+
+    all_cols = slice(None)
+    corr = np.clip(_pearson_pairwise_block(z, mask, all_cols, all_cols), -1, 1)
+    diagonal = np.arange(x.shape[1])
+    corr[:, diagonal, diagonal] = np.where(
+        np.isnan(corr[:, diagonal, diagonal]), np.nan, 1.0
+    )
+    return corr
+
+
+def grouped_correlation(
+    df: pd.DataFrame,
+    by,
+    method: str = "pearson",
+    n_jobs: int = 1,
+    max_cells: int = 2**22,
+    dtype=np.float64,
+) -> tuple:
+    """
+    Calculates one correlation matrix per group (e.g. per state or ZIP3 prefix) in one
+    grouped pass, instead of filtering and correlating each group separately.
+
+    The group keys are factorized and the rows sorted by group once. Groups of similar
+    size are then stacked into zero-padded 3-D batches, and each batch's per-pair
+    statistics are one batched matrix product, so every Pearson matrix has the
+    pairwise-complete semantics of DataFrame.corr. The batches are computed on a thread
+    pool. When there are NaNs, Spearman ranks each column over all of its present values
+    in the group, whereas DataFrame.corr re-ranks every pair.
+
+    Parameters:
+    - df (pd.DataFrame): The pivoted DataFrame; its numeric columns are correlated.
+    - by: The group key: a column name (left out of the correlated columns), or a Series
+        or array with one key per row, e.g. zip_prefix(df["ZIP"]). Rows with a missing
+        key are dropped.
+    - method (str, optional): "pearson" or "spearman" (ranked within each group).
+        Default is "pearson".
+    - n_jobs (int, optional): Number of threads computing the batches. Default is 1.
+    - max_cells (int, optional): The maximum number of values in one padded batch of
+        rows, or in one of its stacks of per-group correlation statistics. Default is
+        2**22.
+    - dtype (optional): np.float64 or np.float32. Default is np.float64.
+
+    Returns:
+    - tuple: (correlations, groups, labels), where correlations is a
+        (groups, measures, measures) array, groups a pd.Index of the sorted group keys
+        and labels a pd.Index of the measures.
+    """
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"method must be 'pearson' or 'spearman', got {method!r}")
+    if isinstance(by, str):
+        key, df = df[by], df.drop(columns=by)
+    else:
+        key = by
+    codes, groups = pd.factorize(np.asarray(key), sort=True)
+    x, labels = _as_float_matrix(df, dtype)
+    if method == "spearman":
+        x = pd.DataFrame(x).groupby(codes).rank().to_numpy(dtype=dtype)
+
+    # Sort the rows by group once; factorize gives missing keys the code -1
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    x, codes = x[order], codes[order]
+    sizes = np.bincount(codes, minlength=len(groups))
+    starts = np.cumsum(sizes) - sizes
+
+    # Batch groups of similar size (the same power of two) to bound the padding
+    batches = []
+    buckets = np.ceil(np.log2(np.maximum(sizes, 1))).astype(np.int64)
+    for bucket in np.unique(buckets):
+        members = np.flatnonzero(buckets == bucket)
+        max_rows = int(sizes[members].max())
+        # Both the padded rows and the per-pair sums of a batch must fit in max_cells
+        per_batch = max(1, max_cells // max(max(max_rows, x.shape[1]) * x.shape[1], 1))
+        for start in range(0, len(members), per_batch):
+            batches.append((members[start : start + per_batch], max_rows))
+
+    corr = np.full((len(groups), len(labels), len(labels)), np.nan, dtype=dtype)
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        results = executor.map(
+            lambda batch: _grouped_batch(x, starts, sizes, *batch), batches
+        )
+        for (members, _), batch_corr in zip(batches, results):
+            corr[members] = batch_corr
+
+    logger.info(
+        "Correlation matrices of %d groups calculated successfully", len(groups)
+    )
+    return corr, pd.Index(groups), labels
+
+
+def stack_grouped_correlation(
+    corr: np.ndarray, groups: pd.Index, labels: pd.Index
+) -> pd.DataFrame:
+    """
+    Flattens the output of grouped_correlation into one DataFrame, e.g. to save it.
+
+    Parameters:
+    - corr (np.ndarray): The (groups, measures, measures) correlations.
+    - groups (pd.Index): The group keys.
+    - labels (pd.Index): The measures.
+
+    Returns:
+    - pd.DataFrame: One row per group and measure, indexed by (group, measure), with one
+        column per measure.
+    """
+    index = pd.MultiIndex.from_product([groups, labels], names=["group", "measure"])
+    return pd.DataFrame(
+        corr.reshape(len(groups) * len(labels), len(labels)),
+        index=index,
+        columns=labels,
+    )
+
+
 # Add the following code to the bottom of the module to allow running it from the command line:
 if __name__ == "__main__":
     import argparse
+    import os
+
+    from correlation_store import CORRELATION_FORMATS, save_correlation_matrix
+    from profiling import configure_logging
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -56,11 +1052,213 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--correlation_matrix_path",
-        help="Path to save the correlation matrix as a CSV file",
+        help="Path to save the correlation matrix; without it the full matrix is not "
+        "calculated",
+    )
+    parser.add_argument(
+        "--correlation_format",
+        help="Correlation matrix file format: csv, npy (full matrix), triu "
+        "(packed upper triangle) or parquet",
+        choices=CORRELATION_FORMATS,
+        default="csv",
+    )
+    parser.add_argument(
+        "--corr_engine",
+        help="Correlation engine: pandas (DataFrame.corr) or numpy (blocked BLAS)",
+        choices=CORRELATION_ENGINES,
+        default="pandas",
+    )
+    parser.add_argument(
+        "--corr_method",
+        help="Correlation method: pearson, spearman or kendall",
+        choices=CORRELATION_METHODS,
+        default="pearson",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        help="Number of threads for the numpy correlation engine",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--block_size",
+        help="Number of columns per block for the numpy correlation engine",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--float32",
+        help="Compute the numpy engine correlation in float32 instead of float64",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        help="Number of bootstrap resamples for confidence intervals and p-values of "
+        "the unweighted Pearson correlation",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--significance_path",
+        help="Path to save the estimates, confidence bounds and p-values as a CSV file",
+    )
+    parser.add_argument(
+        "--ci",
+        help="Confidence level of the bootstrap intervals",
+        type=float,
+        default=0.95,
+    )
+    parser.add_argument("--seed", help="Seed for the bootstrap resampling", type=int)
+    parser.add_argument(
+        "--bootstrap_memory_mb",
+        help="Approximate memory budget of each batch of bootstrap resamples",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--weighted",
+        help="Calculate the Pearson correlation weighted by --weight_col",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--weight_col",
+        help="Column holding the row weights for --weighted",
+        default="TotalPopulation",
+    )
+    parser.add_argument(
+        "--state_path",
+        help="Accumulator state (.npz) to add the data to; created if it does not exist",
+    )
+    parser.add_argument(
+        "--top_pairs",
+        help="Number of most strongly correlated pairs to save to --top_pairs_path",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--top_pairs_path",
+        help="Path to save the strongest pairs as a CSV edge list",
+    )
+    parser.add_argument(
+        "--top_partners",
+        help="Number of strongest partners per measure to save to --top_partners_path",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--top_partners_path",
+        help="Path to save the strongest partners as a CSV edge list",
+    )
+    parser.add_argument(
+        "--top_threshold",
+        help="Minimum absolute correlation for --top_pairs and --top_partners",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--group_by",
+        help="Column to group by for one correlation matrix per group",
+    )
+    parser.add_argument(
+        "--group_zip_digits",
+        help="Group by the first digits of the --group_by ZIP column instead",
+        type=int,
+    )
+    parser.add_argument(
+        "--grouped_path",
+        help="Path to save the per-group correlation matrices as a stacked CSV file",
     )
     args = parser.parse_args()
+    if args.bootstrap > 0 and args.significance_path is None:
+        parser.error("--bootstrap needs --significance_path")
+    if args.bootstrap > 0 and (args.weighted or args.corr_method != "pearson"):
+        parser.error("--bootstrap supports the unweighted pearson correlation only")
+    if args.top_pairs > 0 and args.top_pairs_path is None:
+        parser.error("--top_pairs needs --top_pairs_path")
+    if args.top_partners > 0 and args.top_partners_path is None:
+        parser.error("--top_partners needs --top_partners_path")
+    if (args.top_pairs > 0 or args.top_partners > 0) and args.corr_method == "kendall":
+        parser.error("--top_pairs and --top_partners support pearson and spearman only")
+    if args.group_by is not None and args.grouped_path is None:
+        parser.error("--group_by needs --grouped_path")
+    if args.group_by is not None and args.corr_method == "kendall":
+        parser.error("--group_by supports pearson and spearman only")
+    configure_logging()
 
     df_sdoh_pivoted = pd.read_pickle(args.sdoh_pivoted_file)
-    correlation_matrix(df_sdoh_pivoted).to_csv(
-        args.correlation_matrix_path, index=False
-    )
+    if args.state_path is not None:
+        # Add the new rows to the saved statistics instead of re-reading old inputs
+        if os.path.exists(args.state_path):
+            accumulator = CorrelationAccumulator.load(args.state_path)
+        else:
+            accumulator = CorrelationAccumulator()
+        accumulator.update(df_sdoh_pivoted).save(args.state_path)
+
+    # The full matrix is only built when it is saved, e.g. not for the top-k queries alone
+    if args.correlation_matrix_path is not None:
+        if args.state_path is not None:
+            df_correlation = accumulator.finalize()
+        elif args.weighted:
+            df_correlation = weighted_correlation_matrix(
+                df_sdoh_pivoted,
+                weight_col=args.weight_col,
+                n_jobs=args.n_jobs,
+                block_size=args.block_size,
+                dtype=np.float32 if args.float32 else np.float64,
+            )
+        else:
+            df_correlation = correlation_matrix(
+                df_sdoh_pivoted,
+                engine=args.corr_engine,
+                n_jobs=args.n_jobs,
+                block_size=args.block_size,
+                dtype=np.float32 if args.float32 else np.float64,
+                method=args.corr_method,
+            )
+        save_correlation_matrix(
+            df_correlation, args.correlation_matrix_path, fmt=args.correlation_format
+        )
+
+    # The top-k queries stream over column blocks instead of using the full matrix
+    top_options = {
+        "threshold": args.top_threshold,
+        "method": args.corr_method,
+        "block_size": args.block_size,
+        "n_jobs": args.n_jobs,
+        "dtype": np.float32 if args.float32 else np.float64,
+    }
+    if args.top_pairs > 0:
+        top_correlation_pairs(df_sdoh_pivoted, n=args.top_pairs, **top_options).to_csv(
+            args.top_pairs_path, index=False
+        )
+    if args.top_partners > 0:
+        top_correlation_partners(
+            df_sdoh_pivoted, n=args.top_partners, **top_options
+        ).to_csv(args.top_partners_path, index=False)
+
+    if args.group_by is not None:
+        group_key = args.group_by
+        if args.group_zip_digits is not None:
+            group_key = zip_prefix(
+                df_sdoh_pivoted[args.group_by], digits=args.group_zip_digits
+            )
+        stack_grouped_correlation(
+            *grouped_correlation(
+                df_sdoh_pivoted,
+                group_key,
+                method=args.corr_method,
+                n_jobs=args.n_jobs,
+                dtype=np.float32 if args.float32 else np.float64,
+            )
+        ).to_csv(args.grouped_path)
+
+    if args.bootstrap > 0:
+        correlation_bootstrap(
+            df_sdoh_pivoted,
+            n_boot=args.bootstrap,
+            ci=args.ci,
+            seed=args.seed,
+            n_jobs=args.n_jobs,
+            batch_memory_mb=args.bootstrap_memory_mb,
+            dtype=np.float32 if args.float32 else np.float64,
+        ).to_csv(args.significance_path, index=False)
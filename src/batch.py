@@ -0,0 +1,287 @@
+"""
+This module runs the load, clean and pivot steps over many input files in parallel.
+
+Each input file (e.g. a yearly ACS vintage or a per-state extract) is loaded, cleaned
+and pivoted in its own worker process. The partial results are then combined, either
+into one pivoted DataFrame or into per-file outputs plus a combined correlation matrix
+built from the workers' CorrelationAccumulator statistics.
+
+Functions:
+- expand_inputs(patterns, manifest): Expands glob patterns and a manifest file into a
+    sorted list of input files.
+- load_and_pivot_file(file_path, options): Loads, cleans and pivots one CSV file.
+- run_batch(file_paths, options, n_workers, max_memory_mb, output_dir): Runs
+    load_and_pivot_file over the files on a process pool and combines the results.
+
+Usage:
+1. Import the module:
+    import batch
+
+2. List the input files:
+    files = batch.expand_inputs(["data/SDOH_*.csv"])
+
+3. Run the batch and combine the pivoted frames:
+    df_pivoted, _ = batch.run_batch(files, options, n_workers=4, max_memory_mb=4096)
+
+4. Or write per-file outputs and only combine the correlation statistics:
+    _, accumulator = batch.run_batch(files, options, output_dir="data/batch")
+    correlation_matrix = accumulator.finalize()
+
+The options dictionary holds the keyword arguments of load_and_pivot_file, e.g.:
+    options = {
+        "keep_columns": ["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        "rename_columns": {"LocationName": "ZIP"},
+        "index_col": ["ZIP", "TotalPopulation"],
+        "columns_col": ["Measure"],
+        "values_col": ["Data_Value"],
+    }
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import cleaner
+from analysis import CorrelationAccumulator
+from cache import cache_key, cached_frame
+from loader import load_csv_file
+from profiling import StageProfiler
+
+logger = logging.getLogger(__name__)
+
+
+# Define functions
+def expand_inputs(patterns: list = None, manifest: str = None) -> list:
+    """
+    Expands glob patterns and a manifest file into a sorted list of input files.
+
+    Parameters:
+    - patterns (list, optional): File paths or glob patterns. Default is None.
+    - manifest (str, optional): A text file with one path or pattern per line. Blank
+        lines and lines starting with "#" are ignored. Default is None.
+
+    Returns:
+    - list: The unique matching file paths, sorted.
+    """
+    patterns = list(patterns or [])
+    if manifest is not None:
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    patterns.append(line)
+
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if not matches:
+            raise FileNotFoundError(f"No input files match {pattern!r}")
+        files.update(matches)
+    return sorted(files)
+
+
+def load_and_pivot_file(
+    file_path: str,
+    keep_columns: list,
+    rename_columns: dict,
+    index_col: list,
+    columns_col: list,
+    values_col: list,
+    chunksize: int = None,
+    cache_dir: str = None,
+    optimize: bool = False,
+    pivot_engine: str = "pandas",
+    pivot_aggfunc: str = "first",
+    profiler: StageProfiler = None,
+    cache_max_mb: float = None,
+) -> pd.DataFrame:
+    """
+    Loads, cleans and pivots one CSV file.
+
+    Parameters:
+    - file_path (str): The path to the CSV file.
+    - keep_columns (list): The columns to read and keep.
+    - rename_columns (dict): The columns to rename.
+    - index_col (list): The column(s) to be used as the index for the pivoted DataFrame.
+    - columns_col (list): The column(s) to be used as the columns for the pivoted DataFrame.
+    - values_col (list): The column(s) to be used as the values for the pivoted DataFrame.
+    - chunksize (int, optional): Number of rows to read at a time. Default is None.
+    - cache_dir (str, optional): Directory for the result cache. If given, the cleaned
+        (loaded, kept and renamed) frame is cached, so only the pivot runs again when
+        just the pivot options change. Default is None.
+    - optimize (bool, optional): Shrink column dtypes after loading. Default is False.
+    - pivot_engine (str, optional): "pandas" or "numpy". Default is "pandas".
+    - pivot_aggfunc (str, optional): How the numpy engine combines duplicates.
+        Default is "first".
+    - profiler (StageProfiler, optional): Records the load, keep_columns, rename_columns
+        and pivot stages. Default is None (not profiled).
+    - cache_max_mb (float, optional): Size limit of the result cache; the least recently
+        used entries are evicted beyond it. Default is None (unbounded).
+
+    Returns:
+    - pd.DataFrame: The pivoted DataFrame.
+    """
+    profiler = profiler or StageProfiler(enabled=False)
+
+    def load_and_clean() -> pd.DataFrame:
+        df = profiler.run(
+            "load",
+            load_csv_file,
+            file_path,
+            usecols=keep_columns,
+            chunksize=chunksize,
+            optimize=optimize,
+        )
+        df = profiler.run("keep_columns", cleaner.keep_columns, df, keep_columns)
+        return profiler.run(
+            "rename_columns", cleaner.rename_columns, df, rename_columns
+        )
+
+    if cache_dir is None:
+        df = load_and_clean()
+    else:
+        clean_key = cache_key(
+            file_path,
+            {
+                "stage": "clean",
+                "keep_columns": keep_columns,
+                "rename_columns": rename_columns,
+                "optimize": optimize,
+            },
+        )
+        df = profiler.run(
+            "cached_clean",
+            cached_frame,
+            cache_dir,
+            clean_key,
+            load_and_clean,
+            stage="clean",
+            max_size_mb=cache_max_mb,
+        )
+    return profiler.run(
+        "pivot",
+        cleaner.pivot,
+        df,
+        index_col=index_col,
+        columns_col=columns_col,
+        values_col=values_col,
+        engine=pivot_engine,
+        aggfunc=pivot_aggfunc,
+    )
+
+
+def _limit_memory(max_memory_mb: int) -> None:
+    """
+    Caps the address space of a worker process, where the platform supports it.
+    """
+    if max_memory_mb is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = max_memory_mb * 2**20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _output_stems(file_paths: list) -> list:
+    """
+    Returns a distinct output name for each input file: its file name without the
+    extension or, when file names repeat (e.g. 2019/sdoh.csv and 2020/sdoh.csv), its
+    path relative to the common directory of the inputs, with "__" between the parts.
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in file_paths]
+    if len(set(stems)) == len(stems):
+        return stems
+
+    paths = [os.path.abspath(path) for path in file_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    stems = [
+        os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "__")
+        for path in paths
+    ]
+    if len(set(stems)) != len(stems):
+        raise ValueError("The batch input files must be distinct")
+    return stems
+
+
+def _process_file(
+    file_path: str, options: dict, output_dir: str, stem: str = None
+) -> tuple:
+    """
+    Worker task: pivots one file and either returns the frame or writes per-file
+    outputs, named after stem, and returns only the correlation statistics.
+    """
+    df_pivoted = load_and_pivot_file(file_path, **options)
+    if output_dir is None:
+        return df_pivoted, None
+
+    accumulator = CorrelationAccumulator().update(df_pivoted)
+    df_pivoted.to_pickle(os.path.join(output_dir, f"{stem}_pivoted.pkl"))
+    accumulator.finalize().to_csv(
+        os.path.join(output_dir, f"{stem}_correlation_matrix.csv"), index=False
+    )
+    return None, accumulator
+
+
+def run_batch(
+    file_paths: list,
+    options: dict,
+    n_workers: int = None,
+    max_memory_mb: int = None,
+    output_dir: str = None,
+) -> tuple:
+    """
+    Runs load_and_pivot_file over many files on a process pool and combines the results.
+
+    Parameters:
+    - file_paths (list): The input CSV files.
+    - options (dict): Keyword arguments for load_and_pivot_file.
+    - n_workers (int, optional): Number of worker processes. Default is None
+        (one per CPU, but never more than the number of files).
+    - max_memory_mb (int, optional): Address-space cap for each worker. Default is None.
+    - output_dir (str, optional): If given, each worker writes its pivoted pickle and
+        correlation CSV here and only the correlation statistics are combined. All files
+        must then pivot to the same numeric columns. The outputs are named after the
+        input file names, or their relative paths if file names repeat. Default is None
+        (combine the pivoted frames).
+
+    Returns:
+    - tuple: (combined pivoted DataFrame or None, merged CorrelationAccumulator or None).
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    n_workers = min(n_workers or os.cpu_count() or 1, len(file_paths)) or 1
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers, initializer=_limit_memory, initargs=(max_memory_mb,)
+    ) as executor:
+        results = list(
+            executor.map(
+                _process_file,
+                file_paths,
+                [options] * len(file_paths),
+                [output_dir] * len(file_paths),
+                _output_stems(file_paths),
+            )
+        )
+
+    if output_dir is None:
+        df_combined = pd.concat([frame for frame, _ in results], ignore_index=True)
+        logger.info("Batch of %d files combined successfully", len(file_paths))
+        return df_combined, None
+
+    accumulator = CorrelationAccumulator()
+    for _, partial in results:
+        accumulator.merge(partial)
+    logger.info(
+        "Batch of %d files saved successfully in %s", len(file_paths), output_dir
+    )
+    return None, accumulator
@@ -0,0 +1,473 @@
+"""
+This module benchmarks every pipeline stage and engine on synthetic SDOH-shaped data.
+
+The generator writes long-format CSV files with the columns of the SDOH ACS extract
+(LocationName, Measure, Data_Value, TotalPopulation and the descriptive columns around
+them) at any size from 10^4 to 10^8 rows. The file is written in blocks of ZIP codes, so
+generating it never needs more memory than one block. The number of measures and the
+fraction of missing Data_Value entries are configurable, and the values share a latent
+factor so the correlations are not all near zero.
+
+Each benchmark run times the load (single read and chunked), keep_columns,
+rename_columns, pivot (every pivot engine), correlation (every correlation engine and
+the requested methods) and histogram (every histogram engine) stages with a
+profiling.StageProfiler. The results are a tidy table with one row per size, stage and
+engine, tagged with the git commit and library versions, so runs from different commits
+can be appended to one CSV file and compared with compare_benchmarks.
+
+Functions:
+- generate_sdoh(n_rows, n_measures, nan_rate, seed): Returns a synthetic long-format frame.
+- write_sdoh_csv(path, n_rows, n_measures, nan_rate, seed, block_rows): Writes one to CSV.
+- run_benchmarks(sizes, n_measures, nan_rate, work_dir, ...): Times every stage and engine.
+- compare_benchmarks(baseline, current, threshold): Lists the stages that got slower.
+
+Usage:
+1. Import the module:
+    import benchmark
+
+2. Run the benchmarks and append the results to a CSV file:
+    results = benchmark.run_benchmarks([10**4, 10**5, 10**6], work_dir="data/bench")
+    results.to_csv("data/benchmarks.csv", mode="a", index=False)
+
+3. Compare two runs:
+    regressions = benchmark.compare_benchmarks(baseline_df, results, threshold=1.2)
+
+Or run the module from the command line:
+    python benchmark.py --sizes 10000 100000 1000000 --n_measures 9 --nan_rate 0.05
+    --work_dir data/bench --output data/benchmarks.csv [--baseline data/baseline.csv]
+    [--repeats 3] [--corr_methods pearson spearman] [--trace_memory]
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import logging
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis import correlation_matrix, CORRELATION_ENGINES
+from cleaner import keep_columns, pivot, rename_columns, PIVOT_ENGINES
+from loader import load_csv_file
+from profiling import StageProfiler
+from visualization import plot_histogram, HISTOGRAM_ENGINES
+
+logger = logging.getLogger(__name__)
+
+SDOH_MEASURES = [
+    "Crowding among housing units",
+    "Housing cost burden among households",
+    "Persons of racial or ethnic minority status",
+    "Single-parent households",
+    "No broadband internet subscription among households",
+    "Persons aged 65 years or older",
+    "Persons living below 150% of the poverty level",
+    "Unemployment among people 16 years and older in the labor force",
+    "No high school diploma among adults aged 25 years or older",
+]
+KEEP_COLUMNS = ["LocationName", "Measure", "Data_Value", "TotalPopulation"]
+RENAME_COLUMNS = {"LocationName": "ZIP"}
+RESULT_COLUMNS = [
+    "n_rows",
+    "n_measures",
+    "nan_rate",
+    "stage",
+    "engine",
+    "wall_s",
+    "cpu_s",
+    "peak_traced_mb",
+    "max_rss_mb",
+    "rows_in",
+    "rows_out",
+]
+
+
+# Define functions
+def _measure_names(n_measures: int) -> list:
+    """
+    Returns the real SDOH measure names, padded with numbered measures if more are asked for.
+    """
+    extra = [f"Measure {i + 1}" for i in range(len(SDOH_MEASURES), n_measures)]
+    return (SDOH_MEASURES + extra)[:n_measures]
+
+
+def generate_sdoh(
+    n_rows: int, n_measures: int = 9, nan_rate: float = 0.0, seed: int = 0
+) -> pd.DataFrame:
+    """
+    Returns a synthetic long-format DataFrame shaped like the SDOH ACS extract.
+
+    Each ZIP code has one row per measure, so the frame has n_rows rounded up to a whole
+    number of ZIP codes.
+
+    Parameters:
+    - n_rows (int): The approximate number of rows.
+    - n_measures (int, optional): The number of measures per ZIP code. Default is 9.
+    - nan_rate (float, optional): The fraction of missing Data_Value entries. Default is 0.
+    - seed (int, optional): Seed for the random values. Default is 0.
+
+    Returns:
+    - pd.DataFrame: The synthetic data.
+    """
+    return _generate_block(0, -(-n_rows // n_measures), n_measures, nan_rate, seed)
+
+
+def _generate_block(
+    first_zip: int, n_zips: int, n_measures: int, nan_rate: float, seed
+) -> pd.DataFrame:
+    """
+    Generates the rows of n_zips consecutive ZIP codes.
+    """
+    rng = np.random.default_rng(seed)
+    measures = _measure_names(n_measures)
+    n = n_zips * n_measures
+
+    # A shared latent factor per ZIP code with a different loading per measure
+    latent = np.repeat(rng.standard_normal(n_zips), n_measures)
+    loading = np.tile(np.linspace(-0.8, 0.8, n_measures), n_zips)
+    values = 20 + 8 * (loading * latent + rng.standard_normal(n))
+    values = np.clip(values, 0, 100).round(1)
+    values[rng.random(n) < nan_rate] = np.nan
+
+    measure_ids = [f"M{i + 1:02d}" for i in range(n_measures)]
+    return pd.DataFrame(
+        {
+            "Year": "2017-2021",
+            "LocationName": np.repeat(
+                np.arange(n_zips) + first_zip + 10000, n_measures
+            ),
+            "DataSource": "ACS",
+            "Category": "Social Context",
+            "Measure": np.tile(measures, n_zips),
+            "MeasureID": np.tile(measure_ids, n_zips),
+            "Data_Value_Unit": "%",
+            "Data_Value_Type": "Percentage",
+            "Data_Value": values,
+            "MOE": (values * 0.1).round(1),
+            "TotalPopulation": np.repeat(rng.integers(50, 100000, n_zips), n_measures),
+            "Geolocation": "POINT (0 0)",
+        }
+    )
+
+
+def write_sdoh_csv(
+    path: str,
+    n_rows: int,
+    n_measures: int = 9,
+    nan_rate: float = 0.0,
+    seed: int = 0,
+    block_rows: int = 1000000,
+) -> str:
+    """
+    Writes a synthetic SDOH-shaped CSV file, one block of ZIP codes at a time.
+
+    Parameters:
+    - path (str): The path of the CSV file.
+    - n_rows (int): The approximate number of rows (rounded up to whole ZIP codes).
+    - n_measures (int, optional): The number of measures per ZIP code. Default is 9.
+    - nan_rate (float, optional): The fraction of missing Data_Value entries. Default is 0.
+    - seed (int, optional): Seed for the random values. Default is 0.
+    - block_rows (int, optional): The number of rows generated and written at a time.
+        Default is 1000000.
+
+    Returns:
+    - str: The path of the CSV file.
+    """
+    n_zips = -(-n_rows // n_measures)
+    zips_per_block = max(1, block_rows // n_measures)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for block, first_zip in enumerate(range(0, n_zips, zips_per_block)):
+            df = _generate_block(
+                first_zip,
+                min(zips_per_block, n_zips - first_zip),
+                n_measures,
+                nan_rate,
+                (seed, block),
+            )
+            df.to_csv(f, header=block == 0, index=False)
+    logger.info("Synthetic data saved successfully at %s", path)
+    return path
+
+
+def _git_commit() -> str:
+    """
+    Returns the current git commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _benchmark_size(
+    csv_path: str,
+    work_dir: str,
+    corr_methods: list,
+    chunksize: int,
+    trace_memory: bool,
+) -> list:
+    """
+    Runs every stage and engine once on one CSV file and returns the stage records.
+    """
+    profiler = StageProfiler(trace_memory=trace_memory)
+    engines = []
+
+    def run(stage, label, func, *args, **kwargs):
+        engines.append(label)
+        return profiler.run(stage, func, *args, **kwargs)
+
+    df = run("load", "read_csv", load_csv_file, csv_path, usecols=KEEP_COLUMNS)
+    run(
+        "load",
+        "chunked",
+        load_csv_file,
+        csv_path,
+        usecols=KEEP_COLUMNS,
+        chunksize=chunksize,
+    )
+    df = run("keep_columns", "pandas", keep_columns, df, KEEP_COLUMNS)
+    df = run("rename_columns", "pandas", rename_columns, df, RENAME_COLUMNS)
+
+    for engine in PIVOT_ENGINES:
+        df_pivoted = run(
+            "pivot",
+            engine,
+            pivot,
+            df,
+            index_col=["ZIP", "TotalPopulation"],
+            columns_col=["Measure"],
+            values_col=["Data_Value"],
+            engine=engine,
+        )
+    for method in corr_methods:
+        for engine in CORRELATION_ENGINES:
+            run(
+                f"correlation_{method}",
+                engine,
+                correlation_matrix,
+                df_pivoted,
+                engine=engine,
+                method=method,
+            )
+    for engine in HISTOGRAM_ENGINES:
+        run(
+            "histogram",
+            engine,
+            plot_histogram,
+            df_pivoted,
+            columns=list(df_pivoted.columns[2:5]),
+            path=os.path.join(work_dir, f"histogram_{engine}.png"),
+            engine=engine,
+        )
+
+    records = profiler.report()["stages"]
+    for record, engine in zip(records, engines):
+        record["engine"] = engine
+    return records
+
+
+def run_benchmarks(
+    sizes: list,
+    n_measures: int = 9,
+    nan_rate: float = 0.0,
+    work_dir: str = "data/bench",
+    repeats: int = 1,
+    corr_methods: list = ("pearson", "spearman"),
+    chunksize: int = 100000,
+    trace_memory: bool = False,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Times every pipeline stage and engine on synthetic data of each size.
+
+    Parameters:
+    - sizes (list): The numbers of long-format rows to benchmark.
+    - n_measures (int, optional): The number of measures per ZIP code. Default is 9.
+    - nan_rate (float, optional): The fraction of missing Data_Value entries. Default is 0.
+    - work_dir (str, optional): Directory for the generated CSV files and figures.
+        Default is "data/bench".
+    - repeats (int, optional): Each stage is run this many times and the fastest run is
+        kept. Default is 1.
+    - corr_methods (list, optional): The correlation methods to time with every
+        correlation engine. Default is ("pearson", "spearman").
+    - chunksize (int, optional): The chunk size of the chunked load. Default is 100000.
+    - trace_memory (bool, optional): Record tracemalloc peaks. This slows down the
+        stages, so it is off by default and peak_traced_mb is then empty.
+    - seed (int, optional): Seed for the synthetic data. Default is 0.
+
+    Returns:
+    - pd.DataFrame: One row per size, stage and engine with the columns of
+        RESULT_COLUMNS, plus the git commit, versions and a timestamp.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    rows = []
+    for n_rows in sizes:
+        csv_path = os.path.join(
+            work_dir, f"sdoh_{n_rows}_{n_measures}_{nan_rate:g}_{seed}.csv"
+        )
+        if not os.path.exists(csv_path):
+            write_sdoh_csv(csv_path, n_rows, n_measures, nan_rate, seed)
+
+        runs = [
+            _benchmark_size(csv_path, work_dir, corr_methods, chunksize, trace_memory)
+            for _ in range(repeats)
+        ]
+        for records in zip(*runs):
+            best = min(records, key=lambda record: record["wall_s"])
+            rows.append(
+                {
+                    "n_rows": n_rows,
+                    "n_measures": n_measures,
+                    "nan_rate": nan_rate,
+                    "stage": best["stage"],
+                    "engine": best["engine"],
+                    "wall_s": best["wall_s"],
+                    "cpu_s": best["cpu_s"],
+                    "peak_traced_mb": best.get("peak_traced_mb"),
+                    "max_rss_mb": best["max_rss_mb"],
+                    "rows_in": (best["input"] or {"shape": [None]})["shape"][0],
+                    "rows_out": (best["output"] or {"shape": [None]})["shape"][0],
+                }
+            )
+        logger.info("Benchmark of %d rows finished successfully", n_rows)
+
+    results = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    results["commit"] = _git_commit()
+    results["python"] = platform.python_version()
+    results["numpy"] = np.__version__
+    results["pandas"] = pd.__version__
+    results["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return results
+
+
+def compare_benchmarks(
+    baseline: pd.DataFrame, current: pd.DataFrame, threshold: float = 1.2
+) -> pd.DataFrame:
+    """
+    Lists the stages that are slower in the current run than in the baseline.
+
+    Rows are matched on size, measure count, NaN rate, stage and engine. If a table holds
+    several runs of the same stage, the fastest is used.
+
+    Parameters:
+    - baseline (pd.DataFrame): Results of run_benchmarks for the reference commit.
+    - current (pd.DataFrame): Results of run_benchmarks for the commit under test.
+    - threshold (float, optional): A stage is a regression when its wall time is more
+        than this many times the baseline. Default is 1.2.
+
+    Returns:
+    - pd.DataFrame: The matched stages with the columns wall_s_baseline,
+        wall_s_current and ratio, slowest first, limited to the regressions.
+    """
+    keys = ["n_rows", "n_measures", "nan_rate", "stage", "engine"]
+    merged = pd.merge(
+        baseline.groupby(keys, as_index=False)["wall_s"].min(),
+        current.groupby(keys, as_index=False)["wall_s"].min(),
+        on=keys,
+        suffixes=("_baseline", "_current"),
+    )
+    merged["ratio"] = merged["wall_s_current"] / merged["wall_s_baseline"]
+    regressions = merged[merged["ratio"] > threshold]
+    return regressions.sort_values("ratio", ascending=False, ignore_index=True)
+
+
+# Run the benchmarks from the command line
+if __name__ == "__main__":
+    import argparse
+
+    from profiling import configure_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        help="Numbers of long-format rows to benchmark, e.g. 10000 100000 1000000",
+        nargs="+",
+        type=lambda value: int(float(value)),
+        default=[10000, 100000],
+    )
+    parser.add_argument(
+        "--n_measures", help="Number of measures per ZIP code", type=int, default=9
+    )
+    parser.add_argument(
+        "--nan_rate",
+        help="Fraction of missing Data_Value entries",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--work_dir",
+        help="Directory for the generated CSV files and figures",
+        default="data/bench",
+    )
+    parser.add_argument(
+        "--output",
+        help="CSV file the results are appended to",
+        default="data/benchmarks.csv",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Results CSV of a reference run to compare against",
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Slowdown ratio reported as a regression",
+        type=float,
+        default=1.2,
+    )
+    parser.add_argument(
+        "--repeats", help="Runs per stage; the fastest is kept", type=int, default=1
+    )
+    parser.add_argument(
+        "--corr_methods",
+        help="Correlation methods to time with every correlation engine",
+        nargs="+",
+        default=["pearson", "spearman"],
+    )
+    parser.add_argument(
+        "--trace_memory",
+        help="Record tracemalloc peaks (slows down the stages)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--seed", help="Seed for the synthetic data", type=int, default=0
+    )
+    args = parser.parse_args()
+    configure_logging("WARNING")
+    logger.setLevel(logging.INFO)
+
+    results = run_benchmarks(
+        args.sizes,
+        n_measures=args.n_measures,
+        nan_rate=args.nan_rate,
+        work_dir=args.work_dir,
+        repeats=args.repeats,
+        corr_methods=args.corr_methods,
+        trace_memory=args.trace_memory,
+        seed=args.seed,
+    )
+    results.to_csv(
+        args.output, mode="a", header=not os.path.exists(args.output), index=False
+    )
+    print(results[["n_rows", "stage", "engine", "wall_s", "cpu_s"]].to_string())
+    print(f"\nBenchmark results appended successfully to {args.output}\n")
+
+    if args.baseline is not None:
+        regressions = compare_benchmarks(
+            pd.read_csv(args.baseline), results, args.threshold
+        )
+        if regressions.empty:
+            print("\nNo regressions found\n")
+        else:
+            print("\nRegressions:\n")
+            print(regressions.to_string())
@@ -0,0 +1,279 @@
+"""
+This module provides an on-disk columnar cache for DataFrames produced by the pipeline.
+
+Cached frames are stored as uncompressed Feather (Arrow IPC) files, which can be
+memory-mapped on read, or as Parquet files. Each entry is keyed by a fingerprint of
+the input file (size and modification time, or a content hash) plus the options that
+were used to produce the frame, so a changed input or changed options never reuse a
+stale entry.
+
+The cache can be bounded in size: every hit marks its entry as recently used (by touching
+its modification time), and after each write the least recently used entries are evicted
+until the cache fits. Hits and misses are counted per stage (e.g. "clean", "pivot",
+"correlation") for the whole process.
+
+Functions:
+- file_fingerprint(file_path, content_hash): Returns a fingerprint for an input file.
+- cache_key(file_path, options, content_hash): Returns the cache key for a file and options.
+- read_cached_frame(cache_dir, key, fmt): Loads a cached DataFrame, or None on a miss.
+- write_cached_frame(cache_dir, key, df, fmt): Stores a DataFrame in the cache.
+- cached_frame(cache_dir, key, compute, fmt, stage, max_size_mb): Loads a cached DataFrame
+    or computes and stores it, evicting old entries beyond max_size_mb.
+- evict_cache(cache_dir, max_size_mb): Removes the least recently used entries.
+- cache_stats(cache_dir): Returns the hit and miss counts, and the size of the cache.
+
+Usage:
+1. Import the module:
+    import cache
+
+2. Build a key for the input file and the options used to process it:
+    key = cache.cache_key("data/sdoh.csv", {"stage": "load", "usecols": cols_to_keep})
+
+3. Load the frame from the cache, computing it on a miss:
+    df = cache.cached_frame("data/.cache", key, lambda: pd.read_csv("data/sdoh.csv"))
+
+4. Or bound the cache size and check how well it works:
+    df = cache.cached_frame("data/.cache", key, compute, stage="load", max_size_mb=1024)
+    cache.cache_stats("data/.cache")
+
+Feather and Parquet support require the pyarrow package.
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Callable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMATS = {"feather": ".feather", "parquet": ".parquet"}
+
+# Hits and misses of cached_frame in this process, per stage
+_stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+
+# Define functions
+def file_fingerprint(file_path: str, content_hash: bool = False) -> str:
+    """
+    Returns a fingerprint for an input file.
+
+    Parameters:
+    - file_path (str): The path to the file.
+    - content_hash (bool, optional): If True, hash the file contents with SHA-256.
+        Otherwise use the file size and modification time. Default is False.
+
+    Returns:
+    - str: The fingerprint of the file.
+    """
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    stat = os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def cache_key(file_path: str, options: dict = None, content_hash: bool = False) -> str:
+    """
+    Returns the cache key for an input file and the options used to process it.
+
+    Parameters:
+    - file_path (str): The path to the input file.
+    - options (dict, optional): The options that affect the cached frame. Default is None.
+    - content_hash (bool, optional): If True, fingerprint the file by its contents.
+        Default is False.
+
+    Returns:
+    - str: A hexadecimal cache key.
+    """
+    payload = {
+        "file": os.path.abspath(file_path),
+        "fingerprint": file_fingerprint(file_path, content_hash),
+        "options": options or {},
+    }
+    text = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cache_path(cache_dir: str, key: str, fmt: str) -> str:
+    if fmt not in CACHE_FORMATS:
+        raise ValueError(f"Unknown cache format: {fmt}")
+    return os.path.join(cache_dir, key + CACHE_FORMATS[fmt])
+
+
+def read_cached_frame(cache_dir: str, key: str, fmt: str = "feather") -> pd.DataFrame:
+    """
+    Loads a cached DataFrame, memory-mapping the file where the format supports it.
+
+    Parameters:
+    - cache_dir (str): The cache directory.
+    - key (str): The cache key.
+    - fmt (str, optional): The cache format, "feather" or "parquet". Default is "feather".
+
+    Returns:
+    - pd.DataFrame: The cached DataFrame, or None if the entry does not exist.
+    """
+    path = _cache_path(cache_dir, key, fmt)
+    if not os.path.exists(path):
+        return None
+
+    if fmt == "feather":
+        from pyarrow import feather
+
+        return feather.read_table(path, memory_map=True).to_pandas()
+    return pd.read_parquet(path, memory_map=True)
+
+
+def write_cached_frame(
+    cache_dir: str, key: str, df: pd.DataFrame, fmt: str = "feather"
+) -> str:
+    """
+    Stores a DataFrame in the cache.
+
+    The file is written to a temporary name first and then renamed, so a reader never
+    sees a partially written entry.
+
+    Parameters:
+    - cache_dir (str): The cache directory. It is created if it does not exist.
+    - key (str): The cache key.
+    - df (pd.DataFrame): The DataFrame to store.
+    - fmt (str, optional): The cache format, "feather" or "parquet". Default is "feather".
+
+    Returns:
+    - str: The path of the cached file.
+    """
+    path = _cache_path(cache_dir, key, fmt)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+
+    # Columnar formats need string column names and a default index
+    df = df.reset_index(drop=True)
+    df.columns = [str(col) for col in df.columns]
+    if fmt == "feather":
+        df.to_feather(tmp_path, compression="uncompressed")
+    else:
+        df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def evict_cache(cache_dir: str, max_size_mb: float, keep: str = None) -> int:
+    """
+    Removes the least recently used entries until the cache fits in max_size_mb.
+
+    Parameters:
+    - cache_dir (str): The cache directory.
+    - max_size_mb (float): The size limit of the cache in megabytes.
+    - keep (str, optional): The path of an entry that is never evicted, e.g. the one just
+        written. Default is None.
+
+    Returns:
+    - int: The number of evicted entries.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and os.path.splitext(entry.name)[1] in (
+            CACHE_FORMATS.values()
+        ):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_size_mb * 2**20:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
+        evicted += 1
+    if evicted:
+        logger.info("Evicted %d cache entries", evicted)
+    return evicted
+
+
+def cache_stats(cache_dir: str = None) -> dict:
+    """
+    Returns the hits and misses of cached_frame in this process, per stage and in total.
+
+    Parameters:
+    - cache_dir (str, optional): If given, the number of entries and the size of this
+        cache directory are included. Default is None.
+
+    Returns:
+    - dict: {"stages": {stage: {"hits": int, "misses": int}}, "hits": int, "misses": int}
+        plus "entries" and "size_mb" if cache_dir is given.
+    """
+    stats = {
+        "stages": {stage: dict(counts) for stage, counts in _stats.items()},
+        "hits": sum(counts["hits"] for counts in _stats.values()),
+        "misses": sum(counts["misses"] for counts in _stats.values()),
+    }
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        sizes = [
+            entry.stat().st_size
+            for entry in os.scandir(cache_dir)
+            if os.path.splitext(entry.name)[1] in CACHE_FORMATS.values()
+        ]
+        stats["entries"] = len(sizes)
+        stats["size_mb"] = round(sum(sizes) / 2**20, 3)
+    return stats
+
+
+def reset_cache_stats() -> None:
+    """
+    Resets the hit and miss counts of cached_frame.
+    """
+    _stats.clear()
+
+
+def cached_frame(
+    cache_dir: str,
+    key: str,
+    compute: Callable[[], pd.DataFrame],
+    fmt: str = "feather",
+    stage: str = "frame",
+    max_size_mb: float = None,
+) -> pd.DataFrame:
+    """
+    Loads a DataFrame from the cache, or computes and stores it on a miss.
+
+    Parameters:
+    - cache_dir (str): The cache directory.
+    - key (str): The cache key.
+    - compute (Callable): A function with no arguments that returns the DataFrame.
+    - fmt (str, optional): The cache format, "feather" or "parquet". Default is "feather".
+    - stage (str, optional): The stage the hit or miss is counted for. Default is "frame".
+    - max_size_mb (float, optional): After a miss, the least recently used entries are
+        evicted until the cache fits in this size. Default is None (unbounded).
+
+    Returns:
+    - pd.DataFrame: The cached or freshly computed DataFrame.
+    """
+    df = read_cached_frame(cache_dir, key, fmt)
+    if df is not None:
+        # Mark the entry as recently used for the LRU eviction
+        os.utime(_cache_path(cache_dir, key, fmt))
+        _stats[stage]["hits"] += 1
+        logger.info("Data loaded from cache (%s)", stage)
+        return df
+
+    _stats[stage]["misses"] += 1
+    df = compute()
+    path = write_cached_frame(cache_dir, key, df, fmt)
+    logger.info("Data saved to cache (%s)", stage)
+    if max_size_mb is not None:
+        evict_cache(cache_dir, max_size_mb, keep=path)
+    return df
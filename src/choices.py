@@ -0,0 +1,18 @@
+"""
+This module holds the option values shared by the library modules and the command line.
+
+It imports nothing, so command line parsers can offer these choices (and answer --help
+or report argument errors) without importing pandas, NumPy or matplotlib. The library
+modules re-export the names, e.g. cleaner.PIVOT_ENGINES.
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+PIVOT_ENGINES = ("pandas", "numpy")
+PIVOT_AGGFUNCS = ("first", "mean", "sum", "count")
+CORRELATION_ENGINES = ("pandas", "numpy")
+CORRELATION_METHODS = ("pearson", "spearman", "kendall")
+CORRELATION_FORMATS = ("csv", "npy", "triu", "parquet")
+HISTOGRAM_ENGINES = ("matplotlib", "binned")
+IMPUTE_STRATEGIES = ("none", "median", "weighted_mean", "knn")
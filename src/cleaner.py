@@ -1,6 +1,7 @@
 """
 This module provides functions to clean up a DataFrame by keeping only specified columns, 
-renaming columns, and pivoting the DataFrame.
+renaming columns, shrinking column dtypes, pivoting the DataFrame, and handling the
+measures that are missing after the pivot.
 
 Usage:
 1. Import the module:
@@ -15,16 +16,28 @@ Usage:
 4. Rename columns:
     df_renamed = cleaner.rename_columns(df_keep, cols_to_rename)
     
-5. Pivot the DataFrame:
+5. Optionally shrink the column dtypes (categoricals for repeated strings, narrow numbers):
+    df_renamed = cleaner.optimize_dtypes(df_renamed)
+
+6. Pivot the DataFrame:
     df_pivoted = cleaner.pivot(df_renamed, index_col, columns_col, values_col)
     
-6. Save the cleaned and pivoted DataFrame as a pickle file, if desired:
+   Then optionally report the coverage of the measures, drop sparse measures and rows,
+   and impute the remaining gaps (median, population-weighted mean or nearest ZIP codes):
+    df_pivoted, matrix, coverage = cleaner.handle_missing(
+        df_pivoted, index_col, strategy="knn", min_column_coverage=0.5
+    )
+
+7. Save the cleaned and pivoted DataFrame as a pickle file, if desired:
     df_pivoted.to_pickle("path/to/output.pkl")
 
 Or run the module from the command line:
     python cleaner.py <sdoh_file> <sdoh_edited_pickle_path> --keep_columns <cols_to_keep> 
     --rename_columns_old <old_col_names> --rename_columns_new <new_col_names> 
     --index_col <index_col> --columns_col <columns_col> --values_col <values_col>
+    [--optimize_dtypes] [--pivot_engine {pandas,numpy}] [--pivot_aggfunc {first,mean,sum,count}]
+    [--impute {none,median,weighted_mean,knn}] [--min_column_coverage <fraction>]
+    [--min_row_coverage <fraction>] [--coverage_path <path>]
 
 Example:
     python cleaner.py data/df_sdoh.pkl data/df_sdoh_pivoted.pkl 
@@ -37,10 +50,73 @@ Date: 2024-03-17
 """
 
 # Import packages
+import logging
+import warnings
+
+import numpy as np
 import pandas as pd
 
+from choices import IMPUTE_STRATEGIES, PIVOT_AGGFUNCS, PIVOT_ENGINES
+
+logger = logging.getLogger(__name__)
+
 
 # Define functions
+def optimize_dtypes(
+    df: pd.DataFrame, max_category_ratio: float = 0.5, downcast_floats: bool = False
+) -> pd.DataFrame:
+    """
+    Shrink the column dtypes of the DataFrame and report the memory saved.
+
+    String columns with few distinct values (such as ZIP codes and measure names in the
+    long-format SDOH data) become categoricals, so later steps such as the pivot work on
+    integer codes instead of hashing Python strings. Integer columns are downcast to the
+    narrowest integer type that holds their values.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame to optimize.
+    - max_category_ratio (float, optional): A string column becomes categorical when its
+        number of distinct values is at most this fraction of its length. Default is 0.5.
+    - downcast_floats (bool, optional): If True, float64 columns become float32. This is
+        lossy, so it is off by default. Default is False.
+
+    Returns:
+    - pd.DataFrame: The DataFrame with optimized dtypes.
+    """
+    # Measuring deep memory usage is costly, so only do it when it will be logged
+    log_savings = logger.isEnabledFor(logging.INFO)
+    if log_savings:
+        before = df.memory_usage(deep=True).sum()
+    outdf = df.copy()
+
+    for col in outdf.columns:
+        series = outdf[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(
+            series
+        ):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            outdf[col] = pd.to_numeric(series, downcast="integer")
+        elif pd.api.types.is_float_dtype(series):
+            if downcast_floats:
+                outdf[col] = series.astype("float32")
+        elif pd.api.types.is_string_dtype(series) or pd.api.types.is_object_dtype(
+            series
+        ):
+            if len(series) and series.nunique() <= max_category_ratio * len(series):
+                outdf[col] = series.astype("category")
+
+    if log_savings:
+        after = outdf.memory_usage(deep=True).sum()
+        logger.info(
+            "Dtypes optimized successfully: %.2f MB -> %.2f MB (%d bytes saved)",
+            before / 1e6,
+            after / 1e6,
+            before - after,
+        )
+    return outdf
+
+
 def keep_columns(df: pd.DataFrame, cols_to_keep: list) -> pd.DataFrame:
     """
     Keep only the specified columns in the DataFrame.
@@ -53,7 +129,7 @@ def keep_columns(df: pd.DataFrame, cols_to_keep: list) -> pd.DataFrame:
     - pd.DataFrame: The cleaned DataFrame.
     """
     outdf = df[cols_to_keep]
-    print("\nOnly required columns kept successfully\n")
+    logger.info("Only required columns kept successfully")
     return outdf
 
 
@@ -69,12 +145,92 @@ def rename_columns(df: pd.DataFrame, cols_to_rename: dict) -> pd.DataFrame:
     - pd.DataFrame: The cleaned DataFrame.
     """
     outdf = df.rename(columns=cols_to_rename)
-    print("\nColumns renamed successfully\n")
+    logger.info("Columns renamed successfully")
     return outdf
 
 
+def _pivot_numpy(
+    inpdf: pd.DataFrame,
+    index_col: list,
+    columns_col: str,
+    values_col: str,
+    aggfunc: str = "first",
+) -> pd.DataFrame:
+    """
+    Pivots a DataFrame by factorizing the keys and scattering the values into one 2-D array.
+
+    Rows and columns of the output are sorted like DataFrame.pivot. Duplicate
+    index/columns pairs are combined with aggfunc instead of raising.
+
+    Args:
+        inpdf (DataFrame): The input DataFrame to be pivoted.
+        index_col (list): The column(s) to be used as the index for the pivoted DataFrame.
+        columns_col (str): The column to be used as the columns for the pivoted DataFrame.
+        values_col (str): The column to be used as the values for the pivoted DataFrame.
+        aggfunc (str): How to combine duplicates: "first", "mean", "sum" or "count".
+
+    Returns:
+        DataFrame: The pivoted DataFrame.
+    """
+    if aggfunc not in PIVOT_AGGFUNCS:
+        raise ValueError(f"aggfunc must be one of {PIVOT_AGGFUNCS}, got {aggfunc!r}")
+
+    # Combine the sorted codes of each index column into one row key
+    row_key = np.zeros(len(inpdf), dtype=np.int64)
+    for col in index_col:
+        codes, uniques = pd.factorize(inpdf[col], sort=True, use_na_sentinel=False)
+        row_key = row_key * len(uniques) + codes
+    row_codes, row_uniques = pd.factorize(row_key, sort=True)
+    col_codes, col_uniques = pd.factorize(
+        inpdf[columns_col], sort=True, use_na_sentinel=False
+    )
+    n_rows, n_cols = len(row_uniques), len(col_uniques)
+    # Any input row of a group carries that group's index values
+    key_rows = np.empty(n_rows, dtype=np.int64)
+    key_rows[row_codes] = np.arange(len(row_codes))
+
+    values = inpdf[values_col].to_numpy()
+    out_dtype = np.float32 if values.dtype == np.float32 else np.float64
+    values = values.astype(out_dtype, copy=False)
+    flat = row_codes * n_cols + col_codes
+
+    # Scatter the values into a preallocated array
+    out = np.full(n_rows * n_cols, np.nan, dtype=out_dtype)
+    present = ~np.isnan(values)
+    if aggfunc == "first" and np.bincount(flat).max(initial=0) <= 1:
+        # No duplicates: every cell is written at most once
+        out[flat] = values
+    elif aggfunc == "first":
+        # Like groupby first: keep the first non-missing value per cell
+        cells, first = np.unique(flat[present], return_index=True)
+        out[cells] = values[present][first]
+    else:
+        counts = np.bincount(flat[present], minlength=n_rows * n_cols)
+        observed = counts > 0
+        if aggfunc == "count":
+            out[observed] = counts[observed]
+        else:
+            sums = np.bincount(
+                flat[present], weights=values[present], minlength=n_rows * n_cols
+            )
+            if aggfunc == "mean":
+                sums[observed] /= counts[observed]
+            out[observed] = sums[observed]
+    out = out.reshape(n_rows, n_cols)
+
+    data = {col: inpdf[col].iloc[key_rows].reset_index(drop=True) for col in index_col}
+    for j, label in enumerate(col_uniques):
+        data[label] = out[:, j]
+    return pd.DataFrame(data)
+
+
 def pivot(
-    inpdf: pd.DataFrame, index_col: list, columns_col: list, values_col: list
+    inpdf: pd.DataFrame,
+    index_col: list,
+    columns_col: list,
+    values_col: list,
+    engine: str = "pandas",
+    aggfunc: str = "first",
 ) -> pd.DataFrame:
     """
     Pivots a DataFrame based on the specified index, columns, and values.
@@ -84,11 +240,31 @@ def pivot(
         index_col (list): The column(s) to be used as the index for the pivoted DataFrame.
         columns_col (list): The column(s) to be used as the columns for the pivoted DataFrame.
         values_col (list): The column(s) to be used as the values for the pivoted DataFrame.
+        engine (str): "pandas" uses DataFrame.pivot, which raises on duplicate
+            index/columns pairs. "numpy" factorizes the keys and fills a preallocated
+            array in one pass; it needs a single columns and values column.
+            Default is "pandas".
+        aggfunc (str): How the "numpy" engine combines duplicate index/columns pairs:
+            "first", "mean", "sum" or "count". Default is "first".
 
     Returns:
         DataFrame: The pivoted DataFrame.
 
     """
+    if engine not in PIVOT_ENGINES:
+        raise ValueError(f"engine must be one of {PIVOT_ENGINES}, got {engine!r}")
+
+    if engine == "numpy":
+        if len(columns_col) != 1 or len(values_col) != 1:
+            raise ValueError(
+                "The numpy pivot engine needs exactly one columns and one values column"
+            )
+        outdf = _pivot_numpy(
+            inpdf, list(index_col), columns_col[0], values_col[0], aggfunc
+        )
+        logger.info("DataFrame pivoted successfully")
+        return outdf
+
     # Check if the index, columns, and values are single columns. If yes, convert them to strings
     if len(index_col) == 1:
         index_col = index_col[0]
@@ -104,14 +280,171 @@ def pivot(
         .rename_axis(None, axis=1)
     )
 
-    print("\nDataFrame pivoted successfully\n")
+    logger.info("DataFrame pivoted successfully")
     return outdf
 
 
+def coverage_report(df: pd.DataFrame, measures: list = None) -> pd.DataFrame:
+    """
+    Reports how much of each measure, and of each pair of measures, is present.
+
+    After the pivot, a ZCTA that is missing a measure is NaN in that column, so
+    DataFrame.corr uses a different number of rows for every pair. Element [i, j] of the
+    report is the fraction of rows where both measures i and j are present; the diagonal
+    is the coverage of each measure on its own.
+
+    Parameters:
+    - df (pd.DataFrame): The pivoted DataFrame.
+    - measures (list, optional): The measure columns. Default is None (every numeric
+        column).
+
+    Returns:
+    - pd.DataFrame: The per-pair coverage, between 0 and 1, indexed by measure on both axes.
+    """
+    if measures is None:
+        measures = df.select_dtypes(include="number").columns.tolist()
+    present = df[measures].notna().to_numpy(dtype=np.float64)
+    pairs = present.T @ present / max(len(df), 1)
+    return pd.DataFrame(pairs, index=measures, columns=measures)
+
+
+def _weighted_means(x: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Column means of x over the present values, weighted by the row weights.
+    """
+    present = ~np.isnan(x) & ~np.isnan(weights)[:, None]
+    w = np.where(present, weights[:, None], 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Rows with a missing weight count for nothing, in the sums and the totals
+        return (np.where(present, x, 0) * w).sum(axis=0) / w.sum(axis=0)
+
+
+def _knn_impute(x: np.ndarray, zips: np.ndarray, k: int) -> np.ndarray:
+    """
+    Fills each missing value with the mean of the k present values of the same measure
+    whose ZIP codes are nearest, using the sorted ZIP codes as the spatial index.
+
+    Only the k nearest present ZIP codes on each side of a missing one can be among its
+    k nearest, so the candidates are found with one binary search per measure.
+    """
+    x = x.copy()
+    offsets = np.arange(-k, k)
+    for j in range(x.shape[1]):
+        missing = np.isnan(x[:, j])
+        if not missing.any() or missing.all():
+            continue
+        present = np.flatnonzero(~missing)
+        present = present[np.argsort(zips[present], kind="stable")]
+        sorted_zips = zips[present]
+
+        # Up to 2k candidates around each missing row's position in the sorted ZIP codes
+        targets = zips[missing]
+        candidates = np.searchsorted(sorted_zips, targets)[:, None] + offsets
+        valid = (candidates >= 0) & (candidates < len(present))
+        candidates = np.clip(candidates, 0, len(present) - 1)
+        distance = np.where(
+            valid, np.abs(sorted_zips[candidates] - targets[:, None]), np.inf
+        )
+        n_nearest = min(k, len(present))
+        nearest = np.argpartition(distance, n_nearest - 1, axis=1)[:, :n_nearest]
+        neighbours = np.take_along_axis(candidates, nearest, axis=1)
+        x[missing, j] = x[present[neighbours], j].mean(axis=1)
+    return x
+
+
+def handle_missing(
+    df: pd.DataFrame,
+    index_col: list,
+    strategy: str = "none",
+    min_column_coverage: float = 0.0,
+    min_row_coverage: float = 0.0,
+    weight_col: str = "TotalPopulation",
+    zip_col: str = "ZIP",
+    k: int = 5,
+) -> tuple:
+    """
+    Reports the coverage of the measures, drops sparse measures and rows, and imputes the
+    remaining missing values, so the correlation can use the dense matrix product path.
+
+    The measures are the numeric columns that are not index columns. Sparse measures are
+    dropped first, then sparse rows, then the remaining gaps are imputed column by
+    column with vectorized operations.
+
+    Parameters:
+    - df (pd.DataFrame): The pivoted DataFrame.
+    - index_col (list): The index columns of the pivot (e.g. ZIP and TotalPopulation);
+        they are kept but never imputed or used as measures.
+    - strategy (str, optional): "none" (keep NaN), "median", "weighted_mean" (the column
+        mean weighted by weight_col, e.g. population) or "knn" (the mean of the k
+        nearest ZIP codes that have the measure). Default is "none".
+    - min_column_coverage (float, optional): Measures present in a smaller fraction of
+        the rows are dropped. Default is 0.0.
+    - min_row_coverage (float, optional): Rows with a smaller fraction of the remaining
+        measures present are dropped. Default is 0.0.
+    - weight_col (str, optional): The row weights for "weighted_mean".
+        Default is "TotalPopulation".
+    - zip_col (str, optional): The numeric ZIP code column for "knn". Default is "ZIP".
+    - k (int, optional): The number of neighbours for "knn". Default is 5.
+
+    Returns:
+    - tuple: (DataFrame, matrix, coverage), where DataFrame is the cleaned frame, matrix
+        a C-contiguous float64 array of its measures (dense unless strategy is "none")
+        and coverage the coverage_report of the measures before any change.
+    """
+    if strategy not in IMPUTE_STRATEGIES:
+        raise ValueError(
+            f"strategy must be one of {IMPUTE_STRATEGIES}, got {strategy!r}"
+        )
+    measures = [
+        col
+        for col in df.select_dtypes(include="number").columns
+        if col not in index_col
+    ]
+    coverage = coverage_report(df, measures)
+
+    # Drop the measures, then the rows, that fall below the coverage thresholds
+    column_coverage = pd.Series(np.diag(coverage), index=measures)
+    sparse = column_coverage.index[column_coverage < min_column_coverage].tolist()
+    measures = [col for col in measures if col not in sparse]
+    outdf = df.drop(columns=sparse)
+    if measures:
+        row_coverage = outdf[measures].notna().mean(axis=1)
+        outdf = outdf[row_coverage >= min_row_coverage].reset_index(drop=True)
+
+    x = outdf[measures].to_numpy(dtype=np.float64, na_value=np.nan)
+    n_missing = int(np.isnan(x).sum())
+    if strategy == "median" and n_missing:
+        with warnings.catch_warnings():
+            # A measure with no values at all stays NaN
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            fill = np.nanmedian(x, axis=0)
+        x = np.where(np.isnan(x), fill, x)
+    elif strategy == "weighted_mean" and n_missing:
+        weights = outdf[weight_col].to_numpy(dtype=np.float64, na_value=np.nan)
+        x = np.where(np.isnan(x), _weighted_means(x, weights), x)
+    elif strategy == "knn" and n_missing:
+        zips = outdf[zip_col].to_numpy(dtype=np.float64, na_value=np.nan)
+        x = _knn_impute(x, zips, k)
+
+    matrix = np.ascontiguousarray(x)
+    for j, col in enumerate(measures):
+        outdf[col] = matrix[:, j]
+    logger.info(
+        "Missing data handled successfully: %d measures and %d rows dropped, "
+        "%d values imputed",
+        len(sparse),
+        len(df) - len(outdf),
+        n_missing - int(np.isnan(matrix).sum()),
+    )
+    return outdf, matrix, coverage
+
+
 # Add the following code to the bottom of the module to allow running it from the command line:
 if __name__ == "__main__":
     import argparse
 
+    from profiling import configure_logging
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "sdoh_file",
@@ -151,28 +484,68 @@ if __name__ == "__main__":
         help="List of columns to be used as the values for the pivoted DataFrame",
         nargs="+",
     )
+    parser.add_argument(
+        "--optimize_dtypes",
+        help="Convert repeated strings to categoricals and downcast integers before pivoting",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pivot_engine",
+        help="Pivot engine: pandas (DataFrame.pivot) or numpy (single-pass scatter)",
+        choices=PIVOT_ENGINES,
+        default="pandas",
+    )
+    parser.add_argument(
+        "--pivot_aggfunc",
+        help="How the numpy pivot engine combines duplicate index/columns pairs",
+        choices=PIVOT_AGGFUNCS,
+        default="first",
+    )
+    parser.add_argument(
+        "--impute",
+        help="Imputation of the measures missing after the pivot",
+        choices=IMPUTE_STRATEGIES,
+        default="none",
+    )
+    parser.add_argument(
+        "--min_column_coverage",
+        help="Drop measures present in a smaller fraction of the rows",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--min_row_coverage",
+        help="Drop rows with a smaller fraction of the measures present",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--coverage_path",
+        help="Path to save the per-measure and per-pair coverage as a CSV file",
+    )
     args = parser.parse_args()
+    configure_logging()
 
     # Load the DataFrame from the pickle file
     df_sdoh = pd.read_pickle(args.sdoh_file)
 
-    # Print keep_columns values
-    print("args.keep_columns: ", args.keep_columns)
+    # Log keep_columns values
+    logger.debug("args.keep_columns: %s", args.keep_columns)
 
-    # Print rename_columns_old values
-    print("args.rename_columns_old: ", args.rename_columns_old)
+    # Log rename_columns_old values
+    logger.debug("args.rename_columns_old: %s", args.rename_columns_old)
 
-    # Print rename_columns_new values
-    print("args.rename_columns_new: ", args.rename_columns_new)
+    # Log rename_columns_new values
+    logger.debug("args.rename_columns_new: %s", args.rename_columns_new)
 
-    # Print index_col values
-    print("args.index_col: ", type(args.index_col), args.index_col)
+    # Log index_col values
+    logger.debug("args.index_col: %s %s", type(args.index_col), args.index_col)
 
-    # Print columns_col values
-    print("args.columns_col: ", type(args.columns_col), list(args.columns_col))
+    # Log columns_col values
+    logger.debug("args.columns_col: %s %s", type(args.columns_col), args.columns_col)
 
-    # Print values_col values
-    print("args.values_col: ", type(args.values_col), args.values_col)
+    # Log values_col values
+    logger.debug("args.values_col: %s %s", type(args.values_col), args.values_col)
 
     # Apply the keep_columns function
     df_sdoh_keep = keep_columns(df=df_sdoh, cols_to_keep=list(args.keep_columns))
@@ -186,14 +559,38 @@ if __name__ == "__main__":
     )
     # df_sdoh_edited = df_sdoh_keep
 
+    # Shrink the column dtypes, if requested
+    if args.optimize_dtypes:
+        df_sdoh_renamed = optimize_dtypes(df_sdoh_renamed)
+
     # Transform the DataFrame by pivoting it
     df_sdoh_pivoted = pivot(
         inpdf=df_sdoh_renamed,
         index_col=args.index_col,
         columns_col=args.columns_col,
         values_col=args.values_col,
+        engine=args.pivot_engine,
+        aggfunc=args.pivot_aggfunc,
     )
 
+    # Report the coverage, drop sparse measures and rows and impute, if requested
+    if (
+        args.impute != "none"
+        or args.min_column_coverage > 0
+        or args.min_row_coverage > 0
+        or args.coverage_path is not None
+    ):
+        df_sdoh_pivoted, _, coverage = handle_missing(
+            df_sdoh_pivoted,
+            args.index_col,
+            strategy=args.impute,
+            min_column_coverage=args.min_column_coverage,
+            min_row_coverage=args.min_row_coverage,
+            zip_col=args.index_col[0],
+        )
+        if args.coverage_path is not None:
+            coverage.to_csv(args.coverage_path)
+
     # Save the cleaned and renamed DataFrame as a pickle file
     df_sdoh_pivoted.to_pickle(args.sdoh_edited_pickle_path)
 
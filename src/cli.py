@@ -0,0 +1,91 @@
+"""
+This module is the single command line entry point of the project. Each subcommand runs
+one of the project's scripts with the remaining arguments.
+
+Subcommands:
+- load: Loads a CSV file and saves it as a pickle file (loader.py).
+- clean: Cleans and pivots a pickled DataFrame (cleaner.py).
+- pivot: Pivots a CSV file larger than memory, one hash partition at a time (partition.py).
+- analyze: Calculates the correlation matrix of a pickled DataFrame (analysis.py).
+- plot: Plots histograms and correlation heatmaps (visualization.py).
+- run: Runs the full pipeline (main.py).
+- bench: Runs the benchmark suite (benchmark.py).
+- serve: Starts the local analysis service (service.py).
+
+Only the standard library is imported here: pandas, numpy and matplotlib are imported by
+the subcommand once it runs, so "python cli.py --help" and mistyped subcommands return
+immediately, and "run --help" returns before any pipeline module is imported.
+
+Usage:
+1. List the subcommands:
+    python cli.py --help
+
+2. Run a subcommand with the arguments of its script:
+    python cli.py run --sdoh_file data/sdoh.csv --correlation_matrix_path data/corr.csv
+        --figure_path data/hist.png --keep_columns ... --plot_columns ...
+    python cli.py plot --correlation_matrix_path data/corr.csv --heatmap_path data/heat.png
+
+3. Show the arguments of a subcommand:
+    python cli.py run --help
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import argparse
+import runpy
+import sys
+
+# Subcommand: (module, help)
+SUBCOMMANDS = {
+    "load": ("loader", "Load a CSV file and save it as a pickle file"),
+    "clean": ("cleaner", "Clean and pivot a pickled DataFrame"),
+    "pivot": ("partition", "Pivot a CSV file larger than memory out of core"),
+    "analyze": ("analysis", "Calculate the correlation matrix of a pickled DataFrame"),
+    "plot": ("visualization", "Plot histograms and correlation heatmaps"),
+    "run": ("main", "Run the full pipeline"),
+    "bench": ("benchmark", "Run the benchmark suite"),
+    "serve": ("service", "Start the local analysis service"),
+}
+
+
+# Define functions
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the argument parser of the command line entry point.
+
+    Returns:
+    - argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Social Determinants of Health analysis",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for command, (module, help_text) in SUBCOMMANDS.items():
+        subparser = subparsers.add_parser(command, help=help_text, add_help=False)
+        subparser.set_defaults(module=module)
+    return parser
+
+
+def run(argv: list = None) -> None:
+    """
+    Runs a subcommand's script as if it had been called directly.
+
+    Parameters:
+    - argv (list, optional): The command line arguments. Default is None (sys.argv[1:]).
+
+    Returns:
+    - None
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Only the subcommand is parsed here; its script parses the rest
+    args = build_parser().parse_args(argv[:1])
+    sys.argv = [f"{args.module}.py"] + argv[1:]
+    runpy.run_module(args.module, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    run()
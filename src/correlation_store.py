@@ -0,0 +1,247 @@
+"""
+This module saves correlation matrices in binary formats that can be memory-mapped, so
+single pairs or rows can be looked up without loading the full matrix.
+
+Formats:
+- csv: The matrix as text, without row labels (the original output of main.py).
+- npy: The full matrix as a float64 .npy file, plus a JSON sidecar with the labels.
+- triu: The packed upper triangle (diagonal included, row by row) as a 1-D .npy file,
+    plus a JSON sidecar with the labels. It takes about half the space of npy.
+- parquet: One float64 column per measure plus a "measure" column with the row labels.
+
+For the npy and triu formats the sidecar is written next to the matrix, with the
+extension replaced by ".labels.json" (e.g. data/correlation_matrix.labels.json). A row
+of a triu matrix is read as a contiguous slice for the upper part plus one element per
+earlier row for the lower part.
+
+Functions:
+- save_correlation_matrix(corr, path, fmt): Saves a correlation matrix.
+- load_correlation_matrix(path, fmt): Loads a correlation matrix as a DataFrame.
+
+Usage:
+1. Import the module:
+    import correlation_store
+
+2. Save a correlation matrix:
+    correlation_store.save_correlation_matrix(corr, "data/corr.npy", fmt="triu")
+
+3. Look up pairs and rows without loading the matrix:
+    store = correlation_store.CorrelationStore("data/corr.npy")
+    store.pair("Crowding among housing units", "Single-parent households")
+    store.row("Crowding among housing units")
+
+4. Or load the whole matrix:
+    corr = correlation_store.load_correlation_matrix("data/corr.npy")
+
+Parquet support requires the pyarrow package.
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from choices import CORRELATION_FORMATS
+
+logger = logging.getLogger(__name__)
+
+
+# Define functions
+def labels_path(path: str) -> str:
+    """
+    Returns the path of the labels sidecar of an npy or triu matrix file.
+
+    Parameters:
+    - path (str): The path of the matrix file.
+
+    Returns:
+    - str: The path of the sidecar.
+    """
+    return os.path.splitext(path)[0] + ".labels.json"
+
+
+def _infer_format(path: str) -> str:
+    """
+    Infers the format from the start of the file rather than its extension: an .npy
+    file's layout (npy or triu) is read from its sidecar.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    if magic.startswith(b"PAR1"):
+        return "parquet"
+    if magic == b"\x93NUMPY":
+        with open(labels_path(path), encoding="utf-8") as f:
+            return json.load(f)["layout"]
+    return "csv"
+
+
+def _triu_offsets(n: int) -> np.ndarray:
+    """
+    Returns the position of each row's diagonal element in a packed upper triangle.
+    """
+    rows = np.arange(n, dtype=np.int64)
+    return rows * n - rows * (rows - 1) // 2
+
+
+def save_correlation_matrix(corr: pd.DataFrame, path: str, fmt: str = "csv") -> None:
+    """
+    Saves a correlation matrix.
+
+    Parameters:
+    - corr (pd.DataFrame): A square correlation matrix with matching row and column labels.
+    - path (str): The path of the output file.
+    - fmt (str, optional): "csv", "npy", "triu" or "parquet". Default is "csv".
+
+    Returns:
+    - None
+    """
+    if fmt not in CORRELATION_FORMATS:
+        raise ValueError(f"fmt must be one of {CORRELATION_FORMATS}, got {fmt!r}")
+
+    if fmt == "csv":
+        corr.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df = corr.astype(np.float64)
+        df.columns = [str(col) for col in df.columns]
+        df.insert(0, "measure", [str(label) for label in corr.index])
+        df.to_parquet(path, index=False)
+    else:
+        matrix = corr.to_numpy(dtype=np.float64, na_value=np.nan)
+        if fmt == "triu":
+            matrix = matrix[np.triu_indices(len(matrix))]
+        # Write through a file handle so numpy keeps the path as given
+        with open(path, "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix))
+        with open(labels_path(path), "w", encoding="utf-8") as f:
+            json.dump(
+                {"layout": fmt, "labels": [str(label) for label in corr.columns]}, f
+            )
+    logger.info("Correlation matrix saved successfully at %s", path)
+
+
+def load_correlation_matrix(path: str, fmt: str = None) -> pd.DataFrame:
+    """
+    Loads a correlation matrix saved by save_correlation_matrix.
+
+    Parameters:
+    - path (str): The path of the matrix file.
+    - fmt (str, optional): The format. Default is None (inferred from the file and,
+        for npy and triu matrices, the sidecar).
+
+    Returns:
+    - pd.DataFrame: The correlation matrix, labelled on both axes.
+    """
+    fmt = fmt or _infer_format(path)
+    if fmt == "csv":
+        # The CSV has no row labels; they match the column labels
+        df = pd.read_csv(path)
+        df.index = df.columns
+        return df
+    return CorrelationStore(path, fmt).to_frame()
+
+
+# Define classes
+class CorrelationStore:
+    """
+    Read-only, memory-mapped access to a correlation matrix saved in a binary format.
+
+    Only the bytes of the requested pairs or rows are read from disk (for Parquet, only
+    the requested columns; the matrix is symmetric, so a column is also a row).
+    """
+
+    def __init__(self, path: str, fmt: str = None):
+        self.path = path
+        self.fmt = fmt or _infer_format(path)
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self._parquet = pq.ParquetFile(path, memory_map=True)
+            self.labels = self._parquet.schema_arrow.names[1:]
+        elif self.fmt in ("npy", "triu"):
+            with open(labels_path(path), encoding="utf-8") as f:
+                self.labels = json.load(f)["labels"]
+            self._data = np.load(path, mmap_mode="r")
+        else:
+            raise ValueError(f"Format {self.fmt!r} cannot be memory-mapped")
+        self._positions = {label: i for i, label in enumerate(self.labels)}
+        if self.fmt == "triu":
+            self._offsets = _triu_offsets(len(self.labels))
+
+    def _position(self, label) -> int:
+        try:
+            return self._positions[str(label)]
+        except KeyError:
+            raise KeyError(f"Unknown measure: {label!r}") from None
+
+    def pair(self, label_1, label_2) -> float:
+        """
+        Returns the correlation between two measures.
+
+        Parameters:
+        - label_1, label_2: The measure names.
+
+        Returns:
+        - float: The correlation.
+        """
+        i, j = self._position(label_1), self._position(label_2)
+        if self.fmt == "npy":
+            return float(self._data[i, j])
+        if self.fmt == "triu":
+            i, j = min(i, j), max(i, j)
+            return float(self._data[self._offsets[i] + j - i])
+        column = self._parquet.read(columns=[self.labels[j]]).column(0)
+        return float(column[i].as_py() if column[i].is_valid else np.nan)
+
+    def row(self, label) -> pd.Series:
+        """
+        Returns the correlations of one measure with every measure.
+
+        Parameters:
+        - label: The measure name.
+
+        Returns:
+        - pd.Series: The correlations, indexed by measure.
+        """
+        i = self._position(label)
+        if self.fmt == "npy":
+            values = np.array(self._data[i])
+        elif self.fmt == "triu":
+            # Earlier rows hold (j, i) for j < i; this row holds (i, j) for j >= i
+            lower = self._data[self._offsets[:i] + i - np.arange(i)]
+            upper = self._data[
+                self._offsets[i] : self._offsets[i] + len(self.labels) - i
+            ]
+            values = np.concatenate([lower, upper])
+        else:
+            values = (
+                self._parquet.read(columns=[self.labels[i]])
+                .column(0)
+                .to_numpy(zero_copy_only=False)
+            )
+        return pd.Series(values, index=self.labels, name=self.labels[i])
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Loads the full matrix.
+
+        Returns:
+        - pd.DataFrame: The correlation matrix, labelled on both axes.
+        """
+        n = len(self.labels)
+        if self.fmt == "npy":
+            matrix = np.array(self._data)
+        elif self.fmt == "triu":
+            matrix = np.empty((n, n))
+            rows, cols = np.triu_indices(n)
+            matrix[rows, cols] = self._data
+            matrix[cols, rows] = self._data
+        else:
+            df = self._parquet.read().to_pandas()
+            return df.set_index("measure").rename_axis(None)
+        return pd.DataFrame(matrix, index=self.labels, columns=self.labels)
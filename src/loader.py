@@ -3,7 +3,9 @@ This module provides functions to load CSV files into pandas DataFrames.
 
 Functions:
 - load_csv_file(file_path, pickle_path): Loads a CSV file into a pandas DataFrame 
-    and optionally saves it as a pickle file.
+    and optionally saves it as a pickle file. Parsed frames can be cached on disk.
+- iter_csv_chunks(file_path, usecols, dtype, chunksize): Streams a CSV file chunk by chunk,
+    reading only the requested columns.
 
 Usage:
 1. Import the module:
@@ -11,41 +13,127 @@ Usage:
 2. Load a CSV file:
         df = loader.load_csv_file(file_path, pickle_path)
 
+3. Load only some columns, streaming the file in chunks:
+        df = loader.load_csv_file(file_path, usecols=cols_to_keep, chunksize=100000)
+
 Parameters:
 - file_path (str): The path to the CSV file.
 - pickle_path (str, optional): The path to save the pickle file. Default is None.
+- usecols (list, optional): The columns to read. Other columns are never materialized.
+- dtype (dict, optional): An explicit mapping of column name to dtype.
+- chunksize (int, optional): The number of rows to parse at a time. Default is None.
+- cache_dir (str, optional): A directory for the columnar cache (see cache.py). Default is None.
+- cache_format (str, optional): The cache format, "feather" or "parquet". Default is "feather".
+- optimize (bool, optional): Shrink column dtypes after loading (see cleaner.optimize_dtypes).
+    Default is False.
 
 Returns:
 - pd.DataFrame: The loaded data as a pandas DataFrame.
 
 Example:
         python loader.py data/SDOH_Measures_for_ZCTA__ACS_2017-2021_20240121.csv data/df_sdoh.pkl
+        python loader.py data/SDOH_Measures_for_ZCTA__ACS_2017-2021_20240121.csv data/df_sdoh.pkl 
+        --usecols "LocationName" "Measure" "Data_Value" "TotalPopulation" --chunksize 100000
+        --cache_dir data/.cache --optimize_dtypes
 
 Author: Anuvrat Chaturvedi
 Date: 2024-03-17
 """
 
 # Import packages
+import logging
+from typing import Iterator
+
 import pandas as pd
 
+from cache import cache_key, cached_frame
+from cleaner import optimize_dtypes
+
+logger = logging.getLogger(__name__)
+
+
+def iter_csv_chunks(
+    file_path: str, usecols: list = None, dtype: dict = None, chunksize: int = 100000
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams a CSV file chunk by chunk, reading only the requested columns.
+
+    Columns not listed in usecols are skipped by the parser, so they are never
+    materialized in memory.
+
+    Parameters:
+    - file_path (str): The path to the CSV file.
+    - usecols (list, optional): The columns to read. Default is None (all columns).
+    - dtype (dict, optional): An explicit mapping of column name to dtype. Default is None.
+    - chunksize (int, optional): The number of rows per chunk. Default is 100000.
 
-def load_csv_file(file_path: str, pickle_path: str = "None") -> pd.DataFrame:
+    Yields:
+    - pd.DataFrame: The next chunk of the file.
+    """
+    with pd.read_csv(
+        file_path, usecols=usecols, dtype=dtype, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def load_csv_file(
+    file_path: str,
+    pickle_path: str = "None",
+    usecols: list = None,
+    dtype: dict = None,
+    chunksize: int = None,
+    cache_dir: str = None,
+    cache_format: str = "feather",
+    optimize: bool = False,
+) -> pd.DataFrame:
     """
     Loads a CSV file into a pandas DataFrame and optionally saves it as a pickle file.
 
     Parameters:
     - file_path (str): The path to the CSV file.
     - pickle_path (str, optional): The path to save the pickle file. Default is None.
+    - usecols (list, optional): The columns to read. Default is None (all columns).
+    - dtype (dict, optional): An explicit mapping of column name to dtype. Default is None.
+    - chunksize (int, optional): If given, the file is streamed in chunks of this many rows
+        and the chunks are concatenated. Default is None (single read).
+    - cache_dir (str, optional): If given, the parsed frame is cached in this directory,
+        keyed by the file fingerprint and the loader options. A cache hit skips CSV
+        parsing entirely. Default is None (no cache).
+    - cache_format (str, optional): The cache format, "feather" or "parquet".
+        Default is "feather".
+    - optimize (bool, optional): If True, repeated strings become categoricals and integers
+        are downcast (see cleaner.optimize_dtypes). Default is False.
 
     Returns:
     - pd.DataFrame: The loaded data as a pandas DataFrame.
     """
-    data = pd.read_csv(file_path)
-    print("\nData loaded successfully\n")
+
+    def read() -> pd.DataFrame:
+        if chunksize is None:
+            df = pd.read_csv(file_path, usecols=usecols, dtype=dtype)
+        else:
+            df = pd.concat(
+                iter_csv_chunks(file_path, usecols, dtype, chunksize), ignore_index=True
+            )
+        return optimize_dtypes(df) if optimize else df
+
+    if cache_dir is None:
+        data = read()
+    else:
+        options = {
+            "stage": "load",
+            "usecols": usecols,
+            "dtype": dtype,
+            "optimize": optimize,
+        }
+        key = cache_key(file_path, options)
+        data = cached_frame(cache_dir, key, read, cache_format, stage="load")
+    logger.info("Data loaded successfully")
 
     if pickle_path != "None":
         data.to_pickle(pickle_path)
-        print("\nData saved as pickle file\n")
+        logger.info("Data saved as pickle file")
     return data
 
 
@@ -53,6 +141,8 @@ def load_csv_file(file_path: str, pickle_path: str = "None") -> pd.DataFrame:
 if __name__ == "__main__":
     import argparse
 
+    from profiling import configure_logging
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "sdoh_file", help="CSV file path for Social Determinants of Health"
@@ -62,15 +152,46 @@ if __name__ == "__main__":
         help="Path where output Pickle file for SDOH should be stored",
         nargs="?",
     )
+    parser.add_argument(
+        "--usecols",
+        help="List of columns to read from the CSV file",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows to read at a time when streaming the CSV file",
+        type=int,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory for the columnar cache of parsed CSV files",
+    )
+    parser.add_argument(
+        "--optimize_dtypes",
+        help="Convert repeated strings to categoricals and downcast integers",
+        action="store_true",
+    )
 
     args = parser.parse_args()
+    configure_logging()
 
     # Load the DataFrame from the CSV file and optionally save it as a pickle file
     if args.sdoh_pickle_path is None:
-        df_sdoh = load_csv_file(file_path=args.sdoh_file)
+        df_sdoh = load_csv_file(
+            file_path=args.sdoh_file,
+            usecols=args.usecols,
+            chunksize=args.chunksize,
+            cache_dir=args.cache_dir,
+            optimize=args.optimize_dtypes,
+        )
     else:
         df_sdoh = load_csv_file(
-            file_path=args.sdoh_file, pickle_path=args.sdoh_pickle_path
+            file_path=args.sdoh_file,
+            pickle_path=args.sdoh_pickle_path,
+            usecols=args.usecols,
+            chunksize=args.chunksize,
+            cache_dir=args.cache_dir,
+            optimize=args.optimize_dtypes,
         )
 
     print("\nSample records for Social Determinants of Health:\n")
@@ -8,7 +8,9 @@ It imports functions from the following modules:
 
 The module expects the following command line arguments:
 - `--sdoh_file`: CSV file path for Social Determinants of Health
-- `--correlation_matrix_path`: Path to save the correlation matrix as a CSV file
+- `--correlation_matrix_path`: Path to save the correlation matrix
+- `--correlation_format`: Correlation matrix file format, `csv` (default), `npy`, `triu`
+  (packed upper triangle) or `parquet`; `npy` and `triu` write a `.labels.json` sidecar
 - `--figure_path`: Path to save the histogram as a figure
 - `--keep_columns`: List of columns to keep in the DataFrame
 - `--rename_columns_old`: List of old column names to be renamed in the DataFrame
@@ -17,16 +19,85 @@ The module expects the following command line arguments:
 - `--columns_col`: List of columns to be used as the columns for the pivoted DataFrame
 - `--values_col`: List of columns to be used as the values for the pivoted DataFrame
 - `--plot_columns`: List of columns in the DataFrame to plot the histogram for
+- `--chunksize`: Optional number of rows to read at a time when streaming the CSV file
+- `--cache_dir`: Optional directory for the result cache of the cleaned and pivoted data
+  and the correlation matrix
+- `--cache_max_mb`: Optional size limit of the result cache (least recently used entries
+  are evicted)
+- `--no-cache`: Ignore `--cache_dir` and recompute every stage
+- `--optimize_dtypes`: Optionally convert repeated strings to categoricals and downcast integers
+- `--pivot_engine`: Pivot engine, `pandas` (default) or `numpy`
+- `--pivot_aggfunc`: How the numpy pivot engine combines duplicates (first/mean/sum/count)
+- `--corr_engine`: Correlation engine, `pandas` (default) or `numpy`
+- `--corr_method`: Correlation method, `pearson` (default), `spearman` or `kendall`
+- `--n_jobs`: Number of threads for the numpy correlation engine and the bootstrap
+- `--bootstrap`: Optional number of bootstrap resamples for confidence intervals and p-values
+  of the unweighted Pearson correlation
+- `--significance_path`: Path to save the estimates, confidence bounds and p-values as a CSV file
+- `--seed`: Optional seed for the bootstrap resampling
+- `--ci`: Confidence level of the bootstrap intervals (default 0.95)
+- `--bootstrap_memory_mb`: Approximate memory budget of each batch of bootstrap resamples
+  (default 256)
+- `--weighted`: Optionally calculate the Pearson correlation weighted by `--weight_col`
+- `--weight_col`: Column holding the row weights (default `TotalPopulation`)
+- `--sdoh_files`: Optional CSV files or glob patterns to process as one batch instead of `--sdoh_file`
+- `--manifest`: Optional text file listing the batch input files, one path or pattern per line
+- `--n_workers`: Number of worker processes for the batch (default: one per CPU) or the
+  out-of-core pivot (default: one)
+- `--max_memory_mb`: Optional address-space cap for each batch worker
+- `--batch_output_dir`: Optional directory for per-file batch outputs instead of one combined frame
+- `--hist_engine`: Histogram engine, `matplotlib` (default) or `binned`
+- `--hist_counts_path`: Optional path to save the histogram bin edges and counts as a CSV file
+- `--heatmap_path`: Optional path to save the correlation matrix as a heatmap figure
+- `--heatmap_cluster`: Optionally reorder the heatmap by hierarchical clustering
+- `--lazy`: Optionally run steps 2-4 as an optimized lazy pipeline (see `pipeline.py`)
+- `--impute`: Imputation of the measures missing after the pivot, `none` (default), `median`,
+  `weighted_mean` (weighted by `--weight_col`) or `knn` (mean of the nearest ZIP codes)
+- `--min_column_coverage`: Optionally drop measures present in fewer of the ZCTAs
+- `--min_row_coverage`: Optionally drop ZCTAs with fewer of the measures present
+- `--coverage_path`: Optional path to save the per-measure and per-pair coverage as a CSV file
+- `--out_of_core`: Optionally pivot out of core, hash-partitioning the rows by index key
+  into spill files and pivoting one partition at a time (see `partition.py`)
+- `--spill_dir`: Optional directory for the out-of-core spill files
+- `--spill_memory_mb`: Memory ceiling for the out-of-core pivot (default 1024)
+- `--stream`: Optionally run the lazy pipeline streamed, pivoting `--chunksize` rows at a time
+- `--explain`: Optionally log the optimized plan of the lazy pipeline
+- `--profile`: Optional path to save the per-stage timing and memory report as JSON
+  (`-` prints it)
+- `--log_level`: Logging level, e.g. `DEBUG`, `INFO` (default) or `WARNING`
 
 The module performs the following steps:
 1. Parses the command line arguments
-2. Loads the DataFrame from the CSV file specified by `--sdoh_file`
+2. Loads the DataFrame from the CSV file specified by `--sdoh_file`, reading only
+   the columns listed in `--keep_columns`
 3. Cleans the DataFrame by keeping only the specified columns and renaming them
-4. Pivots the cleaned DataFrame based on the specified index, columns, and values
+4. Pivots the cleaned DataFrame based on the specified index, columns, and values, then
+   reports the coverage of the measures, drops sparse ones and imputes missing values if
+   `--impute`, `--min_column_coverage`, `--min_row_coverage` or `--coverage_path` is given
 5. Calculates the correlation matrix of the pivoted DataFrame
-6. Saves the correlation matrix as a CSV file specified by `--correlation_matrix_path`
+6. Saves the correlation matrix to `--correlation_matrix_path` in `--correlation_format`
 7. Plots a histogram of the specified columns and saves it as a figure specified by `--figure_path`
 
+With `--sdoh_files` or `--manifest`, steps 2-4 run for every input file on a process pool
+(see `batch.py`). The pivoted frames are combined into one before steps 5-7. With
+`--batch_output_dir`, each file's pivoted pickle and correlation matrix are written there
+instead, and only the combined correlation matrix is saved (no bootstrap or histogram).
+That matrix is the unweighted Pearson correlation, so `--weighted`, `--corr_method` and
+`--corr_engine` are rejected with `--batch_output_dir`.
+
+With `--profile`, every stage (load, keep_columns, rename_columns, pivot, correlation,
+histogram, ...) is timed and its peak memory and input/output frame shapes are recorded
+(see `profiling.py`).
+
+When `--cache_dir` is given, each stage is skipped on re-runs with the same input file and
+the same stage arguments: the cleaned frame (keep and rename), the pivoted frame and the
+correlation matrix are read back from the cache, so changing only `--plot_columns` or
+`--figure_path` recomputes nothing. The hits and misses are logged at the end of the run.
+
+pandas, numpy and matplotlib are imported only after the arguments are parsed, so
+`--help` and argument errors return without loading them. The same script runs as
+`python cli.py run` (see `cli.py`).
+
 Example usage:
 python main.py --sdoh_file data/SDOH_Measures_for_ZCTA__ACS_2017-2021_20240121.csv 
 --correlation_matrix_path data/correlation_matrix.csv 
@@ -42,10 +113,21 @@ Date: 2024-03-17
 """
 
 # Import packages
-from loader import load_csv_file
-from cleaner import keep_columns, rename_columns, pivot
-from analysis import correlation_matrix
-from visualization import plot_histogram
+# Only lightweight modules are imported up front, so --help and argument errors do not
+# wait for pandas and matplotlib; the pipeline modules are imported after parsing
+import logging
+
+from choices import (
+    CORRELATION_ENGINES,
+    CORRELATION_FORMATS,
+    CORRELATION_METHODS,
+    HISTOGRAM_ENGINES,
+    IMPUTE_STRATEGIES,
+    PIVOT_AGGFUNCS,
+    PIVOT_ENGINES,
+)
+
+logger = logging.getLogger(__name__)
 
 # Main functionality: Perform data cleaning, analysis, and saving of a correlation matrix
 # It can be run from the command line
@@ -61,7 +143,14 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--correlation_matrix_path",
-        help="Path to save the correlation matrix as a CSV file",
+        help="Path to save the correlation matrix",
+    )
+    parser.add_argument(
+        "--correlation_format",
+        help="Correlation matrix file format: csv, npy (full matrix), triu "
+        "(packed upper triangle) or parquet",
+        choices=CORRELATION_FORMATS,
+        default="csv",
     )
     parser.add_argument(
         "--figure_path",
@@ -102,36 +191,479 @@ if __name__ == "__main__":
         help="List of columns in the DataFrame to plot the histogram for",
         nargs="+",
     )
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows to read at a time when streaming the CSV file",
+        type=int,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory for the result cache of the cleaned and pivoted data and the "
+        "correlation matrix",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        help="Size limit of the result cache; least recently used entries are evicted",
+        type=float,
+    )
+    parser.add_argument(
+        "--no_cache",
+        "--no-cache",
+        help="Ignore --cache_dir and recompute every stage",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--optimize_dtypes",
+        help="Convert repeated strings to categoricals and downcast integers after loading",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pivot_engine",
+        help="Pivot engine: pandas (DataFrame.pivot) or numpy (single-pass scatter)",
+        choices=PIVOT_ENGINES,
+        default="pandas",
+    )
+    parser.add_argument(
+        "--pivot_aggfunc",
+        help="How the numpy pivot engine combines duplicate index/columns pairs",
+        choices=PIVOT_AGGFUNCS,
+        default="first",
+    )
+    parser.add_argument(
+        "--corr_engine",
+        help="Correlation engine: pandas (DataFrame.corr) or numpy (blocked BLAS)",
+        choices=CORRELATION_ENGINES,
+        default="pandas",
+    )
+    parser.add_argument(
+        "--corr_method",
+        help="Correlation method: pearson, spearman or kendall",
+        choices=CORRELATION_METHODS,
+        default="pearson",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        help="Number of threads for the numpy correlation engine and the bootstrap",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--bootstrap",
+        help="Number of bootstrap resamples for confidence intervals and p-values of "
+        "the unweighted Pearson correlation",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--significance_path",
+        help="Path to save the estimates, confidence bounds and p-values as a CSV file",
+    )
+    parser.add_argument("--seed", help="Seed for the bootstrap resampling", type=int)
+    parser.add_argument(
+        "--ci",
+        help="Confidence level of the bootstrap intervals",
+        type=float,
+        default=0.95,
+    )
+    parser.add_argument(
+        "--bootstrap_memory_mb",
+        help="Approximate memory budget of each batch of bootstrap resamples",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--weighted",
+        help="Calculate the Pearson correlation weighted by --weight_col",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--weight_col",
+        help="Column holding the row weights for --weighted",
+        default="TotalPopulation",
+    )
+    parser.add_argument(
+        "--sdoh_files",
+        help="CSV files or glob patterns to process as one batch",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Text file listing the batch input files, one path or pattern per line",
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes for the batch or the out-of-core pivot",
+        type=int,
+    )
+    parser.add_argument(
+        "--max_memory_mb",
+        help="Address-space cap for each batch worker in megabytes",
+        type=int,
+    )
+    parser.add_argument(
+        "--batch_output_dir",
+        help="Directory for per-file batch outputs instead of one combined frame",
+    )
+    parser.add_argument(
+        "--hist_engine",
+        help="Histogram engine: matplotlib (axes.hist) or binned (precomputed counts)",
+        choices=HISTOGRAM_ENGINES,
+        default="matplotlib",
+    )
+    parser.add_argument(
+        "--hist_counts_path",
+        help="Path to save the histogram bin edges and counts as a CSV file",
+    )
+    parser.add_argument(
+        "--heatmap_path",
+        help="Path to save the correlation matrix as a heatmap figure",
+    )
+    parser.add_argument(
+        "--heatmap_cluster",
+        help="Reorder the heatmap by hierarchical clustering",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--lazy",
+        help="Run the load, clean and pivot steps as an optimized lazy pipeline",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--impute",
+        help="Imputation of the measures missing after the pivot: none, median, "
+        "weighted_mean (by --weight_col) or knn (nearest ZIP codes)",
+        choices=IMPUTE_STRATEGIES,
+        default="none",
+    )
+    parser.add_argument(
+        "--min_column_coverage",
+        help="Drop measures present in a smaller fraction of the ZCTAs",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--min_row_coverage",
+        help="Drop ZCTAs with a smaller fraction of the measures present",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--coverage_path",
+        help="Path to save the per-measure and per-pair coverage as a CSV file",
+    )
+    parser.add_argument(
+        "--out_of_core",
+        help="Pivot out of core: hash-partition the rows by index key into spill files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--spill_dir",
+        help="Directory for the out-of-core spill files (default: system temp directory)",
+    )
+    parser.add_argument(
+        "--spill_memory_mb",
+        help="Memory ceiling in megabytes for the out-of-core pivot",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--stream",
+        help="Run the lazy pipeline streamed, pivoting --chunksize rows at a time; "
+        "fastest when the rows of each index key are contiguous in the file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--explain",
+        help="Log the optimized plan of the lazy pipeline",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Path to save the per-stage timing and memory report as JSON (- prints it)",
+    )
+    parser.add_argument(
+        "--log_level",
+        help="Logging level, e.g. DEBUG, INFO or WARNING",
+        default="INFO",
+    )
     # Parse the arguments
     args = parser.parse_args()
+    if args.bootstrap > 0 and args.significance_path is None:
+        parser.error("--bootstrap needs --significance_path")
+    if args.bootstrap > 0 and (args.weighted or args.corr_method != "pearson"):
+        parser.error("--bootstrap supports the unweighted pearson correlation only")
+    if args.batch_output_dir is not None and (
+        args.weighted or args.corr_method != "pearson" or args.corr_engine != "pandas"
+    ):
+        parser.error(
+            "--batch_output_dir combines the unweighted pearson correlation only; "
+            "--weighted, --corr_method and --corr_engine are not supported"
+        )
 
-    # Load the DataFrame from the CSV file
-    df_sdoh = load_csv_file(args.sdoh_file)
-
-    # Clean the DataFrame
-    df_sdoh_cleaned = keep_columns(df_sdoh, args.keep_columns)
-    df_sdoh_cleaned = rename_columns(
-        df_sdoh_cleaned, dict(zip(args.rename_columns_old, args.rename_columns_new))
+    from analysis import (
+        correlation_bootstrap,
+        correlation_matrix,
+        weighted_correlation_matrix,
+    )
+    from batch import expand_inputs, load_and_pivot_file, run_batch
+    from cache import cache_key, cache_stats, cached_frame
+    from cleaner import handle_missing
+    from correlation_store import save_correlation_matrix
+    from partition import pivot_out_of_core
+    from pipeline import Pipeline
+    from profiling import configure_logging, StageProfiler
+    from visualization import (
+        histogram_counts,
+        plot_correlation_heatmap,
+        plot_histogram,
     )
-    df_sdoh_pivoted = pivot(
-        df_sdoh_cleaned,
-        index_col=args.index_col,
-        columns_col=args.columns_col,
-        values_col=args.values_col,
+
+    configure_logging(args.log_level)
+    profiler = StageProfiler(enabled=args.profile is not None)
+    if args.no_cache:
+        args.cache_dir = None
+
+    # Options for loading, cleaning (keep/rename) and pivoting each input file
+    pivot_options = {
+        "keep_columns": args.keep_columns,
+        "rename_columns": dict(zip(args.rename_columns_old, args.rename_columns_new)),
+        "index_col": args.index_col,
+        "columns_col": args.columns_col,
+        "values_col": args.values_col,
+        "chunksize": args.chunksize,
+        "cache_dir": args.cache_dir,
+        "cache_max_mb": args.cache_max_mb,
+        "optimize": args.optimize_dtypes,
+        "pivot_engine": args.pivot_engine,
+        "pivot_aggfunc": args.pivot_aggfunc,
+    }
+
+    # The arguments that determine the pivoted frame, for the result cache keys. The
+    # eager, lazy, streamed and out-of-core runs give the same frame, so how it is
+    # computed (and the chunk size) is not part of the key
+    pivot_cache_options = {
+        "keep_columns": args.keep_columns,
+        "rename_columns_old": args.rename_columns_old,
+        "rename_columns_new": args.rename_columns_new,
+        "index_col": args.index_col,
+        "columns_col": args.columns_col,
+        "values_col": args.values_col,
+        "optimize_dtypes": args.optimize_dtypes,
+        "pivot_engine": args.pivot_engine,
+        "pivot_aggfunc": args.pivot_aggfunc,
+    }
+
+    # The same steps as a lazy pipeline, with projection and renames pushed into the read
+    if args.lazy or args.stream or args.explain:
+        lazy_pipeline = (
+            Pipeline(args.sdoh_file)
+            .keep_columns(args.keep_columns)
+            .rename_columns(pivot_options["rename_columns"])
+        )
+        if args.optimize_dtypes:
+            lazy_pipeline = lazy_pipeline.optimize_dtypes()
+        lazy_pipeline = lazy_pipeline.pivot(
+            args.index_col,
+            args.columns_col,
+            args.values_col,
+            engine=args.pivot_engine,
+            aggfunc=args.pivot_aggfunc,
+        )
+        if args.explain:
+            logger.info("Optimized plan:\n%s", lazy_pipeline.explain())
+
+    def load_and_pivot():
+        if args.out_of_core:
+            return profiler.run(
+                "pivot_out_of_core",
+                pivot_out_of_core,
+                args.sdoh_file,
+                keep_columns=args.keep_columns,
+                rename_columns=pivot_options["rename_columns"],
+                index_col=args.index_col,
+                columns_col=args.columns_col,
+                values_col=args.values_col,
+                engine=args.pivot_engine,
+                aggfunc=args.pivot_aggfunc,
+                max_memory_mb=args.spill_memory_mb,
+                temp_dir=args.spill_dir,
+                n_workers=args.n_workers or 1,
+                chunksize=args.chunksize,
+            )
+        if args.lazy or args.stream:
+            return lazy_pipeline.collect(
+                stream=args.stream,
+                chunksize=args.chunksize or 100000,
+                profiler=profiler,
+            )
+        # Load, clean and pivot the CSV file, reading only the columns we keep
+        return load_and_pivot_file(args.sdoh_file, profiler=profiler, **pivot_options)
+
+    # Load, clean and pivot the data, reusing the cached pivot when the inputs are unchanged
+    accumulator = None
+    if args.sdoh_files or args.manifest:
+        df_sdoh_pivoted, accumulator = profiler.run(
+            "batch",
+            run_batch,
+            expand_inputs(args.sdoh_files, args.manifest),
+            pivot_options,
+            n_workers=args.n_workers,
+            max_memory_mb=args.max_memory_mb,
+            output_dir=args.batch_output_dir,
+        )
+    elif args.cache_dir is None:
+        df_sdoh_pivoted = load_and_pivot()
+    else:
+        df_sdoh_pivoted = profiler.run(
+            "cached_pivot",
+            cached_frame,
+            args.cache_dir,
+            cache_key(args.sdoh_file, {"stage": "pivot", **pivot_cache_options}),
+            load_and_pivot,
+            stage="pivot",
+            max_size_mb=args.cache_max_mb,
+        )
+
+    # Report the coverage of the measures, drop sparse ones and impute the rest, if requested
+    missing_options = {
+        "strategy": args.impute,
+        "min_column_coverage": args.min_column_coverage,
+        "min_row_coverage": args.min_row_coverage,
+        "weight_col": args.weight_col,
+    }
+    handles_missing = (
+        args.impute != "none"
+        or args.min_column_coverage > 0
+        or args.min_row_coverage > 0
+        or args.coverage_path is not None
     )
+    if handles_missing and df_sdoh_pivoted is not None:
+        df_sdoh_pivoted, _, coverage = profiler.run(
+            "missing_data",
+            handle_missing,
+            df_sdoh_pivoted,
+            args.index_col,
+            zip_col=args.index_col[0],
+            **missing_options,
+        )
+        if args.coverage_path is not None:
+            coverage.to_csv(args.coverage_path)
+            logger.info("Coverage report saved successfully as a CSV file")
 
     # Calculate the correlation matrix
-    correlation_matrix_df = correlation_matrix(df_sdoh_pivoted)
+    def calculate_correlation():
+        if args.weighted:
+            return profiler.run(
+                "correlation",
+                weighted_correlation_matrix,
+                df_sdoh_pivoted,
+                weight_col=args.weight_col,
+                n_jobs=args.n_jobs,
+            )
+        return profiler.run(
+            "correlation",
+            correlation_matrix,
+            df_sdoh_pivoted,
+            engine=args.corr_engine,
+            n_jobs=args.n_jobs,
+            method=args.corr_method,
+        )
 
-    # Save the correlation matrix as a CSV file
-    correlation_matrix_df.to_csv(args.correlation_matrix_path, index=False)
-    print("\nCorrelation matrix saved successfully as a CSV file\n")
+    if accumulator is not None:
+        correlation_matrix_df = profiler.run("correlation", accumulator.finalize)
+    elif args.cache_dir is None or args.sdoh_files or args.manifest:
+        correlation_matrix_df = calculate_correlation()
+    else:
+        correlation_key = cache_key(
+            args.sdoh_file,
+            {
+                "stage": "correlation",
+                **pivot_cache_options,
+                "weighted": args.weighted,
+                "weight_col": args.weight_col if args.weighted else None,
+                "corr_engine": args.corr_engine,
+                "corr_method": args.corr_method,
+                "missing_data": missing_options,
+            },
+        )
+        correlation_matrix_df = profiler.run(
+            "cached_correlation",
+            cached_frame,
+            args.cache_dir,
+            correlation_key,
+            calculate_correlation,
+            stage="correlation",
+            max_size_mb=args.cache_max_mb,
+        )
+        # The cache stores the matrix without its row labels; they match the columns
+        correlation_matrix_df.index = correlation_matrix_df.columns
 
-    # Save the histogram
-    plot_histogram(
-        df=df_sdoh_pivoted,
-        columns=args.plot_columns,
-        title=f"SDOH Histogram (N={df_sdoh_pivoted.shape[0]})",
-        bins=10,
-        path=args.figure_path,
+    # Save the correlation matrix in the requested format
+    profiler.run(
+        "save_correlation",
+        save_correlation_matrix,
+        correlation_matrix_df,
+        args.correlation_matrix_path,
+        fmt=args.correlation_format,
     )
+
+    # Save the correlation heatmap, if requested
+    if args.heatmap_path is not None:
+        profiler.run(
+            "heatmap",
+            plot_correlation_heatmap,
+            correlation_matrix_df,
+            path=args.heatmap_path,
+            cluster=args.heatmap_cluster,
+        )
+
+    # Save the bootstrap confidence intervals and p-values, if requested
+    # (per-file batch outputs have no combined frame to bootstrap or plot)
+    if args.bootstrap > 0 and df_sdoh_pivoted is not None:
+        profiler.run(
+            "bootstrap",
+            correlation_bootstrap,
+            df_sdoh_pivoted,
+            n_boot=args.bootstrap,
+            ci=args.ci,
+            seed=args.seed,
+            n_jobs=args.n_jobs,
+            batch_memory_mb=args.bootstrap_memory_mb,
+        ).to_csv(args.significance_path, index=False)
+        logger.info("Correlation significance saved successfully as a CSV file")
+
+    # Save the histogram counts, if requested, and the histogram
+    if df_sdoh_pivoted is not None:
+        if args.hist_counts_path is not None:
+            profiler.run(
+                "histogram_counts",
+                histogram_counts,
+                df_sdoh_pivoted,
+                args.plot_columns,
+                bins=10,
+            ).to_csv(args.hist_counts_path, index=False)
+        profiler.run(
+            "histogram",
+            plot_histogram,
+            df=df_sdoh_pivoted,
+            columns=args.plot_columns,
+            title=f"SDOH Histogram (N={df_sdoh_pivoted.shape[0]})",
+            bins=10,
+            path=args.figure_path,
+            engine=args.hist_engine,
+        )
+
+    # Report how often the result cache was used
+    if args.cache_dir is not None:
+        stats = cache_stats(args.cache_dir)
+        logger.info(
+            "Result cache: %d hits, %d misses, %d entries (%.1f MB)",
+            stats["hits"],
+            stats["misses"],
+            stats.get("entries", 0),
+            stats.get("size_mb", 0.0),
+        )
+
+    # Save the per-stage profile, if requested
+    if args.profile is not None:
+        profiler.save(args.profile)
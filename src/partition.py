@@ -0,0 +1,391 @@
+"""
+This module pivots CSV files that are larger than memory by hash-partitioning the rows
+by their index key.
+
+cleaner.pivot needs the whole long-format frame in memory. The out-of-core pivot instead:
+1. Streams the CSV file in chunks, keeping and renaming the columns of each chunk.
+2. Hashes the index key (e.g. ZIP and TotalPopulation) of every row and appends the row
+    to one of n_partitions spill files on disk, so all rows of a key land in the same
+    partition, in file order.
+3. Pivots each partition on its own with cleaner.pivot, on a process pool if
+    n_workers > 1.
+4. Concatenates the pivoted partitions and sorts them like an in-memory pivot, or yields
+    them one at a time so the wide result never has to be in memory either.
+
+The chunk size and the number of partitions are derived from a memory ceiling and an
+estimate of the in-memory size of the rows, taken from a sample at the top of the file.
+Spill files are written to a temporary directory, which is removed afterwards.
+
+Functions:
+- iter_pivot_partitions(file_path, ...): Yields the pivoted partitions one at a time.
+- pivot_out_of_core(file_path, ...): Returns the full pivoted DataFrame, matching
+    cleaner.pivot on the loaded, cleaned frame.
+
+Usage:
+1. Import the module:
+    import partition
+
+2. Pivot a large CSV file within a memory ceiling:
+    df_pivoted = partition.pivot_out_of_core(
+        "data/sdoh.csv",
+        keep_columns=["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        rename_columns={"LocationName": "ZIP"},
+        index_col=["ZIP", "TotalPopulation"],
+        columns_col=["Measure"],
+        values_col=["Data_Value"],
+        max_memory_mb=1024,
+        temp_dir="/scratch",
+        n_workers=4,
+    )
+
+3. Or stream the pivoted partitions, e.g. to write them out one by one:
+    for i, df_part in enumerate(partition.iter_pivot_partitions("data/sdoh.csv", ...)):
+        df_part.to_pickle(f"data/pivoted_{i}.pkl")
+
+Or run the module from the command line:
+    python partition.py data/sdoh.csv data/df_sdoh_pivoted.pkl
+    --keep_columns "LocationName" "Measure" "Data_Value" "TotalPopulation"
+    --rename_columns_old "LocationName" --rename_columns_new "ZIP"
+    --index_col "ZIP" "TotalPopulation" --columns_col "Measure" --values_col "Data_Value"
+    --max_memory_mb 1024 --temp_dir /scratch --n_workers 4
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import logging
+import math
+import os
+import pickle
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+import cleaner
+from loader import iter_csv_chunks
+from profiling import quiet_logging
+
+logger = logging.getLogger(__name__)
+
+# Rows read to estimate the in-memory and on-disk size of a row
+SAMPLE_ROWS = 10000
+# A pivot holds its input, the factorized keys and the output at once
+PIVOT_OVERHEAD = 4
+
+
+# Define functions
+def _estimate_rows(file_path: str, usecols: list) -> tuple:
+    """
+    Estimates the number of rows of a CSV file and the in-memory bytes per row of the
+    columns that are read, from a sample at the top of the file.
+    """
+    sample = pd.read_csv(file_path, usecols=usecols, nrows=SAMPLE_ROWS)
+    if sample.empty:
+        return 0, 1.0
+    row_bytes = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+
+    with open(file_path, "rb") as f:
+        f.readline()
+        lines = [line for _, line in zip(range(len(sample)), f)]
+    line_bytes = sum(len(line) for line in lines) / max(len(lines), 1)
+    n_rows = math.ceil(os.path.getsize(file_path) / max(line_bytes, 1))
+    return n_rows, float(row_bytes)
+
+
+def _partition_codes(df: pd.DataFrame, index_col: list, n_partitions: int):
+    """
+    Returns the partition of each row, from a hash of its index key.
+
+    The key columns are normalized first, so that a key hashes the same way whether a
+    chunk parsed it as an integer or a float.
+    """
+    key = pd.DataFrame(
+        {
+            col: (
+                df[col].astype(np.float64)
+                if pd.api.types.is_numeric_dtype(df[col])
+                else df[col].astype(str)
+            )
+            for col in index_col
+        }
+    )
+    hashes = pd.util.hash_pandas_object(key, index=False).to_numpy()
+    return hashes % np.uint64(n_partitions)
+
+
+def _spill(
+    file_path: str,
+    keep_columns: list,
+    rename_columns: dict,
+    index_col: list,
+    n_partitions: int,
+    chunksize: int,
+    spill_dir: str,
+) -> list:
+    """
+    Streams the CSV file and appends each cleaned chunk's rows to the spill file of their
+    partition. Returns the paths of the non-empty spill files.
+    """
+    paths = [os.path.join(spill_dir, f"part-{i:05d}.pkl") for i in range(n_partitions)]
+    spilled = set()
+    n_chunks = 0
+    for chunk in iter_csv_chunks(file_path, keep_columns, None, chunksize):
+        chunk = cleaner.rename_columns(
+            cleaner.keep_columns(chunk, keep_columns), rename_columns
+        )
+        codes = _partition_codes(chunk, index_col, n_partitions)
+        for part in np.unique(codes):
+            # Append and close right away, so many partitions do not exhaust the open
+            # file limit
+            with open(paths[part], "ab") as f:
+                pickle.dump(chunk[codes == part], f, protocol=pickle.HIGHEST_PROTOCOL)
+            spilled.add(part)
+        n_chunks += 1
+    logger.debug("Spilled %d chunks into %d partitions", n_chunks, len(spilled))
+    return [paths[part] for part in sorted(spilled)]
+
+
+def _pivot_partition(spill_path: str, pivot_options: dict) -> pd.DataFrame:
+    """
+    Worker task: reads one spill file back and pivots it.
+    """
+    frames = []
+    with open(spill_path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                break
+    os.remove(spill_path)
+    # cleaner would log once per partition; the whole file is logged once instead
+    with quiet_logging("cleaner"):
+        return cleaner.pivot(pd.concat(frames, ignore_index=True), **pivot_options)
+
+
+def iter_pivot_partitions(
+    file_path: str,
+    keep_columns: list,
+    rename_columns: dict,
+    index_col: list,
+    columns_col: list,
+    values_col: list,
+    engine: str = "pandas",
+    aggfunc: str = "first",
+    max_memory_mb: int = 1024,
+    temp_dir: str = None,
+    n_partitions: int = None,
+    n_workers: int = 1,
+    chunksize: int = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Pivots a CSV file partition by partition and yields each pivoted partition.
+
+    Every index key is in exactly one partition, and each partition is sorted, but the
+    partitions are not in key order.
+
+    Parameters:
+    - file_path (str): The path to the CSV file.
+    - keep_columns (list): The columns to read and keep.
+    - rename_columns (dict): The columns to rename.
+    - index_col (list): The column(s) to be used as the index for the pivoted DataFrame.
+    - columns_col (list): The column(s) to be used as the columns for the pivoted DataFrame.
+    - values_col (list): The column(s) to be used as the values for the pivoted DataFrame.
+    - engine (str, optional): The cleaner.pivot engine, "pandas" or "numpy".
+        Default is "pandas".
+    - aggfunc (str, optional): How the numpy engine combines duplicates. Default is "first".
+    - max_memory_mb (int, optional): The memory ceiling for the chunks being read and the
+        partitions being pivoted at the same time. Default is 1024.
+    - temp_dir (str, optional): The directory for the spill files. Default is None (the
+        system temporary directory).
+    - n_partitions (int, optional): The number of partitions. Default is None (enough for
+        n_workers partitions to be pivoted within max_memory_mb).
+    - n_workers (int, optional): The number of worker processes pivoting partitions.
+        Default is 1 (pivot in this process).
+    - chunksize (int, optional): The number of rows to read at a time. Default is None
+        (a quarter of max_memory_mb per chunk).
+
+    Yields:
+    - pd.DataFrame: The next pivoted partition.
+    """
+    n_rows, row_bytes = _estimate_rows(file_path, keep_columns)
+    budget = max_memory_mb * 2**20 / PIVOT_OVERHEAD
+    if chunksize is None:
+        chunksize = max(int(budget / row_bytes), 1000)
+    if n_partitions is None:
+        n_partitions = max(math.ceil(n_rows * row_bytes * n_workers / budget), 1)
+    logger.info(
+        "Pivoting about %d rows in %d partitions of %d-row chunks",
+        n_rows,
+        n_partitions,
+        chunksize,
+    )
+
+    pivot_options = {
+        "index_col": index_col,
+        "columns_col": columns_col,
+        "values_col": values_col,
+        "engine": engine,
+        "aggfunc": aggfunc,
+    }
+    with tempfile.TemporaryDirectory(prefix="pivot-", dir=temp_dir) as spill_dir:
+        # cleaner would log once per chunk; log once for the whole file instead
+        with quiet_logging("cleaner"):
+            spill_paths = _spill(
+                file_path,
+                keep_columns,
+                rename_columns,
+                index_col,
+                n_partitions,
+                chunksize,
+                spill_dir,
+            )
+        if n_workers > 1 and len(spill_paths) > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                # Keep at most n_workers partitions submitted or waiting to be
+                # consumed, so a slow caller does not let them pile up in memory
+                pending = deque()
+                for spill_path in spill_paths:
+                    pending.append(
+                        executor.submit(_pivot_partition, spill_path, pivot_options)
+                    )
+                    if len(pending) == n_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+        else:
+            for spill_path in spill_paths:
+                yield _pivot_partition(spill_path, pivot_options)
+
+
+def pivot_out_of_core(file_path: str, **options) -> pd.DataFrame:
+    """
+    Pivots a CSV file that may not fit in memory. The result matches cleaner.pivot on the
+    loaded, kept and renamed frame.
+
+    Parameters:
+    - file_path (str): The path to the CSV file.
+    - **options: The keyword arguments of iter_pivot_partitions.
+
+    Returns:
+    - pd.DataFrame: The pivoted DataFrame.
+    """
+    index_col = options["index_col"]
+    df = pd.concat(list(iter_pivot_partitions(file_path, **options)), ignore_index=True)
+    value_cols = sorted(col for col in df.columns if col not in index_col)
+    df = df[index_col + value_cols].sort_values(index_col, ignore_index=True)
+    logger.info("DataFrame pivoted successfully out of core")
+    return df
+
+
+# Add the following code to the bottom of the module to allow running it from the command line:
+if __name__ == "__main__":
+    import argparse
+
+    from choices import PIVOT_AGGFUNCS, PIVOT_ENGINES
+    from profiling import configure_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "sdoh_file",
+        help="CSV file path for Social Determinants of Health",
+    )
+    parser.add_argument(
+        "sdoh_pivoted_pickle_path",
+        help="Path where the pivoted Pickle file should be stored",
+    )
+    parser.add_argument(
+        "--keep_columns",
+        help="List of columns to keep in the DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--rename_columns_old",
+        help="List of old column names to be renamed in the DataFrame",
+        nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "--rename_columns_new",
+        help="List of corresponding new column names after renaming",
+        nargs="+",
+        default=[],
+    )
+    parser.add_argument(
+        "--index_col",
+        help="List of columns to be used as the index for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--columns_col",
+        help="List of columns to be used as the columns for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--values_col",
+        help="List of columns to be used as the values for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--pivot_engine",
+        help="Pivot engine for each partition: pandas or numpy",
+        choices=PIVOT_ENGINES,
+        default="pandas",
+    )
+    parser.add_argument(
+        "--pivot_aggfunc",
+        help="How the numpy pivot engine combines duplicate index/columns pairs",
+        choices=PIVOT_AGGFUNCS,
+        default="first",
+    )
+    parser.add_argument(
+        "--max_memory_mb",
+        help="Memory ceiling in megabytes for the chunks and partitions in memory",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--temp_dir",
+        help="Directory for the spill files (default: the system temporary directory)",
+    )
+    parser.add_argument(
+        "--n_partitions",
+        help="Number of partitions (default: derived from --max_memory_mb)",
+        type=int,
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes pivoting partitions",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows to read at a time (default: derived from --max_memory_mb)",
+        type=int,
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    # Pivot the CSV file partition by partition and save the result as a pickle file
+    df_sdoh_pivoted = pivot_out_of_core(
+        args.sdoh_file,
+        keep_columns=args.keep_columns,
+        rename_columns=dict(zip(args.rename_columns_old, args.rename_columns_new)),
+        index_col=args.index_col,
+        columns_col=args.columns_col,
+        values_col=args.values_col,
+        engine=args.pivot_engine,
+        aggfunc=args.pivot_aggfunc,
+        max_memory_mb=args.max_memory_mb,
+        temp_dir=args.temp_dir,
+        n_partitions=args.n_partitions,
+        n_workers=args.n_workers,
+        chunksize=args.chunksize,
+    )
+    df_sdoh_pivoted.to_pickle(args.sdoh_pivoted_pickle_path)
+    logger.info("Pivoted DataFrame saved successfully")
@@ -0,0 +1,365 @@
+"""
+This module provides a lazy pipeline that records the load, clean, pivot and correlation
+steps and optimizes them before anything runs.
+
+Building a Pipeline only records the steps. When it is run, the steps are turned into a
+plan:
+- Column projection is pushed into the CSV read: only the columns that a later step
+    needs are parsed, so keep_columns never copies a wider frame.
+- Renames are pushed into the read as well: the parsed columns are relabelled in place,
+    without copying the data.
+- No-op steps are dropped: a keep_columns that the read already satisfies, renames of a
+    column to itself, and consecutive renames are fused into one.
+
+The same plan runs eagerly (read the whole file, then pivot, like main.py) or streamed
+(read the file in chunks and pivot each chunk, so the long-format frame is never fully
+in memory). Streaming is fastest when the rows of one index key (e.g. one ZIP code) are
+contiguous in the file, as they are in the SDOH extract; a key that straddles a chunk
+boundary is carried over to the next chunk. Keys that appear in several chunks anyway
+(e.g. a file sorted by measure) are combined after the chunks are pivoted. The pandas
+engine has at most one value per key and measure, so the chunks are simply merged; the
+numpy engine combines them with its aggfunc ("mean" cannot be combined from partial
+pivots and raises).
+
+Usage:
+1. Import the module:
+    import pipeline
+
+2. Record the steps:
+    plan = (
+        pipeline.Pipeline("data/sdoh.csv")
+        .keep_columns(["LocationName", "Measure", "Data_Value", "TotalPopulation"])
+        .rename_columns({"LocationName": "ZIP"})
+        .pivot(["ZIP", "TotalPopulation"], ["Measure"], ["Data_Value"])
+    )
+
+3. Print the optimized plan:
+    print(plan.explain())
+
+4. Run it eagerly or streamed; add a correlation step to get the correlation matrix:
+    df_pivoted = plan.collect()
+    df_pivoted = plan.collect(stream=True, chunksize=100000)
+    correlation_matrix = plan.correlate(engine="numpy").collect()
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import logging
+
+import pandas as pd
+
+from analysis import correlation_matrix
+from cleaner import keep_columns, optimize_dtypes, pivot, rename_columns
+from loader import iter_csv_chunks
+from profiling import quiet_logging, StageProfiler
+
+logger = logging.getLogger(__name__)
+
+
+# Define classes
+class Pipeline:
+    """
+    A lazily evaluated chain of load, clean, pivot and correlation steps.
+
+    Each builder method returns a new Pipeline, so a partial pipeline can be reused.
+    """
+
+    def __init__(self, file_path: str, steps: tuple = ()):
+        self.file_path = file_path
+        self.steps = tuple(steps)
+
+    def _add(self, op: str, **params) -> "Pipeline":
+        if self.steps and self.steps[-1][0] == "correlate":
+            raise ValueError("No step can follow correlate")
+        return Pipeline(self.file_path, self.steps + ((op, params),))
+
+    def keep_columns(self, cols_to_keep: list) -> "Pipeline":
+        """
+        Records cleaner.keep_columns.
+        """
+        return self._add("keep_columns", columns=list(cols_to_keep))
+
+    def rename_columns(self, cols_to_rename: dict) -> "Pipeline":
+        """
+        Records cleaner.rename_columns.
+        """
+        return self._add("rename_columns", mapping=dict(cols_to_rename))
+
+    def optimize_dtypes(self) -> "Pipeline":
+        """
+        Records cleaner.optimize_dtypes.
+        """
+        return self._add("optimize_dtypes")
+
+    def pivot(
+        self,
+        index_col: list,
+        columns_col: list,
+        values_col: list,
+        engine: str = "pandas",
+        aggfunc: str = "first",
+    ) -> "Pipeline":
+        """
+        Records cleaner.pivot.
+        """
+        return self._add(
+            "pivot",
+            index_col=list(index_col),
+            columns_col=list(columns_col),
+            values_col=list(values_col),
+            engine=engine,
+            aggfunc=aggfunc,
+        )
+
+    def correlate(
+        self, engine: str = "pandas", method: str = "pearson", n_jobs: int = 1
+    ) -> "Pipeline":
+        """
+        Records analysis.correlation_matrix. It must be the last step.
+        """
+        return self._add("correlate", engine=engine, method=method, n_jobs=n_jobs)
+
+    def plan(self) -> list:
+        """
+        Returns the optimized plan.
+
+        The first node is always a "read" node with the columns to parse (usecols) and
+        the renames to apply to them. The remaining nodes are the steps that still do
+        work after projection and renames are pushed into the read.
+
+        Returns:
+        - list: (operation, parameters) tuples.
+        """
+        # Track each current column name back to its name in the file
+        source = None
+        renames = {}
+        needed = None
+        nodes = []
+
+        for op, params in self.steps:
+            if op in ("keep_columns", "rename_columns") and needed is not None:
+                # After the pivot, column steps work on the pivoted frame
+                nodes.append((op, params))
+            elif op == "keep_columns":
+                names = params["columns"]
+                if source is None:
+                    source = {name: renames.get(name, name) for name in names}
+                else:
+                    _check_columns(names, source)
+                    source = {name: source[name] for name in names}
+            elif op == "rename_columns":
+                # Renaming a column to itself is a no-op
+                mapping = {
+                    old: new for old, new in params["mapping"].items() if old != new
+                }
+                if source is None:
+                    # Before any projection, renames apply to the file's columns
+                    for old, new in mapping.items():
+                        renames[new] = renames.pop(old, old)
+                else:
+                    source = {
+                        mapping.get(name, name): src for name, src in source.items()
+                    }
+            else:
+                if op == "pivot":
+                    needed = (
+                        params["index_col"]
+                        + params["columns_col"]
+                        + params["values_col"]
+                    )
+                nodes.append((op, params))
+
+        # Only the columns the pivot uses (or the kept columns) are read
+        if needed is None and source is not None:
+            needed = list(source)
+        if source is None and needed is not None:
+            source = {name: renames.get(name, name) for name in needed}
+        if needed is not None:
+            _check_columns(needed, source)
+            source = {name: source[name] for name in needed}
+
+        read = {
+            "file_path": self.file_path,
+            "usecols": None if source is None else list(source.values()),
+            "rename": (
+                {src: name for name, src in source.items() if src != name}
+                if source is not None
+                else {src: name for name, src in renames.items()}
+            ),
+            "columns": None if source is None else list(source),
+        }
+        return [("read", read)] + nodes
+
+    def explain(self) -> str:
+        """
+        Returns the optimized plan as text, one node per line.
+
+        Returns:
+        - str: The plan.
+        """
+        lines = []
+        for i, (op, params) in enumerate(self.plan()):
+            details = ", ".join(
+                f"{key}={value!r}"
+                for key, value in params.items()
+                if value not in (None, {}) and key != "columns"
+            )
+            lines.append(f"{i}: {op}({details})")
+        return "\n".join(lines)
+
+    def collect(
+        self,
+        stream: bool = False,
+        chunksize: int = 100000,
+        profiler: StageProfiler = None,
+    ):
+        """
+        Runs the optimized plan.
+
+        Parameters:
+        - stream (bool, optional): Read the file in chunks and pivot each chunk. Needs a
+            pivot step. Default is False (read the whole file first).
+        - chunksize (int, optional): The number of rows per chunk when streaming.
+            Default is 100000.
+        - profiler (StageProfiler, optional): Records each plan node as a stage.
+            Default is None.
+
+        Returns:
+        - pd.DataFrame: The result of the last step.
+        """
+        profiler = profiler or StageProfiler(enabled=False)
+        nodes = self.plan()
+        read = nodes[0][1]
+        ops = [op for op, _ in nodes[1:]]
+
+        if not stream:
+            df = profiler.run("read", _read, read)
+            for op, params in nodes[1:]:
+                df = profiler.run(op, _apply, df, op, params)
+            return df
+
+        if "pivot" not in ops:
+            raise ValueError("A streamed pipeline needs a pivot step")
+        split = ops.index("pivot") + 2
+        per_chunk, after = nodes[1:split], nodes[split:]
+        df = profiler.run(
+            "stream_pivot", _stream_pivot, read, per_chunk, chunksize, per_chunk[-1][1]
+        )
+        for op, params in after:
+            df = profiler.run(op, _apply, df, op, params)
+        return df
+
+
+# Define functions
+def _check_columns(names: list, available: dict) -> None:
+    """
+    Raises a KeyError if a step refers to a column that an earlier step dropped.
+    """
+    missing = [name for name in names if name not in available]
+    if missing:
+        raise KeyError(f"Columns not found: {missing}")
+
+
+def _read(read: dict, chunksize: int = None):
+    """
+    Runs the read node: parses only the projected columns and relabels them in place.
+    """
+    if chunksize is None:
+        frames = [pd.read_csv(read["file_path"], usecols=read["usecols"])]
+    else:
+        frames = iter_csv_chunks(read["file_path"], read["usecols"], None, chunksize)
+
+    def relabel(df):
+        # Relabel the parsed columns in place; no data is copied
+        if read["rename"]:
+            df.columns = [read["rename"].get(col, col) for col in df.columns]
+        # usecols keeps the file's column order; select the requested order
+        if read["columns"] is not None and df.columns.tolist() != read["columns"]:
+            df = df[read["columns"]]
+        return df
+
+    if chunksize is None:
+        logger.info("Data loaded successfully")
+        return relabel(frames[0])
+    return (relabel(df) for df in frames)
+
+
+def _apply(df: pd.DataFrame, op: str, params: dict) -> pd.DataFrame:
+    """
+    Runs one plan node on a DataFrame.
+    """
+    if op == "keep_columns":
+        return keep_columns(df, params["columns"])
+    if op == "rename_columns":
+        return rename_columns(df, params["mapping"])
+    if op == "optimize_dtypes":
+        return optimize_dtypes(df)
+    if op == "pivot":
+        return pivot(df, **params)
+    if op == "correlate":
+        return correlation_matrix(df, **params)
+    raise ValueError(f"Unknown plan node: {op}")
+
+
+def _combine_keys(
+    df: pd.DataFrame, index_col: list, engine: str, aggfunc: str
+) -> pd.DataFrame:
+    """
+    Combines the rows of index keys that were pivoted in more than one chunk.
+    """
+    logger.warning(
+        "Index keys are not contiguous in the file; combining the pivoted chunks"
+    )
+    grouped = df.groupby(index_col, sort=True, dropna=False)
+    # The pandas engine ignores aggfunc: each key has at most one value per measure
+    if engine == "pandas" or aggfunc == "first":
+        return grouped.first().reset_index()
+    if aggfunc in ("sum", "count"):
+        return grouped.sum(min_count=1).reset_index()
+    raise ValueError(
+        f"aggfunc {aggfunc!r} cannot be combined across chunks; the rows of each index "
+        "key must be contiguous in the file, or use an eager or out-of-core pivot"
+    )
+
+
+def _stream_pivot(
+    read: dict, per_chunk: list, chunksize: int, pivot_params: dict
+) -> pd.DataFrame:
+    """
+    Reads the file in chunks, runs the steps up to the pivot on each chunk, and combines
+    the pivoted chunks, sorted like an eager pivot.
+    """
+    index_col = pivot_params["index_col"]
+    pivoted = []
+    carry = None
+
+    def run_chunk(chunk):
+        for op, params in per_chunk:
+            chunk = _apply(chunk, op, params)
+        pivoted.append(chunk)
+
+    # The per-chunk steps would log once per chunk; log once for the whole file instead
+    with quiet_logging("cleaner"):
+        for chunk in _read(read, chunksize):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            # Hold back the last index key: its rows may continue in the next chunk
+            last_key = chunk[index_col].iloc[-1]
+            tail = (chunk[index_col] == last_key).all(axis=1)
+            carry = chunk[tail]
+            if (~tail).any():
+                run_chunk(chunk[~tail])
+        if carry is not None and len(carry):
+            run_chunk(carry)
+    logger.info("DataFrame pivoted successfully in %d chunks", len(pivoted))
+
+    df = pd.concat(pivoted, ignore_index=True)
+    if df.duplicated(index_col).any():
+        df = _combine_keys(
+            df, index_col, pivot_params["engine"], pivot_params["aggfunc"]
+        )
+    value_cols = sorted(col for col in df.columns if col not in index_col)
+    df = df[index_col + value_cols]
+    return df.sort_values(index_col, ignore_index=True)
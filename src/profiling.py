@@ -0,0 +1,267 @@
+"""
+This module records where time and memory go in each stage of the pipeline.
+
+A StageProfiler wraps the stages (load, keep_columns, rename_columns, pivot, correlation,
+histogram, ...) and records for each one:
+- wall time and CPU time,
+- the peak memory traced by tracemalloc while the stage ran (numpy and pandas buffers
+    included) and the process peak resident set size,
+- the shape and memory usage of the input and output DataFrames.
+
+The report is a JSON document with one entry per stage, in the order the stages ran.
+A disabled profiler runs the stages without measuring anything.
+
+Classes:
+- StageProfiler: Records each stage's timings, memory and frame shapes.
+
+Functions:
+- describe_frame(obj): Returns the shape and memory usage of a DataFrame.
+- configure_logging(level): Sets up the levelled log output used by the command line tools.
+- quiet_logging(name, level): Drops a logger's records below a level inside a with block.
+
+Usage:
+1. Import the module:
+    import profiling
+
+2. Run each stage through the profiler:
+    profiler = profiling.StageProfiler()
+    df = profiler.run("load", loader.load_csv_file, "data/sdoh.csv")
+    df = profiler.run("keep_columns", cleaner.keep_columns, df, cols_to_keep)
+
+3. Save the report:
+    profiler.save("data/profile.json")
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+# Define functions
+def configure_logging(level: str = "INFO") -> None:
+    """
+    Sets up the levelled log output used by the command line tools.
+
+    Parameters:
+    - level (str, optional): The lowest level to show, e.g. "DEBUG", "INFO" or "WARNING".
+        Default is "INFO".
+
+    Returns:
+    - None
+    """
+    logging.basicConfig(level=level.upper(), format="%(message)s")
+
+
+@contextmanager
+def quiet_logging(name: str, level: str = "WARNING"):
+    """
+    Drops the records of a logger below a level inside a with block, e.g. to log once for
+    a whole file instead of once per chunk.
+
+    Only the records of the calling thread are dropped, and only until the block exits,
+    so other callers of the logger are not affected.
+
+    Parameters:
+    - name (str): The name of the logger, e.g. "cleaner".
+    - level (str, optional): The lowest level to keep. Default is "WARNING".
+
+    Returns:
+    - None
+    """
+    levelno = logging.getLevelName(level.upper())
+    thread = threading.get_ident()
+
+    def keep(record):
+        return record.levelno >= levelno or record.thread != thread
+
+    quieted = logging.getLogger(name)
+    quieted.addFilter(keep)
+    try:
+        yield
+    finally:
+        quieted.removeFilter(keep)
+
+
+def describe_frame(obj) -> dict:
+    """
+    Returns the shape and memory usage of a DataFrame or Series, or None for other objects.
+
+    Parameters:
+    - obj: The object to describe.
+
+    Returns:
+    - dict: {"shape": [...], "memory_mb": float}, or None.
+    """
+    if isinstance(obj, pd.DataFrame):
+        memory = obj.memory_usage(deep=True).sum()
+    elif isinstance(obj, pd.Series):
+        memory = obj.memory_usage(deep=True)
+    else:
+        return None
+    return {"shape": list(obj.shape), "memory_mb": round(memory / 2**20, 3)}
+
+
+def _max_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the process, where the platform reports it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(max_rss / (2**20 if sys.platform == "darwin" else 2**10), 3)
+
+
+# Define classes
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak memory and frame shapes for each pipeline stage.
+
+    Stages may be nested (e.g. a cached pivot that loads, cleans and pivots on a miss);
+    the peak memory of an outer stage includes its inner stages.
+    """
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._open = []
+
+    @contextmanager
+    def stage(self, name: str, input_frame=None):
+        """
+        Context manager that profiles the code in its block as one stage.
+
+        The yielded record is a dict; set record["output"] = describe_frame(result)
+        to report the output frame.
+
+        Parameters:
+        - name (str): The stage name.
+        - input_frame (pd.DataFrame, optional): The frame the stage reads. Default is None.
+
+        Yields:
+        - dict: The record of the stage.
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        record = {
+            "stage": name,
+            "depth": len(self._open),
+            "input": describe_frame(input_frame),
+            "output": None,
+        }
+        self.stages.append(record)
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The enclosing stage keeps the peak reached before this stage started
+            if self._open:
+                self._open[-1]["_peak"] = max(self._open[-1]["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_start"], record["_peak"] = current, current
+        self._open.append(record)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall, 6)
+            record["cpu_s"] = round(time.process_time() - cpu, 6)
+            self._open.pop()
+            if self.trace_memory:
+                peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+                record["peak_traced_mb"] = round(
+                    (peak - record.pop("_start")) / 2**20, 3
+                )
+                if self._open:
+                    self._open[-1]["_peak"] = max(self._open[-1]["_peak"], peak)
+                if started_tracing:
+                    tracemalloc.stop()
+            record["max_rss_mb"] = _max_rss_mb()
+            logger.debug(
+                "Stage %s finished in %.3fs (%.3fs CPU)",
+                name,
+                record["wall_s"],
+                record["cpu_s"],
+            )
+
+    def run(self, name: str, func: Callable, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) as one stage and returns its result.
+
+        The first DataFrame among the arguments is reported as the input frame and the
+        result as the output frame.
+
+        Parameters:
+        - name (str): The stage name.
+        - func (Callable): The stage function.
+        - *args, **kwargs: The arguments of func.
+
+        Returns:
+        - The result of func.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        frames = [
+            arg
+            for arg in (*args, *kwargs.values())
+            if isinstance(arg, (pd.DataFrame, pd.Series))
+        ]
+        with self.stage(name, frames[0] if frames else None) as record:
+            result = func(*args, **kwargs)
+            record["output"] = describe_frame(result)
+        return result
+
+    def report(self) -> dict:
+        """
+        Returns the profile as a JSON-serializable dict.
+
+        Returns:
+        - dict: {"stages": [...], "total_wall_s": float, "total_cpu_s": float}. Each
+            stage has a depth (0 for outermost stages); the totals only count depth 0.
+        """
+        stages = [record for record in self.stages if "wall_s" in record]
+        top_level = [record for record in stages if record["depth"] == 0]
+        return {
+            "stages": stages,
+            "total_wall_s": round(sum(r["wall_s"] for r in top_level), 6),
+            "total_cpu_s": round(sum(r["cpu_s"] for r in top_level), 6),
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Saves the profile as a JSON file, or prints it if path is "-".
+
+        Parameters:
+        - path (str): The path of the JSON file.
+
+        Returns:
+        - None
+        """
+        text = json.dumps(self.report(), indent=2)
+        if path == "-":
+            print(text)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        logger.info("Profile saved successfully at %s", path)
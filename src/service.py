@@ -0,0 +1,416 @@
+"""
+This module runs the analysis as a long-lived local HTTP service, so dashboards do not
+pay interpreter startup, imports, CSV parsing and pivoting on every request.
+
+Each dataset (a CSV file) is loaded, cleaned and pivoted once and kept in an LRU cache
+with a memory cap. Requests are served concurrently on an asyncio event loop; the
+CPU-bound work (loading, correlation, histograms) runs on a thread pool, where NumPy and
+pandas release the GIL and every worker shares the cached frames without copying them.
+Responses are kept in a second LRU cache, so repeated identical requests are answered
+without recomputing anything. A dataset is reloaded when its file changes.
+
+Endpoints (GET, parameters in the query string, JSON responses unless noted):
+- /load?file=<csv>: Loads a dataset and returns its shape and columns.
+- /correlation?file=<csv>[&measures=<a,b,...>][&method=pearson][&engine=numpy]:
+    The correlation matrix of the dataset, or of a subset of its measures, in pandas'
+    "split" JSON layout (columns, index, data).
+- /histogram?file=<csv>&columns=<a,b,...>[&bins=10][&format=png]: Histogram bin edges
+    and counts, or the histogram as a PNG image.
+- /stats: Cache sizes and hit/miss counts.
+
+Measures and columns are comma-separated; names that contain commas can be passed as
+repeated parameters instead (measures=a&measures=b).
+
+Usage:
+    python service.py --keep_columns "LocationName" "Measure" "Data_Value" "TotalPopulation"
+    --rename_columns_old "LocationName" --rename_columns_new "ZIP"
+    --index_col "ZIP" "TotalPopulation" --columns_col "Measure" --values_col "Data_Value"
+    [--host 127.0.0.1] [--port 8765] [--socket <path>] [--max_memory_mb 2048]
+    [--max_results 256] [--n_workers 4]
+
+    curl "http://127.0.0.1:8765/correlation?file=data/sdoh.csv&engine=numpy"
+
+With --socket, the service listens on a Unix domain socket instead of a TCP port:
+    curl --unix-socket /tmp/sdoh.sock "http://localhost/stats"
+
+Author: Anuvrat Chaturvedi
+Date: 2024-03-17
+"""
+
+# Import packages
+import asyncio
+import io
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from analysis import correlation_matrix
+from batch import load_and_pivot_file
+from cache import cache_key
+from visualization import _FigureTemplate, histogram_counts
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Server Error"}
+# Query parameters that hold comma-separated lists
+LIST_PARAMS = ("measures", "columns")
+
+
+# Define classes
+class DatasetCache:
+    """
+    LRU cache of pivoted DataFrames, bounded by their total memory usage.
+
+    The most recently loaded frame is always kept, even if it alone exceeds the cap.
+    """
+
+    def __init__(self, max_memory_mb: float = 2048):
+        self.max_bytes = max_memory_mb * 2**20
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> pd.DataFrame:
+        """
+        Returns the cached frame and marks it as recently used, or None on a miss.
+
+        Misses are counted by the caller, once per load, so requests that wait for a
+        load already in progress do not inflate them.
+        """
+        if key not in self.frames:
+            return None
+        self.hits += 1
+        self.frames.move_to_end(key)
+        return self.frames[key]
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """
+        Stores a frame and evicts the least recently used frames above the memory cap.
+        """
+        self.frames[key] = df
+        self.frames.move_to_end(key)
+        self.sizes[key] = int(df.memory_usage(deep=True).sum())
+        while len(self.frames) > 1 and self.memory_bytes > self.max_bytes:
+            evicted, _ = self.frames.popitem(last=False)
+            del self.sizes[evicted]
+            logger.info("Dataset evicted from the cache")
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+
+class ResultCache:
+    """
+    LRU cache of encoded responses, bounded by the number of entries.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class AnalysisService:
+    """
+    Serves correlation and histogram requests from cached, pivoted datasets.
+
+    Parameters:
+    - pivot_options (dict): Keyword arguments for batch.load_and_pivot_file (keep_columns,
+        rename_columns, index_col, columns_col, values_col, ...).
+    - max_memory_mb (float, optional): Memory cap of the dataset cache. Default is 2048.
+    - max_results (int, optional): Number of cached responses. Default is 256.
+    - n_workers (int, optional): Threads for the CPU-bound work. Default is None
+        (the ThreadPoolExecutor default).
+    """
+
+    def __init__(
+        self,
+        pivot_options: dict,
+        max_memory_mb: float = 2048,
+        max_results: int = 256,
+        n_workers: int = None,
+    ):
+        self.pivot_options = pivot_options
+        self.datasets = DatasetCache(max_memory_mb)
+        self.results = ResultCache(max_results)
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        # Concurrent requests for a dataset that is still loading wait for one load
+        self._loading = {}
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    def dataset_key(self, file_path: str) -> str:
+        """
+        Returns the cache key of a dataset, from the file's fingerprint and the pivot
+        options.
+        """
+        return cache_key(file_path, {"stage": "pivot", **self.pivot_options})
+
+    async def dataset(self, file_path: str) -> tuple:
+        """
+        Returns (key, pivoted DataFrame) for a CSV file, loading it at most once.
+        """
+        key = self.dataset_key(file_path)
+        df = self.datasets.get(key)
+        if df is not None:
+            return key, df
+        if key not in self._loading:
+            self.datasets.misses += 1
+            self._loading[key] = asyncio.ensure_future(
+                self._run(load_and_pivot_file, file_path, **self.pivot_options)
+            )
+        try:
+            df = await self._loading[key]
+        finally:
+            self._loading.pop(key, None)
+        if self.datasets.frames.get(key) is not df:
+            self.datasets.put(key, df)
+        return key, df
+
+    async def handle(self, target: str) -> tuple:
+        """
+        Answers one request.
+
+        Parameters:
+        - target (str): The request path and query string, e.g. "/stats".
+
+        Returns:
+        - tuple: (status code, content type, body bytes).
+        """
+        url = urlsplit(target)
+        params = {
+            name: (
+                [item for value in values for item in value.split(",")]
+                if name in LIST_PARAMS
+                else values
+            )
+            for name, values in parse_qs(url.query).items()
+        }
+        try:
+            if url.path == "/stats":
+                return 200, "application/json", self._json(self.stats())
+            if url.path not in ("/load", "/correlation", "/histogram"):
+                return 404, "application/json", self._json({"error": "Not found"})
+            if "file" not in params:
+                raise ValueError("Missing parameter: file")
+
+            # The dataset key fingerprints the file, so a cached response is answered
+            # without loading the dataset, even after it was evicted
+            key = self.dataset_key(params["file"][0])
+            result_key = (key, url.path, tuple(sorted(parse_qs(url.query).items())))
+            result_key = json.dumps(result_key)
+            cached = self.results.get(result_key)
+            if cached is not None:
+                return cached
+
+            _, df = await self.dataset(params["file"][0])
+            response = await self._run(self._compute, url.path, df, params)
+            self.results.put(result_key, response)
+            return response
+        except FileNotFoundError as error:
+            return 404, "application/json", self._json({"error": str(error)})
+        except (KeyError, ValueError) as error:
+            return 400, "application/json", self._json({"error": str(error)})
+        except Exception as error:
+            logger.exception("Request %s failed", target)
+            return 500, "application/json", self._json({"error": str(error)})
+
+    def _compute(self, path: str, df: pd.DataFrame, params: dict) -> tuple:
+        """
+        Runs the CPU-bound part of a request on a worker thread.
+        """
+        if path == "/load":
+            body = {"shape": list(df.shape), "columns": [str(c) for c in df.columns]}
+            return 200, "application/json", self._json(body)
+
+        if path == "/correlation":
+            measures = params.get("measures")
+            if measures is not None:
+                missing = [m for m in measures if m not in df.columns]
+                if missing:
+                    raise KeyError(f"Measures not found: {missing}")
+                df = df[measures]
+            corr = correlation_matrix(
+                df,
+                engine=params.get("engine", ["pandas"])[0],
+                method=params.get("method", ["pearson"])[0],
+            )
+            return 200, "application/json", corr.to_json(orient="split").encode()
+
+        columns = params.get("columns")
+        if not columns:
+            raise ValueError("Missing parameter: columns")
+        counts = histogram_counts(df, columns, bins=int(params.get("bins", [10])[0]))
+        if params.get("format", ["json"])[0] != "png":
+            return 200, "application/json", counts.to_json(orient="records").encode()
+
+        # Draw through the object-oriented API; pyplot is not thread-safe
+        template = _FigureTemplate(len(columns))
+        buffer = io.BytesIO()
+        try:
+            template.render(counts, f"SDOH Histogram (N={df.shape[0]})", buffer)
+        finally:
+            template.close()
+        return 200, "image/png", buffer.getvalue()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache sizes and hit/miss counts.
+        """
+        return {
+            "datasets": len(self.datasets.frames),
+            "dataset_memory_mb": round(self.datasets.memory_bytes / 2**20, 3),
+            "dataset_hits": self.datasets.hits,
+            "dataset_misses": self.datasets.misses,
+            "results": len(self.results.entries),
+            "result_hits": self.results.hits,
+            "result_misses": self.results.misses,
+        }
+
+    @staticmethod
+    def _json(body) -> bytes:
+        return json.dumps(body).encode()
+
+    async def handle_connection(self, reader, writer) -> None:
+        """
+        Reads one HTTP/1.1 request from a stream and writes the response.
+        """
+        try:
+            request_line = await reader.readline()
+            # Skip the headers; requests have no body
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+                status, content_type = 400, "application/json"
+                body = self._json({"error": "Only GET requests are supported"})
+            else:
+                status, content_type, body = await self.handle(parts[1])
+            header = (
+                f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(header.encode("latin-1"))
+            if parts and parts[0] != "HEAD":
+                writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, socket_path=None):
+        """
+        Starts listening on a TCP port, or on a Unix domain socket if socket_path is given.
+
+        Returns:
+        - asyncio.Server: The running server.
+        """
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=socket_path
+            )
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(
+            "Service listening on %s",
+            socket_path or ":".join(map(str, server.sockets[0].getsockname()[:2])),
+        )
+        return server
+
+
+# Run the service from the command line
+if __name__ == "__main__":
+    import argparse
+
+    from profiling import configure_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--keep_columns", help="List of columns to keep in the DataFrame", nargs="+"
+    )
+    parser.add_argument(
+        "--rename_columns_old",
+        help="List of old column names to be renamed in the DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--rename_columns_new",
+        help="List of corresponding new column names after renaming",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--index_col",
+        help="List of columns to be used as the index for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--columns_col",
+        help="List of columns to be used as the columns for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--values_col",
+        help="List of columns to be used as the values for the pivoted DataFrame",
+        nargs="+",
+    )
+    parser.add_argument("--host", help="Address to listen on", default="127.0.0.1")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=8765)
+    parser.add_argument("--socket", help="Unix domain socket to listen on instead")
+    parser.add_argument(
+        "--max_memory_mb",
+        help="Memory cap of the dataset cache",
+        type=float,
+        default=2048,
+    )
+    parser.add_argument(
+        "--max_results", help="Number of cached responses", type=int, default=256
+    )
+    parser.add_argument("--n_workers", help="Threads for the CPU-bound work", type=int)
+    args = parser.parse_args()
+    configure_logging()
+
+    service = AnalysisService(
+        {
+            "keep_columns": args.keep_columns,
+            "rename_columns": dict(
+                zip(args.rename_columns_old, args.rename_columns_new)
+            ),
+            "index_col": args.index_col,
+            "columns_col": args.columns_col,
+            "values_col": args.values_col,
+        },
+        max_memory_mb=args.max_memory_mb,
+        max_results=args.max_results,
+        n_workers=args.n_workers,
+    )
+
+    async def serve():
+        server = await service.start(args.host, args.port, args.socket)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
@@ -82,3 +82,1139 @@ def test_all_functions_in_project():
     plot_histogram(df, plot_columns, figure_path)
     assert os.path.exists(figure_path)
     os.remove(figure_path)
+
+
+def _write_sdoh_csv(path, n_zips=50, seed=0):
+    """
+    Write a small long-format CSV shaped like the SDOH ACS extract and return its path.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    measures = [
+        "Crowding among housing units",
+        "Persons of racial or ethnic minority status",
+        "Single-parent households",
+    ]
+    zips = np.arange(10000, 10000 + n_zips)
+    df = pd.DataFrame(
+        {
+            "Year": "2017-2021",
+            "LocationName": np.repeat(zips, len(measures)),
+            "Measure": np.tile(measures, n_zips),
+            "Data_Value": rng.uniform(0, 50, n_zips * len(measures)).round(1),
+            "TotalPopulation": np.repeat(
+                rng.integers(50, 100000, n_zips), len(measures)
+            ),
+            "Geolocation": "POINT (0 0)",
+        }
+    )
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def _cli_error(script, *args):
+    """
+    Run a command line tool that must reject its arguments and return its error message.
+    """
+    import subprocess
+    import sys
+
+    completed = subprocess.run(
+        [sys.executable, script, *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 2
+    return completed.stderr
+
+
+def test_load_csv_file_chunked(tmp_path):
+    """
+    Test that the streaming loader projects columns and matches a full read.
+    """
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    columns_to_keep = ["LocationName", "Measure", "Data_Value", "TotalPopulation"]
+
+    df_full = keep_columns(load_csv_file(sdoh_file), columns_to_keep)
+    df_chunked = load_csv_file(sdoh_file, usecols=columns_to_keep, chunksize=7)
+
+    assert df_chunked.columns.tolist() == columns_to_keep
+    assert df_chunked.equals(df_full)
+
+
+def test_load_csv_file_cache(tmp_path, monkeypatch):
+    """
+    Test that a cache hit returns the same frame without re-parsing the CSV.
+    """
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    cache_dir = str(tmp_path / "cache")
+    columns_to_keep = ["LocationName", "Measure", "Data_Value", "TotalPopulation"]
+
+    df_first = load_csv_file(sdoh_file, usecols=columns_to_keep, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Different loader options use a different cache entry
+    load_csv_file(sdoh_file, usecols=columns_to_keep[:2], cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # A cache hit must not parse the CSV again
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("The CSV file was parsed on a cache hit")
+
+    monkeypatch.setattr(pd, "read_csv", no_parsing)
+    df_second = load_csv_file(sdoh_file, usecols=columns_to_keep, cache_dir=cache_dir)
+    assert df_second.equals(df_first)
+
+
+def test_optimize_dtypes():
+    """
+    Test that dtype optimization shrinks memory without changing the pivot.
+    """
+    from cleaner import optimize_dtypes
+
+    df = pd.DataFrame(
+        {
+            "ZIP": ["48104", "48104", "48105", "48105"],
+            "Measure": ["a", "b", "a", "b"],
+            "Data_Value": [1.5, 2.5, 3.5, 4.5],
+            "TotalPopulation": [100, 100, 200, 200],
+        }
+    )
+    df_optimized = optimize_dtypes(df)
+
+    assert isinstance(df_optimized["Measure"].dtype, pd.CategoricalDtype)
+    assert df_optimized["TotalPopulation"].dtype == "int16"
+    assert df_optimized["Data_Value"].dtype == "float64"
+
+    args = (["ZIP", "TotalPopulation"], ["Measure"], ["Data_Value"])
+    expected = pivot(df, *args)
+    result = pivot(df_optimized, *args)
+    assert result[["a", "b"]].equals(expected[["a", "b"]])
+
+
+def test_pivot_numpy_engine(tmp_path):
+    """
+    Test that the numpy pivot engine matches the pandas engine and aggregates duplicates.
+    """
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    df = rename_columns(
+        load_csv_file(
+            sdoh_file,
+            usecols=["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        ),
+        {"LocationName": "ZIP"},
+    )
+    args = (["ZIP", "TotalPopulation"], ["Measure"], ["Data_Value"])
+    assert pivot(df, *args, engine="numpy").equals(pivot(df, *args))
+
+    df_dup = pd.concat([df, df.assign(Data_Value=df["Data_Value"] + 1)])
+    df_mean = pivot(df_dup, *args, engine="numpy", aggfunc="mean")
+    df_first = pivot(df_dup, *args, engine="numpy", aggfunc="first")
+    df_count = pivot(df_dup, *args, engine="numpy", aggfunc="count")
+    measure = "Single-parent households"
+    assert (df_mean[measure] - df_first[measure]).round(6).eq(0.5).all()
+    assert df_count[measure].eq(2).all()
+
+
+def test_correlation_matrix_numpy_engine():
+    """
+    Test that the numpy correlation engine matches DataFrame.corr with and without NaNs.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(200, 7)), columns=list("abcdefg"))
+    df["b"] += df["a"]
+    df["label"] = "x"
+
+    numeric = df.drop(columns="label")
+    result = correlation_matrix(df, engine="numpy")
+    assert np.allclose(result, numeric.corr(), atol=1e-10)
+
+    df_nan = df.mask(rng.random(df.shape) < 0.2)
+    numeric_nan = df_nan.drop(columns="label")
+    result = correlation_matrix(df_nan, engine="numpy", n_jobs=2, block_size=3)
+    assert np.allclose(result, numeric_nan.corr(), atol=1e-10, equal_nan=True)
+
+    result = correlation_matrix(df_nan, engine="numpy", dtype=np.float32)
+    assert np.allclose(result, numeric_nan.corr(), atol=1e-4, equal_nan=True)
+
+
+def test_correlation_matrix_rank_methods(monkeypatch):
+    """
+    Test the numpy Spearman and Kendall tau-b engines, including ties and NaNs.
+    """
+    import numpy as np
+    import sys
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.integers(0, 6, size=(120, 4)).astype(float))
+    df[1] += df[0]
+
+    result = correlation_matrix(df, engine="numpy", method="spearman")
+    assert np.allclose(result, df.corr(method="spearman"), atol=1e-10)
+
+    def kendall_tau_b(a, b):
+        keep = ~(np.isnan(a) | np.isnan(b))
+        a, b = a[keep], b[keep]
+        i, j = np.triu_indices(len(a), 1)
+        sign_a, sign_b = np.sign(a[i] - a[j]), np.sign(b[i] - b[j])
+        return (sign_a * sign_b).sum() / np.sqrt(
+            np.count_nonzero(sign_a) * np.count_nonzero(sign_b)
+        )
+
+    df_nan = df.mask(rng.random(df.shape) < 0.1)
+    result = correlation_matrix(df_nan, engine="numpy", method="kendall", n_jobs=2)
+    expected = [
+        [kendall_tau_b(df_nan[a].values, df_nan[b].values) for b in df_nan]
+        for a in df_nan
+    ]
+    assert np.allclose(result, expected, atol=1e-12)
+
+    # The pandas engine does not need scipy for Kendall either
+    monkeypatch.setitem(sys.modules, "scipy", None)
+    result = correlation_matrix(df_nan, method="kendall")
+    assert np.allclose(result, expected, atol=1e-12)
+
+
+def test_correlation_bootstrap():
+    """
+    Test that bootstrap intervals bracket the estimate and are reproducible across workers.
+    """
+    from analysis import correlation_bootstrap
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(300, 4)), columns=list("abcd"))
+    df["b"] += df["a"]
+    df = df.mask(rng.random(df.shape) < 0.05)
+
+    result = correlation_bootstrap(df, n_boot=200, seed=1, batch_memory_mb=1)
+    assert result.shape == (6, 7)
+    assert np.allclose(
+        result["estimate"],
+        [df[a].corr(df[b]) for a, b in zip(result["measure_1"], result["measure_2"])],
+    )
+    assert (result["lower"] <= result["estimate"]).all()
+    assert (result["estimate"] <= result["upper"]).all()
+    assert result.loc[0, "p_value"] < 1e-6
+
+    parallel = correlation_bootstrap(
+        df, n_boot=200, seed=1, n_jobs=3, batch_memory_mb=1
+    )
+    assert parallel.equals(result)
+
+    # Keeping only the tails of each batch gives the quantiles of all the resamples
+    import analysis
+
+    x = df.to_numpy()
+    present = ~np.isnan(x)
+    x = np.where(present, x - np.nanmean(x, axis=0), 0)
+    one_per_batch = correlation_bootstrap(df, n_boot=50, seed=1, batch_memory_mb=0)
+    boots = np.concatenate(
+        [
+            analysis._bootstrap_batch(x, present.astype(float), 1, child)
+            for child in np.random.SeedSequence(1).spawn(50)
+        ]
+    )
+    lower, upper = np.nanquantile(boots, [0.025, 0.975], axis=0)
+    i, j = np.triu_indices(4, 1)
+    assert np.allclose(one_per_batch["lower"], lower[i, j])
+    assert np.allclose(one_per_batch["upper"], upper[i, j])
+
+    # Without a path the command line tools would compute and discard the results
+    for script in ("main.py", "analysis.py"):
+        assert "--significance_path" in _cli_error(script, "--bootstrap", "10")
+        # The intervals are of the unweighted Pearson correlation only
+        for option in (["--weighted"], ["--corr_method", "spearman"]):
+            assert "pearson" in _cli_error(
+                script, "--bootstrap", "10", "--significance_path", "s.csv", *option
+            )
+
+
+def test_weighted_correlation_matrix():
+    """
+    Test that equal weights match DataFrame.corr and integer weights match replicated rows.
+    """
+    from analysis import weighted_correlation_matrix
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(200, 4)), columns=list("abcd"))
+    df["b"] += df["a"]
+    df = df.mask(rng.random(df.shape) < 0.1)
+
+    df["TotalPopulation"] = 5.0
+    result = weighted_correlation_matrix(df, block_size=2)
+    expected = df.drop(columns="TotalPopulation").corr()
+    assert np.allclose(result, expected, atol=1e-10, equal_nan=True)
+
+    df["TotalPopulation"] = rng.integers(1, 4, len(df)).astype(float)
+    replicated = df.loc[df.index.repeat(df["TotalPopulation"].astype(int))]
+    result = weighted_correlation_matrix(df)
+    expected = replicated.drop(columns="TotalPopulation").corr()
+    assert np.allclose(result, expected, atol=1e-10, equal_nan=True)
+
+
+def test_correlation_accumulator(tmp_path):
+    """
+    Test that chunked, merged and reloaded accumulators match DataFrame.corr.
+    """
+    from analysis import CorrelationAccumulator
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(500, 4)) * 10 + 1e4, columns=list("abcd"))
+    df["b"] += df["a"]
+    df = df.mask(rng.random(df.shape) < 0.1)
+
+    first = CorrelationAccumulator()
+    for start in range(0, 300, 100):
+        first.update(df.iloc[start : start + 100])
+    state_path = str(tmp_path / "state.npz")
+    first.save(state_path)
+
+    second = CorrelationAccumulator().update(df.iloc[300:])
+    result = CorrelationAccumulator.load(state_path).merge(second).finalize()
+    assert np.allclose(result, df.corr(), atol=1e-10)
+
+
+def test_run_batch(tmp_path):
+    """
+    Test that a batch over several files matches pivoting each file on its own.
+    """
+    from batch import expand_inputs, load_and_pivot_file, run_batch
+    import numpy as np
+
+    for seed in range(3):
+        _write_sdoh_csv(tmp_path / f"sdoh_{seed}.csv", seed=seed)
+    files = expand_inputs([str(tmp_path / "sdoh_*.csv")])
+    options = {
+        "keep_columns": ["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        "rename_columns": {"LocationName": "ZIP"},
+        "index_col": ["ZIP", "TotalPopulation"],
+        "columns_col": ["Measure"],
+        "values_col": ["Data_Value"],
+    }
+    expected = pd.concat(
+        [load_and_pivot_file(f, **options) for f in files], ignore_index=True
+    )
+
+    df_combined, _ = run_batch(files, options, n_workers=2)
+    assert df_combined.equals(expected)
+
+    output_dir = str(tmp_path / "batch")
+    _, accumulator = run_batch(files, options, n_workers=2, output_dir=output_dir)
+    assert len(os.listdir(output_dir)) == 2 * len(files)
+    assert np.allclose(accumulator.finalize(), expected.corr(), atol=1e-10)
+
+    # Files with the same name in different directories get distinct outputs
+    vintages = []
+    for year in ("2019", "2020"):
+        (tmp_path / year).mkdir()
+        vintages.append(_write_sdoh_csv(tmp_path / year / "sdoh.csv", seed=int(year)))
+    output_dir = str(tmp_path / "vintages")
+    run_batch(vintages, options, n_workers=1, output_dir=output_dir)
+    assert sorted(os.listdir(output_dir)) == [
+        f"{year}__sdoh_{output}"
+        for year in ("2019", "2020")
+        for output in ("correlation_matrix.csv", "pivoted.pkl")
+    ]
+
+    # The per-file outputs only combine unweighted Pearson statistics
+    for option in (
+        ["--weighted"],
+        ["--corr_method", "kendall"],
+        ["--corr_engine", "numpy"],
+    ):
+        assert "--batch_output_dir" in _cli_error(
+            "main.py", "--sdoh_files", *files, "--batch_output_dir", output_dir, *option
+        )
+
+
+def test_histogram_counts(tmp_path):
+    """
+    Test that the binning engine matches numpy.histogram and can be plotted.
+    """
+    from visualization import histogram_counts
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "a": rng.normal(size=500),
+            "b": rng.integers(0, 7, 500).astype(float),
+            "w": rng.random(500),
+        }
+    )
+    df.loc[::9, "a"] = np.nan
+
+    counts = histogram_counts(df, ["a", "b"], bins=8)
+    for col in ["a", "b"]:
+        expected, edges = np.histogram(df[col].dropna(), bins=8)
+        col_counts = counts[counts["column"] == col]
+        assert (col_counts["count"].to_numpy() == expected).all()
+        assert np.allclose(col_counts["left"], edges[:-1])
+
+    counts = histogram_counts(df, ["b"], bins=5, weights="w")
+    expected, _ = np.histogram(df["b"], bins=5, weights=df["w"])
+    assert np.allclose(counts["count"], expected)
+
+    figure_path = str(tmp_path / "histogram.png")
+    plot_histogram(df, ["a"], path=figure_path, engine="binned")
+    assert os.path.exists(figure_path)
+
+
+def test_sketches(tmp_path):
+    """
+    Test streaming histograms and KLL sketches against exact results, including merges.
+    """
+    from sketches import KLLSketch, StreamingHistogram, sketch_long_csv
+    from visualization import histogram_counts
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(size=100000)
+    edges = np.linspace(values.min(), values.max(), 11)
+
+    parts = [(StreamingHistogram(edges), KLLSketch(200, seed)) for seed in range(4)]
+    for (hist, sketch), chunk in zip(parts, np.split(values, 4)):
+        hist.update(chunk)
+        sketch.update(chunk)
+    hist, sketch = parts[0]
+    for other_hist, other_sketch in parts[1:]:
+        hist.merge(other_hist)
+        sketch.merge(other_sketch)
+
+    exact = histogram_counts(pd.DataFrame({"x": values}), ["x"], bins=10)
+    assert np.array_equal(hist.counts, exact["count"])
+
+    q = np.linspace(0.05, 0.95, 19)
+    true_rank = np.searchsorted(np.sort(values), sketch.quantile(q), "right") / len(
+        values
+    )
+    assert sketch.n == len(values)
+    assert np.abs(true_rank - q).max() < 0.02
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    histograms, quantiles = sketch_long_csv(
+        sdoh_file, "Measure", "Data_Value", np.linspace(0, 50, 6), chunksize=20
+    )
+    df = pd.read_csv(sdoh_file)
+    crowding = df.loc[df["Measure"] == "Crowding among housing units", "Data_Value"]
+    assert histograms["Crowding among housing units"].counts.sum() == len(crowding)
+    assert quantiles["Crowding among housing units"].n == len(crowding)
+
+
+def test_render_histogram_batch(tmp_path):
+    """
+    Test that batch rendering writes one figure per group and reports its throughput.
+    """
+    from visualization import histogram_jobs, render_histogram_batch
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "group": rng.integers(0, 4, 400),
+            "a": rng.normal(size=400),
+            "b": rng.random(400),
+        }
+    )
+    jobs = histogram_jobs(df, "group", ["a", "b"], str(tmp_path / "hist_{group}.png"))
+    throughput = render_histogram_batch(jobs, n_workers=2, jobs_per_task=1)
+
+    assert throughput > 0
+    assert sorted(os.listdir(tmp_path)) == [f"hist_{g}.png" for g in range(4)]
+    for g in range(4):
+        with open(tmp_path / f"hist_{g}.png", "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    # Plotting in a loop must not leave figures open in pyplot
+    import matplotlib.pyplot as plt
+
+    for engine in ("matplotlib", "binned"):
+        for i in range(3):
+            plot_histogram(
+                df, ["a", "b"], path=str(tmp_path / f"{engine}_{i}.png"), engine=engine
+            )
+            assert os.path.getsize(tmp_path / f"{engine}_{i}.png") > 0
+    assert plt.get_fignums() == []
+
+
+def test_correlation_heatmap(tmp_path):
+    """
+    Test that clustering groups correlated measures and the heatmap is saved.
+    """
+    from visualization import cluster_order, plot_correlation_heatmap
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(300, 2))
+    x = base[:, [0, 1, 0, 1, 0, 1]] + 0.3 * rng.normal(size=(300, 6))
+    corr = pd.DataFrame(x, columns=list("abcdef")).corr()
+    order = cluster_order(corr)
+
+    assert sorted(order) == list(range(6))
+    groups = [i % 2 for i in order]
+    assert groups in ([0, 0, 0, 1, 1, 1], [1, 1, 1, 0, 0, 0])
+
+    path = tmp_path / "heatmap.png"
+    plot_correlation_heatmap(corr, path=str(path), cluster=True, max_cells=4)
+    assert path.stat().st_size > 0
+
+
+def test_stage_profiler(tmp_path):
+    """
+    Test that the profiler records nested stages, frame shapes and a JSON report.
+    """
+    from profiling import quiet_logging, StageProfiler
+    import json
+    import logging
+    import numpy as np
+    import threading
+
+    profiler = StageProfiler()
+    df = pd.DataFrame({"a": np.arange(1000.0), "b": np.ones(1000)})
+    with profiler.stage("outer", df):
+        total = profiler.run("inner", lambda frame: frame * 2, df)
+        big = np.ones(2**20)
+    del big
+
+    path = tmp_path / "profile.json"
+    profiler.save(str(path))
+    report = json.loads(path.read_text())
+    outer, inner = report["stages"]
+
+    assert (outer["stage"], outer["depth"], inner["depth"]) == ("outer", 0, 1)
+    assert inner["input"]["shape"] == inner["output"]["shape"] == list(total.shape)
+    assert outer["peak_traced_mb"] >= 8 > inner["peak_traced_mb"]
+    assert report["total_wall_s"] == outer["wall_s"] >= inner["wall_s"]
+    assert StageProfiler(enabled=False).run("noop", len, df) == 1000
+
+    # quiet_logging drops the calling thread's records inside the block only
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    quieted = logging.getLogger("test_quiet_logging")
+    quieted.setLevel(logging.INFO)
+    quieted.addHandler(handler)
+    with quiet_logging("test_quiet_logging"):
+        quieted.info("dropped")
+        other = threading.Thread(target=quieted.info, args=("other thread",))
+        other.start()
+        other.join()
+        quieted.warning("kept")
+    quieted.info("after")
+    quieted.removeHandler(handler)
+    assert [record.getMessage() for record in records] == [
+        "other thread",
+        "kept",
+        "after",
+    ]
+
+
+def test_benchmark_suite(tmp_path):
+    """
+    Test the synthetic data generator and that every stage and engine is timed.
+    """
+    from benchmark import compare_benchmarks, generate_sdoh, run_benchmarks
+
+    df = generate_sdoh(1000, n_measures=4, nan_rate=0.1, seed=0)
+    assert df.shape[0] == 1000 and df["Measure"].nunique() == 4
+    assert 0.05 < df["Data_Value"].isna().mean() < 0.15
+
+    results = run_benchmarks(
+        [200], n_measures=4, work_dir=str(tmp_path), corr_methods=["pearson"]
+    )
+    engines = set(zip(results["stage"], results["engine"]))
+    assert {("pivot", "pandas"), ("pivot", "numpy")} <= engines
+    assert {("correlation_pearson", "numpy"), ("histogram", "binned")} <= engines
+    assert (results["wall_s"] >= 0).all() and results["rows_in"].max() == 200
+
+    slower = results.assign(wall_s=results["wall_s"] * 2 + 1)
+    assert len(compare_benchmarks(results, slower)) == len(results)
+    assert compare_benchmarks(results, results).empty
+
+
+def test_lazy_pipeline(tmp_path):
+    """
+    Test that the optimized plan reads only the needed columns and that eager and
+    streamed runs match the step-by-step pipeline.
+    """
+    from batch import load_and_pivot_file
+    from pipeline import Pipeline
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    columns_to_keep = ["LocationName", "Measure", "Data_Value", "TotalPopulation"]
+    lazy = (
+        Pipeline(sdoh_file)
+        .keep_columns(columns_to_keep)
+        .rename_columns({"LocationName": "ZIP", "Measure": "Measure"})
+        .pivot(["ZIP", "TotalPopulation"], ["Measure"], ["Data_Value"])
+    )
+    (read_op, read), (pivot_op, _) = lazy.plan()
+
+    assert (read_op, pivot_op) == ("read", "pivot")
+    assert sorted(read["usecols"]) == sorted(columns_to_keep)
+    assert read["rename"] == {"LocationName": "ZIP"}
+    assert "usecols" in lazy.explain()
+
+    expected = load_and_pivot_file(
+        sdoh_file,
+        columns_to_keep,
+        {"LocationName": "ZIP"},
+        ["ZIP", "TotalPopulation"],
+        ["Measure"],
+        ["Data_Value"],
+    )
+    pd.testing.assert_frame_equal(lazy.collect(), expected)
+    pd.testing.assert_frame_equal(lazy.collect(stream=True, chunksize=7), expected)
+    assert lazy.correlate().collect(stream=True, chunksize=7).shape == (5, 5)
+
+
+def test_stream_pivot_non_contiguous_keys(tmp_path):
+    """
+    Test that a streamed pivot combines index keys whose rows are spread over chunks.
+    """
+    from pipeline import Pipeline
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv", n_zips=10)
+    by_measure = tmp_path / "sdoh_by_measure.csv"
+    pd.read_csv(sdoh_file).sort_values("Measure", kind="stable").to_csv(
+        by_measure, index=False
+    )
+    lazy = (
+        Pipeline(str(by_measure))
+        .keep_columns(["LocationName", "Measure", "Data_Value", "TotalPopulation"])
+        .rename_columns({"LocationName": "ZIP"})
+        .pivot(["ZIP", "TotalPopulation"], ["Measure"], ["Data_Value"])
+    )
+
+    expected = lazy.collect()
+    assert len(expected) == 10
+    pd.testing.assert_frame_equal(lazy.collect(stream=True, chunksize=7), expected)
+
+    # The pandas engine ignores aggfunc, so only a numpy mean cannot be combined
+    for engine in ("pandas", "numpy"):
+        averaged = (
+            Pipeline(str(by_measure))
+            .keep_columns(["LocationName", "Measure", "Data_Value", "TotalPopulation"])
+            .rename_columns({"LocationName": "ZIP"})
+            .pivot(
+                ["ZIP", "TotalPopulation"],
+                ["Measure"],
+                ["Data_Value"],
+                engine=engine,
+                aggfunc="mean",
+            )
+        )
+        try:
+            streamed = averaged.collect(stream=True, chunksize=7)
+            assert (
+                engine == "pandas"
+            ), "a numpy mean over non-contiguous keys must raise"
+            pd.testing.assert_frame_equal(streamed, expected)
+        except ValueError:
+            assert engine == "numpy"
+
+
+def test_correlation_store(tmp_path):
+    """
+    Test that every binary format round-trips and supports memory-mapped lookups.
+    """
+    from correlation_store import (
+        CorrelationStore,
+        load_correlation_matrix,
+        save_correlation_matrix,
+    )
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    corr = pd.DataFrame(rng.normal(size=(100, 6)), columns=list("abcdef")).corr()
+    corr.iloc[1, 2] = corr.iloc[2, 1] = np.nan
+
+    formats = [("npy", "c.npy"), ("triu", "t.npy"), ("parquet", "c.parquet")]
+    # The format does not depend on the extension
+    formats += [
+        ("npy", "c.bin"),
+        ("triu", "t.corr"),
+        ("parquet", "p.bin"),
+        ("csv", "c.txt"),
+    ]
+    for fmt, name in formats:
+        path = str(tmp_path / name)
+        save_correlation_matrix(corr, path, fmt=fmt)
+        pd.testing.assert_frame_equal(load_correlation_matrix(path), corr)
+        if fmt == "csv":
+            continue
+        store = CorrelationStore(path)
+
+        assert store.fmt == fmt
+        assert store.pair("e", "b") == corr.loc["e", "b"]
+        assert np.isnan(store.pair("c", "b"))
+        pd.testing.assert_series_equal(store.row("d"), corr.loc["d"])
+
+
+def test_top_correlations(tmp_path):
+    """
+    Test that the streamed top-k queries match the full correlation matrix.
+    """
+    from analysis import top_correlation_pairs, top_correlation_partners
+    import numpy as np
+    import subprocess
+    import sys
+
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(200, 3)) @ rng.normal(size=(3, 40))
+    df = pd.DataFrame(
+        x + rng.normal(size=(200, 40)), columns=[f"m{i}" for i in range(40)]
+    )
+    df = df.mask(rng.random(df.shape) < 0.1)
+    full = df.corr()
+
+    pairs = top_correlation_pairs(df, n=15, block_size=7)
+    upper = full.where(np.triu(np.ones(full.shape, dtype=bool), k=1)).stack()
+    expected = upper.loc[upper.abs().sort_values(ascending=False).index[:15]]
+    assert list(zip(pairs["measure_1"], pairs["measure_2"])) == list(expected.index)
+    assert np.allclose(pairs["correlation"], expected)
+
+    partners = top_correlation_partners(df, n=4, measures=["m3"], block_size=7)
+    row = full.loc["m3"].drop("m3")
+    assert list(partners["partner"]) == list(row.abs().nlargest(4).index)
+    assert np.allclose(partners["correlation"], row[partners["partner"]])
+    assert list(partners["rank"]) == [1, 2, 3, 4]
+
+    strong = top_correlation_partners(df, n=40, threshold=0.9, block_size=7)
+    assert (strong["correlation"].abs() >= 0.9).all()
+    assert "--top_pairs_path" in _cli_error("analysis.py", "--top_pairs", "5")
+    assert "--top_partners_path" in _cli_error("analysis.py", "--top_partners", "5")
+    assert "pearson and spearman" in _cli_error(
+        "analysis.py",
+        "--top_pairs",
+        "5",
+        "--top_pairs_path",
+        "t.csv",
+        "--corr_method",
+        "kendall",
+    )
+
+    # Without --correlation_matrix_path the command line tool skips the full matrix
+    df.to_pickle(tmp_path / "pivoted.pkl")
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "analysis.py",
+            "--sdoh_pivoted_file",
+            str(tmp_path / "pivoted.pkl"),
+            "--top_pairs",
+            "15",
+            "--top_pairs_path",
+            str(tmp_path / "pairs.csv"),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    assert completed.returncode == 0, completed.stderr
+    assert "Correlation matrix" not in completed.stderr
+    assert pd.read_csv(tmp_path / "pairs.csv").shape == (15, 3)
+
+
+def test_analysis_service(tmp_path):
+    """
+    Test that the service answers concurrent requests over HTTP from its caches.
+    """
+    from service import AnalysisService
+    from urllib.parse import quote
+    import asyncio
+    import json
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    service = AnalysisService(
+        {
+            "keep_columns": [
+                "LocationName",
+                "Measure",
+                "Data_Value",
+                "TotalPopulation",
+            ],
+            "rename_columns": {"LocationName": "ZIP"},
+            "index_col": ["ZIP", "TotalPopulation"],
+            "columns_col": ["Measure"],
+            "values_col": ["Data_Value"],
+        },
+        n_workers=2,
+    )
+
+    async def get(port, target):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        header, body = response.split(b"\r\n\r\n", 1)
+        return int(header.split()[1]), body
+
+    async def run():
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        measures = quote("Crowding among housing units,Single-parent households")
+        async with server:
+            return await asyncio.gather(
+                get(port, f"/correlation?file={sdoh_file}"),
+                get(port, f"/correlation?file={sdoh_file}&measures={measures}"),
+                get(port, f"/histogram?file={sdoh_file}&columns={measures}&format=png"),
+                get(port, f"/correlation?file={tmp_path}/missing.csv"),
+            ) + [await get(port, f"/correlation?file={sdoh_file}")]
+
+    full, subset, png, missing, repeated = asyncio.run(run())
+
+    assert full[0] == subset[0] == png[0] == 200 and missing[0] == 404
+    assert len(json.loads(full[1])["columns"]) == 5
+    assert len(json.loads(subset[1])["data"]) == 2
+    assert png[1].startswith(b"\x89PNG")
+    assert repeated == full
+    stats = service.stats()
+    assert stats["datasets"] == 1 and stats["result_hits"] == 1
+    # The concurrent requests for the same file share one load, counted as one miss
+    assert stats["dataset_misses"] == 1
+
+    # A cached response is answered without reloading its evicted dataset
+    service.datasets.frames.clear()
+    service.datasets.sizes.clear()
+    assert asyncio.run(service.handle(f"/correlation?file={sdoh_file}"))[2] == full[1]
+    assert service.stats()["dataset_misses"] == 1
+
+    # Only measures and columns are split on commas, not the file path
+    comma_file = _write_sdoh_csv(tmp_path / "sdoh,2021.csv")
+    status, _, body = asyncio.run(service.handle(f"/load?file={quote(comma_file)}"))
+    service.executor.shutdown()
+    assert status == 200 and json.loads(body)["shape"][1] == 5
+
+
+def test_cli_import_budget():
+    """
+    Test that the CLI parses without importing pandas or matplotlib, within an import
+    time budget.
+    """
+    import subprocess
+    import sys
+
+    # Each check runs in a fresh interpreter so earlier imports do not hide a regression
+    def run(code):
+        return subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    result = run(
+        "import sys, cli; cli.build_parser()\n"
+        "assert 'pandas' not in sys.modules and 'matplotlib' not in sys.modules"
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines()[1:]:
+        _, us, name = line.split("|")
+        cumulative[name.strip()] = int(us)
+    # A generous budget: the standard library modules cli needs take a few milliseconds
+    assert cumulative["cli"] < 200000
+
+    run("import sys, visualization; assert 'matplotlib' not in sys.modules")
+
+    help_text = subprocess.run(
+        [sys.executable, "cli.py", "run", "--help"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert "--sdoh_file" in help_text
+
+
+def test_out_of_core_pivot(tmp_path, monkeypatch):
+    """
+    Test that the hash-partitioned pivot matches the in-memory pivot and cleans up its
+    spill files.
+    """
+    from batch import load_and_pivot_file
+    from concurrent.futures import ThreadPoolExecutor
+    from partition import iter_pivot_partitions, pivot_out_of_core
+    import logging
+    import partition
+    import resource
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    options = {
+        "keep_columns": ["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        "rename_columns": {"LocationName": "ZIP"},
+        "index_col": ["ZIP", "TotalPopulation"],
+        "columns_col": ["Measure"],
+        "values_col": ["Data_Value"],
+    }
+    expected = load_and_pivot_file(sdoh_file, **options)
+
+    for engine, n_workers in [("pandas", 1), ("numpy", 2)]:
+        df = pivot_out_of_core(
+            sdoh_file,
+            **options,
+            engine=engine,
+            temp_dir=str(spill_dir),
+            n_partitions=4,
+            n_workers=n_workers,
+            chunksize=7,
+        )
+        pd.testing.assert_frame_equal(df, expected)
+
+    partitions = list(
+        iter_pivot_partitions(sdoh_file, **options, n_partitions=4, chunksize=7)
+    )
+    assert 1 < len(partitions) <= 4
+    assert sum(len(part) for part in partitions) == len(expected)
+    assert list(spill_dir.iterdir()) == []
+
+    # More partitions than the open file limit
+    many_file = _write_sdoh_csv(tmp_path / "many.csv", n_zips=300)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (128, hard))
+    try:
+        df = pivot_out_of_core(many_file, **options, n_partitions=1000, chunksize=300)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(df) == 300
+
+    # Only about one partition per worker is pivoted ahead of the caller
+    submitted = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted.append(args[1])
+            return super().submit(*args, **kwargs)
+
+    monkeypatch.setattr(partition, "ProcessPoolExecutor", RecordingExecutor)
+    partitions = iter_pivot_partitions(
+        sdoh_file, **options, n_partitions=8, n_workers=2, chunksize=7
+    )
+    cleaner_logger = logging.getLogger("cleaner")
+    level = cleaner_logger.level
+    next(partitions)
+    assert len(submitted) == 2
+    # The cleaner logs are not muted while the caller holds a partition
+    record = cleaner_logger.makeRecord("cleaner", logging.INFO, "", 0, "", (), None)
+    assert cleaner_logger.level == level and cleaner_logger.filter(record)
+    assert len(list(partitions)) == len(submitted) - 1
+
+
+def test_grouped_correlation(tmp_path, monkeypatch):
+    """
+    Test that the grouped pass matches correlating each group separately.
+    """
+    from analysis import grouped_correlation, stack_grouped_correlation, zip_prefix
+    from batch import load_and_pivot_file
+    import analysis
+    import numpy as np
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv", n_zips=200)
+    df = load_and_pivot_file(
+        sdoh_file,
+        ["LocationName", "Measure", "Data_Value", "TotalPopulation"],
+        {"LocationName": "ZIP"},
+        ["ZIP", "TotalPopulation"],
+        ["Measure"],
+        ["Data_Value"],
+    )
+    df.iloc[::7, 3] = np.nan
+    key = zip_prefix(df["ZIP"], digits=4)
+
+    corr, groups, labels = grouped_correlation(df, key, n_jobs=2, max_cells=100)
+
+    assert corr.shape == (len(groups), len(labels), len(labels)) and len(groups) > 1
+    for i, group in enumerate(groups):
+        expected = df[key == group].corr()
+        np.testing.assert_allclose(corr[i], expected.to_numpy(), atol=1e-10)
+    stacked = stack_grouped_correlation(corr, groups, labels)
+    assert stacked.loc[groups[0]].shape == (len(labels), len(labels))
+    assert zip_prefix(pd.Series([501, 10001])).tolist() == ["005", "100"]
+
+    # With small groups and many measures the per-pair sums bound the batch size
+    batch_sizes = []
+    grouped_batch = analysis._grouped_batch
+
+    def recorded_batch(x, starts, sizes, batch, max_rows):
+        batch_sizes.append(len(batch))
+        return grouped_batch(x, starts, sizes, batch, max_rows)
+
+    monkeypatch.setattr(analysis, "_grouped_batch", recorded_batch)
+    rng = np.random.default_rng(0)
+    wide = pd.DataFrame(rng.normal(size=(400, 50)))
+    grouped_correlation(wide, np.repeat(np.arange(100), 4), max_cells=50 * 50 * 10)
+    assert max(batch_sizes) == 10
+    assert "--grouped_path" in _cli_error("analysis.py", "--group_by", "ZIP")
+    assert "pearson and spearman" in _cli_error(
+        "analysis.py",
+        "--group_by",
+        "ZIP",
+        "--grouped_path",
+        "g.csv",
+        "--corr_method",
+        "kendall",
+    )
+
+
+def test_result_cache_lru(tmp_path):
+    """
+    Test that the result cache counts hits and misses and evicts the least recently used
+    entries beyond its size limit.
+    """
+    from cache import cache_key, cache_stats, cached_frame, reset_cache_stats
+    import time
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    cache_dir = str(tmp_path / "cache")
+    frames = {
+        stage: pd.DataFrame({"value": range(i * 1000, (i + 1) * 1000)})
+        for i, stage in enumerate(["clean", "pivot", "correlation"])
+    }
+    keys = {stage: cache_key(sdoh_file, {"stage": stage}) for stage in frames}
+    reset_cache_stats()
+
+    def lookup(stage, max_size_mb=None):
+        return cached_frame(
+            cache_dir,
+            keys[stage],
+            lambda: frames[stage],
+            stage=stage,
+            max_size_mb=max_size_mb,
+        )
+
+    lookup("clean")
+    time.sleep(0.01)
+    lookup("pivot")
+    time.sleep(0.01)
+    # A hit makes "clean" the most recently used entry
+    pd.testing.assert_frame_equal(lookup("clean"), frames["clean"])
+    time.sleep(0.01)
+    entry_mb = cache_stats(cache_dir)["size_mb"] / 2
+    lookup("correlation", max_size_mb=entry_mb * 2.5)
+
+    stats = cache_stats(cache_dir)
+    assert stats["hits"] == 1 and stats["misses"] == 3 and stats["entries"] == 2
+    assert stats["stages"]["clean"] == {"hits": 1, "misses": 1}
+    # "pivot" was evicted; "clean" and "correlation" are still cached
+    lookup("clean")
+    lookup("pivot")
+    assert cache_stats()["stages"]["pivot"] == {"hits": 0, "misses": 2}
+
+
+def test_main_result_cache(tmp_path):
+    """
+    Test that main.py skips the cached stages on a re-run and recomputes with --no-cache.
+    """
+    import subprocess
+    import sys
+
+    sdoh_file = _write_sdoh_csv(tmp_path / "sdoh.csv")
+    cache_dir = str(tmp_path / "cache")
+
+    def run_main(name, *options):
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "main.py",
+                "--sdoh_file",
+                sdoh_file,
+                "--correlation_matrix_path",
+                str(tmp_path / f"{name}.csv"),
+                "--figure_path",
+                str(tmp_path / f"{name}.png"),
+                "--keep_columns",
+                "LocationName",
+                "Measure",
+                "Data_Value",
+                "TotalPopulation",
+                "--rename_columns_old",
+                "LocationName",
+                "--rename_columns_new",
+                "ZIP",
+                "--index_col",
+                "ZIP",
+                "TotalPopulation",
+                "--columns_col",
+                "Measure",
+                "--values_col",
+                "Data_Value",
+                "--plot_columns",
+                "Crowding among housing units",
+                *options,
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+        assert completed.returncode == 0, completed.stderr
+        return completed.stderr
+
+    log = run_main("first", "--cache_dir", cache_dir)
+    assert "Result cache: 0 hits, 3 misses" in log
+
+    # Another figure, chunk size or execution strategy gives the same frames: no stage runs
+    log = run_main("second", "--cache_dir", cache_dir, "--chunksize", "40", "--lazy")
+    assert "Result cache: 2 hits, 0 misses" in log
+    assert "DataFrame pivoted successfully" not in log
+    assert "Correlation matrix calculated successfully" not in log
+
+    log = run_main("third", "--cache_dir", cache_dir, "--no-cache")
+    assert "Result cache" not in log
+    assert "DataFrame pivoted successfully" in log
+    assert "Correlation matrix calculated successfully" in log
+
+    first = pd.read_csv(tmp_path / "first.csv")
+    for name in ("second", "third"):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / f"{name}.csv"), first)
+
+
+def test_handle_missing():
+    """
+    Test the coverage report, the coverage thresholds and each imputation strategy.
+    """
+    from cleaner import coverage_report, handle_missing
+    import numpy as np
+
+    df = pd.DataFrame(
+        {
+            "ZIP": [10001, 10002, 10003, 10010, 10011],
+            "TotalPopulation": [100.0, 100.0, 300.0, 0.0, 100.0],
+            "a": [1.0, np.nan, 3.0, 10.0, np.nan],
+            "b": [2.0, 4.0, np.nan, 8.0, 6.0],
+            "c": [np.nan, np.nan, np.nan, np.nan, 1.0],
+        }
+    )
+    index_col = ["ZIP", "TotalPopulation"]
+
+    coverage = coverage_report(df, ["a", "b", "c"])
+    assert coverage.loc["a", "a"] == 0.6 and coverage.loc["a", "b"] == 0.4
+
+    expected = {"median": 3.0, "weighted_mean": 2.5, "knn": 2.0}
+    for strategy, value in expected.items():
+        out, matrix, report = handle_missing(
+            df, index_col, strategy, min_column_coverage=0.5, k=2
+        )
+        assert list(out.columns) == ["ZIP", "TotalPopulation", "a", "b"]
+        assert matrix.shape == (5, 2) and not np.isnan(matrix).any()
+        assert matrix.flags["C_CONTIGUOUS"]
+        assert out.loc[1, "a"] == value
+        assert report.equals(coverage_report(df, ["a", "b", "c"]))
+
+    # A row without a weight is left out of the weighted mean instead of spoiling it
+    df.loc[0, "TotalPopulation"] = np.nan
+    out, matrix, _ = handle_missing(df, index_col, "weighted_mean")
+    assert not np.isnan(matrix[:, :2]).any()
+    assert out.loc[1, "a"] == 3.0 and out.loc[2, "b"] == 5.0
+
+    out, matrix, _ = handle_missing(df, index_col, min_row_coverage=0.5)
+    assert len(out) == 3 and np.isnan(matrix).sum() == 3
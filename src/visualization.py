@@ -4,6 +4,19 @@ This module provides functions for visualizing data using histograms.
 The main function in this module is `plot_histogram`, which plots a histogram 
 of the specified columns in a DataFrame.
 
+`histogram_counts` bins all the requested columns in one vectorized pass and returns the
+bin edges and counts as a DataFrame, and `plot_histogram_counts` draws those counts
+without handing the raw values to matplotlib. `plot_histogram(..., engine="binned")`
+combines the two. `plot_histogram_sketch` draws streaming histograms (see sketches.py)
+built from data that never has to be loaded in full.
+
+`plot_correlation_heatmap` draws a correlation matrix as a single raster image,
+optionally reordered by hierarchical clustering and downsampled for very large matrices.
+
+`render_histogram_batch` renders many figures (e.g. one per state or vintage, built with
+`histogram_jobs`) on a process pool with the headless Agg backend and reports the
+throughput in figures per second.
+
 Usage:
 1. Import the module:
     import visualization
@@ -24,6 +37,7 @@ Parameters:
 - title (str, optional): The title of the histogram. Default is "Histogram".
 - bins (int, optional): The number of bins to use for the histogram. Default is 10.
 - path (str, optional): The path to save the histogram as a figure. Default is "data/histogram.png".
+- engine (str, optional): "matplotlib" (axes.hist) or "binned" (histogram_counts). Default is "matplotlib".
 
 Returns:
 - None
@@ -31,6 +45,20 @@ Returns:
 Or run the module from the command line:
     python visualization.py --sdoh_pivoted_file <path_to_sdoh_file> 
     --figure_path <path_to_save_histogram> --plot_columns <columns_to_plot>
+    [--hist_engine {matplotlib,binned}] [--hist_counts_path <path_to_save_counts>]
+
+Or render one figure per group of a column ("{group}" in the path is replaced):
+    python visualization.py --sdoh_pivoted_file <path_to_sdoh_file>
+    --figure_path "output/histogram_{group}.png" --plot_columns <columns_to_plot>
+    --group_col <column> [--n_workers <n>]
+
+Or plot a saved correlation matrix as a heatmap:
+    python visualization.py --correlation_matrix_path <path_to_correlation_csv>
+    --heatmap_path <path_to_save_heatmap> [--heatmap_cluster]
+
+Or stream a long-format CSV file instead of loading the pivoted DataFrame:
+    python visualization.py --sdoh_file <path_to_csv> --figure_path <path_to_save_histogram>
+    --plot_columns <measures_to_plot> --hist_range <low> <high>
 
 Example:
     python visualization.py --sdoh_pivoted_file data/df_sdoh_pivoted.pkl 
@@ -44,17 +72,391 @@ Date: 2024-03-17
 """
 
 # Import packages
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+from choices import HISTOGRAM_ENGINES
+from sketches import sketch_long_csv, sketches_to_counts
+
+logger = logging.getLogger(__name__)
 
 
 # Define functions
+def histogram_counts(
+    df: pd.DataFrame,
+    columns: list,
+    bins: int = 10,
+    shared_edges: bool = False,
+    weights=None,
+) -> pd.DataFrame:
+    """
+    Bin the specified columns of the DataFrame in one vectorized pass.
+
+    Bin edges span each column's minimum to maximum, like numpy.histogram and
+    matplotlib's hist; with shared_edges, every column uses the overall minimum and
+    maximum. The last bin is closed on the right. Missing values are not counted.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing the data.
+    - columns (list): The list of names of the columns to bin.
+    - bins (int, optional): The number of bins per column. Default is 10.
+    - shared_edges (bool, optional): Use the same edges for all columns. Default is False.
+    - weights (str or array-like, optional): A column name or an array of row weights.
+        Default is None (each row counts 1).
+
+    Returns:
+    - pd.DataFrame: One row per column and bin with the columns column, bin, left,
+        right and count.
+    """
+    x = df[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    n_cols = x.shape[1]
+    if isinstance(weights, str):
+        weights = df[weights].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    # One row of edges per column
+    with np.errstate(all="ignore"):
+        lo, hi = np.nanmin(x, axis=0), np.nanmax(x, axis=0)
+    if shared_edges:
+        lo, hi = np.full(n_cols, np.nanmin(lo)), np.full(n_cols, np.nanmax(hi))
+    lo, hi = np.nan_to_num(lo), np.nan_to_num(hi)
+    # Like numpy.histogram, widen an empty range by 0.5 on each side
+    lo, hi = np.where(lo == hi, lo - 0.5, lo), np.where(lo == hi, hi + 0.5, hi)
+    edges = np.linspace(lo, hi, bins + 1, axis=1)
+
+    # Bin index of every value, corrected against the edges as numpy.histogram does
+    valid = ~np.isnan(x)
+    if weights is not None:
+        valid &= ~np.isnan(weights)[:, None]
+    with np.errstate(invalid="ignore"):
+        index = ((x - lo) / (hi - lo) * bins).astype(np.int64, copy=False)
+    index = np.clip(index, 0, bins - 1)
+    col = np.broadcast_to(np.arange(n_cols), x.shape)
+    index[valid & (x < edges[col, index])] -= 1
+    index[valid & (x >= edges[col, index + 1]) & (index != bins - 1)] += 1
+
+    flat = (col * bins + index)[valid]
+    row_weights = None
+    if weights is not None:
+        row_weights = np.broadcast_to(np.asarray(weights)[:, None], x.shape)[valid]
+    counts = np.bincount(flat, weights=row_weights, minlength=n_cols * bins)
+
+    return pd.DataFrame(
+        {
+            "column": np.repeat(columns, bins),
+            "bin": np.tile(np.arange(bins), n_cols),
+            "left": edges[:, :-1].ravel(),
+            "right": edges[:, 1:].ravel(),
+            "count": counts,
+        }
+    )
+
+
+def plot_histogram_counts(
+    counts: pd.DataFrame, title="Histogram", path: str = "data/histogram.png"
+) -> None:
+    """
+    Plot precomputed histogram counts (see histogram_counts) - one column per row.
+
+    Each histogram is drawn as a single filled step line, so no per-bar patches or copies
+    of the raw data are created.
+
+    Parameters:
+    - counts (pd.DataFrame): The output of histogram_counts.
+    - title (str, optional): The title of the histogram. Default is "Histogram".
+    - path (str, optional): The path to save the histogram as a figure.
+        Default is "data/histogram.png".
+
+    Returns:
+    - None
+    """
+    # A bare Figure on the Agg canvas avoids importing pyplot and its backends
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    columns = list(dict.fromkeys(counts["column"]))
+    fig = Figure(figsize=(10, len(columns) * 2))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(len(columns), 1, squeeze=False)
+    _draw_counts(fig, axes[:, 0], counts, title)
+    fig.savefig(path)
+    logger.info("Histogram saved successfully at %s", path)
+
+
+def _draw_counts(fig, axes, counts: pd.DataFrame, title: str) -> None:
+    """
+    Draw histogram counts on a column of axes, one histogram per axes.
+    """
+    for ax, (col, col_counts) in zip(axes, counts.groupby("column", sort=False)):
+        edges = np.append(col_counts["left"].to_numpy(), col_counts["right"].iloc[-1])
+        ax.stairs(col_counts["count"].to_numpy(), edges, fill=True)
+        ax.set_title(col)
+    fig.suptitle(title)
+    fig.tight_layout()
+
+
+class _FigureTemplate:
+    """
+    A reusable Agg figure with one axes per histogram row.
+
+    The figure is built once through the object-oriented API (no pyplot state) and its
+    axes are cleared and redrawn for every figure rendered with the same number of rows.
+    """
+
+    def __init__(self, n_rows: int):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure(figsize=(10, n_rows * 2))
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.subplots(n_rows, 1, squeeze=False)[:, 0]
+
+    def render(self, counts: pd.DataFrame, title: str, path: str) -> None:
+        for ax in self.axes:
+            ax.clear()
+        _draw_counts(self.figure, self.axes, counts, title)
+        self.figure.savefig(path)
+
+    def close(self) -> None:
+        self.figure.clear()
+        self.axes = None
+        self.figure = None
+
+
+def _render_jobs(jobs: list) -> int:
+    """
+    Worker task: render (counts, title, path) jobs, reusing one template per layout.
+    """
+    templates = {}
+    try:
+        for counts, title, path in jobs:
+            n_rows = counts["column"].nunique()
+            if n_rows not in templates:
+                templates[n_rows] = _FigureTemplate(n_rows)
+            templates[n_rows].render(counts, title, path)
+    finally:
+        for template in templates.values():
+            template.close()
+    return len(jobs)
+
+
+def render_histogram_batch(
+    jobs: list, n_workers: int = None, jobs_per_task: int = 16
+) -> float:
+    """
+    Render many histogram figures on a process pool with the headless Agg backend.
+
+    Figures are drawn through matplotlib's object-oriented Figure API without pyplot, so
+    no global figure state builds up. Each worker reuses one figure template per layout
+    and closes its figures when its task ends.
+
+    Parameters:
+    - jobs (list): (counts, title, path) tuples, where counts is the output of
+        histogram_counts (see histogram_jobs).
+    - n_workers (int, optional): Number of worker processes. Default is None (one per CPU).
+    - jobs_per_task (int, optional): Number of figures each worker task renders with
+        the same templates. Default is 16.
+
+    Returns:
+    - float: The throughput in figures per second.
+    """
+    start = time.perf_counter()
+    tasks = [jobs[i : i + jobs_per_task] for i in range(0, len(jobs), jobs_per_task)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        rendered = sum(executor.map(_render_jobs, tasks))
+    elapsed = time.perf_counter() - start
+
+    throughput = rendered / elapsed if elapsed > 0 else float("inf")
+    logger.info(
+        "%d histograms saved successfully in %.2fs (%.1f figures/sec)",
+        rendered,
+        elapsed,
+        throughput,
+    )
+    return throughput
+
+
+def histogram_jobs(
+    df: pd.DataFrame,
+    group_col: str,
+    columns: list,
+    path_template: str,
+    title="Histogram",
+    bins: int = 10,
+) -> list:
+    """
+    Build one histogram rendering job per group of the DataFrame.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame containing the data.
+    - group_col (str): The column to group by, e.g. a state or vintage column.
+    - columns (list): The list of names of the columns to plot.
+    - path_template (str): The figure path with a "{group}" placeholder.
+    - title (str, optional): The title prefix of each figure. Default is "Histogram".
+    - bins (int, optional): The number of bins to use for the histogram. Default is 10.
+
+    Returns:
+    - list: (counts, title, path) tuples for render_histogram_batch.
+    """
+    return [
+        (
+            histogram_counts(group, columns, bins),
+            f"{title} - {group_col} {key} (N={len(group)})",
+            path_template.format(group=key),
+        )
+        for key, group in df.groupby(group_col, sort=True)
+    ]
+
+
+def plot_histogram_sketch(
+    histograms: dict, title="Histogram", path: str = "data/histogram.png"
+) -> None:
+    """
+    Plot streaming histograms (see sketches.StreamingHistogram) - one per row.
+
+    Parameters:
+    - histograms (dict): Column name -> StreamingHistogram.
+    - title (str, optional): The title of the histogram. Default is "Histogram".
+    - path (str, optional): The path to save the histogram as a figure.
+        Default is "data/histogram.png".
+
+    Returns:
+    - None
+    """
+    plot_histogram_counts(sketches_to_counts(histograms), title, path)
+
+
+def cluster_order(corr: pd.DataFrame) -> list:
+    """
+    Order the measures of a correlation matrix by average-linkage hierarchical clustering.
+
+    The distance between two measures is 1 - |r|. Clusters are merged greedily, closest
+    pair first, and the order is the concatenated members of the final cluster, so
+    strongly correlated measures end up next to each other.
+
+    Parameters:
+    - corr (pd.DataFrame): A square correlation matrix.
+
+    Returns:
+    - list: The row positions in clustered order.
+    """
+    n = len(corr)
+    dist = 1 - np.abs(corr.to_numpy(dtype=np.float64, na_value=np.nan))
+    dist = np.nan_to_num(dist, nan=1.0)
+    np.fill_diagonal(dist, np.inf)
+    sizes = np.ones(n)
+    members = [[i] for i in range(n)]
+    # Each row's nearest neighbour, so a merge does not rescan the whole matrix
+    nearest = dist.argmin(axis=1)
+    nearest_dist = dist[np.arange(n), nearest]
+
+    for _ in range(n - 1):
+        i = int(nearest_dist.argmin())
+        j = int(nearest[i])
+        # Average linkage (Lance-Williams update) for the merged cluster i
+        merged = (sizes[i] * dist[i] + sizes[j] * dist[j]) / (sizes[i] + sizes[j])
+        merged[[i, j]] = np.inf
+        dist[i], dist[:, i] = merged, merged
+        dist[j], dist[:, j] = np.inf, np.inf
+        sizes[i] += sizes[j]
+        members[i] += members[j]
+        members[j] = []
+        nearest_dist[j] = np.inf
+
+        stale = np.flatnonzero((nearest == i) | (nearest == j))
+        stale = np.union1d(stale[np.isfinite(nearest_dist[stale])], [i])
+        nearest[stale] = dist[stale].argmin(axis=1)
+        nearest_dist[stale] = dist[stale, nearest[stale]]
+        closer = merged < nearest_dist
+        nearest[closer], nearest_dist[closer] = i, merged[closer]
+
+    return next(group for group in members if group) if n else []
+
+
+def _downsample(matrix: np.ndarray, max_cells: int) -> np.ndarray:
+    """
+    Average a square matrix over square tiles so it has at most max_cells rows.
+    """
+    factor = int(np.ceil(len(matrix) / max_cells))
+    if factor <= 1:
+        return matrix
+    size = int(np.ceil(len(matrix) / factor)) * factor
+    padded = np.full((size, size), np.nan)
+    padded[: len(matrix), : len(matrix)] = matrix
+    tiles = padded.reshape(size // factor, factor, size // factor, factor)
+    with np.errstate(invalid="ignore"):
+        return np.nanmean(tiles, axis=(1, 3))
+
+
+def plot_correlation_heatmap(
+    corr: pd.DataFrame,
+    path: str = "data/correlation_heatmap.png",
+    title="Correlation Matrix",
+    cluster: bool = False,
+    max_cells: int = 1000,
+    max_labels: int = 50,
+) -> None:
+    """
+    Plot a correlation matrix as a heatmap drawn as one raster image.
+
+    The whole matrix is a single imshow image rather than one artist per cell, so it
+    stays fast for hundreds to thousands of measures.
+
+    Parameters:
+    - corr (pd.DataFrame): A square correlation matrix, e.g. from analysis.correlation_matrix.
+    - path (str, optional): The path to save the heatmap as a figure.
+        Default is "data/correlation_heatmap.png".
+    - title (str, optional): The title of the heatmap. Default is "Correlation Matrix".
+    - cluster (bool, optional): Reorder rows and columns by hierarchical clustering
+        (see cluster_order). Default is False.
+    - max_cells (int, optional): Larger matrices are averaged over square tiles down to
+        this many rows and columns. Default is 1000.
+    - max_labels (int, optional): Measure names are shown only up to this many rows.
+        Default is 50.
+
+    Returns:
+    - None
+    """
+    if cluster:
+        order = cluster_order(corr)
+        corr = corr.iloc[order, order]
+    matrix = _downsample(corr.to_numpy(dtype=np.float64, na_value=np.nan), max_cells)
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    size = min(20, max(6, len(matrix) * 0.25))
+    fig = Figure(figsize=(size + 2, size))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    image = ax.imshow(
+        matrix, cmap="RdBu_r", vmin=-1, vmax=1, interpolation="nearest", aspect="equal"
+    )
+    fig.colorbar(image, ax=ax, shrink=0.8)
+
+    if len(matrix) == len(corr) and len(corr) <= max_labels:
+        ax.set_xticks(range(len(corr)), corr.columns, rotation=90, fontsize=8)
+        ax.set_yticks(range(len(corr)), corr.index, fontsize=8)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+    ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path)
+    fig.clear()
+    logger.info("Correlation heatmap saved successfully at %s", path)
+
+
 def plot_histogram(
     df: pd.DataFrame,
     columns: list,
     title="Histogram",
     bins: int = 10,
     path: str = "data/histogram.png",
+    engine: str = "matplotlib",
 ) -> None:
     """
     Plot a histogram of the specified columns in the DataFrame - one column per row.
@@ -66,6 +468,9 @@ def plot_histogram(
     - bins (int, optional): The number of bins to use for the histogram. Default is 10.
     - path (str, optional): The path to save the histogram as a figure.
         Default is "data/histogram.png".
+    - engine (str, optional): "matplotlib" passes the raw values to axes.hist. "binned"
+        bins all columns with histogram_counts first and draws only the counts.
+        Default is "matplotlib".
 
     Returns:
     - None
@@ -79,26 +484,55 @@ def plot_histogram(
         plot_histogram(data, columns_to_plot, title="My Histogram", bins=20,
             path="output/histogram.png")
     """
-    fig, axes = plt.subplots(len(columns), 1, figsize=(10, len(columns) * 2))
+    if engine not in HISTOGRAM_ENGINES:
+        raise ValueError(f"engine must be one of {HISTOGRAM_ENGINES}, got {engine!r}")
+
+    if engine == "binned":
+        plot_histogram_counts(histogram_counts(df, columns, bins), title, path)
+        return
+
+    # matplotlib is slow to import, so it is only imported once something is plotted.
+    # A bare Figure on the Agg canvas is not registered with pyplot, so it is freed
+    # once it goes out of scope instead of accumulating across calls.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, len(columns) * 2))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(len(columns), 1, squeeze=False)[:, 0]
 
     for i, col in enumerate(columns):
         axes[i].hist(df[col], bins=bins)
         axes[i].set_title(col)
 
     fig.suptitle(title)
-    plt.tight_layout()
-    plt.savefig(path)
-    print(f"\nHistogram saved successfully at {path}\n")
+    fig.tight_layout()
+    fig.savefig(path)
+    logger.info("Histogram saved successfully at %s", path)
 
 
 # Add the following code to the bottom of the module to allow running it from the command line:
 if __name__ == "__main__":
     import argparse
 
+    from correlation_store import load_correlation_matrix
+    from profiling import configure_logging
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--sdoh_pivoted_file", help="Path for cleaned up SDOH pickle file"
     )
+    parser.add_argument(
+        "--sdoh_file",
+        help="Long-format SDOH CSV file to stream instead of --sdoh_pivoted_file",
+    )
+    parser.add_argument(
+        "--hist_range",
+        help="Low and high bin edges for the streamed histograms of --sdoh_file",
+        nargs=2,
+        type=float,
+        default=[0.0, 100.0],
+    )
     parser.add_argument(
         "--figure_path",
         help="Path to save the histogram as a figure",
@@ -108,14 +542,84 @@ if __name__ == "__main__":
         help="List of columns in the DataFrame to plot the histogram for",
         nargs="+",
     )
+    parser.add_argument(
+        "--hist_engine",
+        help="Histogram engine: matplotlib (axes.hist) or binned (precomputed counts)",
+        choices=HISTOGRAM_ENGINES,
+        default="matplotlib",
+    )
+    parser.add_argument(
+        "--hist_counts_path",
+        help="Path to save the histogram bin edges and counts as a CSV file",
+    )
+    parser.add_argument(
+        "--group_col",
+        help="Render one figure per value of this column; use {group} in --figure_path",
+    )
+    parser.add_argument(
+        "--n_workers",
+        help="Number of worker processes for --group_col rendering",
+        type=int,
+    )
+    parser.add_argument(
+        "--correlation_matrix_path",
+        help="Correlation matrix file (from analysis.py, any format) to plot as a heatmap",
+    )
+    parser.add_argument(
+        "--heatmap_path",
+        help="Path to save the correlation heatmap as a figure",
+    )
+    parser.add_argument(
+        "--heatmap_cluster",
+        help="Reorder the heatmap by hierarchical clustering",
+        action="store_true",
+    )
     args = parser.parse_args()
+    configure_logging()
 
-    df_sdoh_pivoted = pd.read_pickle(args.sdoh_pivoted_file)
+    if args.correlation_matrix_path is not None:
+        df_correlation = load_correlation_matrix(args.correlation_matrix_path)
+        plot_correlation_heatmap(
+            df_correlation, path=args.heatmap_path, cluster=args.heatmap_cluster
+        )
+    elif args.sdoh_file is not None:
+        # Stream the long-format file chunk by chunk instead of loading it
+        histograms, _ = sketch_long_csv(
+            args.sdoh_file,
+            "Measure",
+            "Data_Value",
+            edges=np.linspace(*args.hist_range, 11),
+        )
+        plot_histogram_sketch(
+            {col: histograms[col] for col in args.plot_columns},
+            title="SDOH Histogram (streamed)",
+            path=args.figure_path,
+        )
+    elif args.group_col is not None:
+        df_sdoh_pivoted = pd.read_pickle(args.sdoh_pivoted_file)
+        render_histogram_batch(
+            histogram_jobs(
+                df_sdoh_pivoted,
+                args.group_col,
+                args.plot_columns,
+                args.figure_path,
+                title="SDOH Histogram",
+            ),
+            n_workers=args.n_workers,
+        )
+    else:
+        df_sdoh_pivoted = pd.read_pickle(args.sdoh_pivoted_file)
 
-    plot_histogram(
-        df=df_sdoh_pivoted,
-        columns=args.plot_columns,
-        title=f"SDOH Histogram (N={df_sdoh_pivoted.shape[0]})",
-        bins=10,
-        path=args.figure_path,
-    )
+        if args.hist_counts_path is not None:
+            histogram_counts(df_sdoh_pivoted, args.plot_columns, bins=10).to_csv(
+                args.hist_counts_path, index=False
+            )
+
+        plot_histogram(
+            df=df_sdoh_pivoted,
+            columns=args.plot_columns,
+            title=f"SDOH Histogram (N={df_sdoh_pivoted.shape[0]})",
+            bins=10,
+            path=args.figure_path,
+            engine=args.hist_engine,
+        )